@@ -0,0 +1,420 @@
+"""
+Async (ASGI) entry point serving the read-heavy and quiz routes of flaskr.
+
+The routes, request arguments and response bodies match the Flask app (categories, stats,
+question pages, add/delete/search, ranked search and quizzes), but every query runs on
+SQLAlchemy's asyncio engine, so one process can keep thousands of quiz players waiting on
+the database without holding a worker thread each. The mapped classes come from models.py.
+
+Serve it with an ASGI server from the backend folder:
+    uvicorn asgi:create_asgi_app --factory --workers 4
+"""
+import random
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.datastructures import MultiDict
+
+import migrations
+from migrations import question_hash
+from models import DB_PATH, Question, Category, CategoryRegistry, QUESTION_COLUMNS, format_rows, questions_version
+from flaskr import CATEGORIES_MAX_AGE
+from flaskr.adaptive_quiz import (
+    QuestionPools, POOL_CHANGES_LIMIT, target_difficulty, pick_adaptive_id, category_in_pools, pool_rows_selection,
+    pool_version_selection, pruned_version_selection, pool_changes_selection
+)
+from flaskr.compression import COMPRESS_MIN_BYTES
+from flaskr.duplicates import (
+    DUPLICATE_POLICY, NearDuplicateIndex, signature, sync_selection, duplicate_selection, best_duplicate,
+    duplicate_error, duplicate_policy
+)
+from flaskr.formats import RANKED_FIELDS, question_shape, shape_questions
+from flaskr.importer import question_values
+from flaskr.json_provider import fast_dumps
+from flaskr.pagination import QUESTIONS_PER_PAGE, check_cursor, page_selection, page_response, split_page
+from flaskr.quiz import quiz_selection, quiz_request, quiz_batch_size, quiz_sample
+from flaskr.stats import total_selection, counts_selection, format_stats
+from flaskr.search import (
+    InvertedIndex, POSTGRES_SEARCH, POSTGRES_COUNT, search_rows_to_questions, page_of_hits, rank_questions
+)
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+ERROR_MESSAGES = {
+    400: "Bad Request",
+    404: "resource not found",
+    405: "Method Not Allowed",
+    422: "Unprocessable Entity",
+}
+
+class FastJSONResponse(JSONResponse):
+    # orjson when it is installed, see flaskr/json_provider.py
+    def render(self, content):
+        return fast_dumps(content)
+
+def async_url(database_path):
+    url = make_url(database_path)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+def error(status):
+    # like the Flask error handlers: the error is in the body, the HTTP status stays 200
+    return FastJSONResponse({"success": False, "error": status, "message": ERROR_MESSAGES[status]})
+
+def query_args(request):
+    # the flaskr pagination helpers read werkzeug-style request.args
+    return SimpleNamespace(args=MultiDict(request.query_params.multi_items()))
+
+async def count(session, selection):
+    return await session.scalar(selection.with_only_columns(func.count(Question.id)).order_by(None))
+
+async def category_is_empty(session, category_id):
+    # category_id 0 is every category, as in flaskr/quiz.py
+    return await session.scalar(total_selection(None if category_id == 0 else category_id)) == 0
+
+def create_asgi_app(db_URI=DB_PATH):
+    engine = create_async_engine(async_url(db_URI))
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    category_registry = CategoryRegistry()
+    search_index = None if engine.dialect.name == "postgresql" else InvertedIndex()
+    question_pools = QuestionPools()
+    duplicates = NearDuplicateIndex()
+
+    # migrations are synchronous; run them once with a throwaway sync engine
+    sync_engine = create_engine(db_URI)
+    try:
+        migrations.upgrade(sync_engine)
+    finally:
+        sync_engine.dispose()
+
+    async def categories_snapshot(session):
+        snapshot = category_registry.fresh_snapshot()
+        if snapshot is None:
+            version = category_registry.version
+            selection = await session.execute(select(Category.id, Category.type).order_by(Category.id))
+            snapshot = category_registry.store(dict(selection.all()), version)
+        return snapshot
+
+    async def paginate(session, request, selection):
+        # (current_questions, next_cursor), see flaskr.pagination.paginate_questions
+        args = query_args(request).args
+        selection = page_selection(args, selection)
+        if selection is None:
+            return [], None
+        rows = (await session.execute(selection.with_only_columns(*QUESTION_COLUMNS))).all()
+        return split_page(args, format_rows(rows))
+
+    async def retrieve_categories(request):
+        async with Session() as session:
+            categories, etag, _ = await categories_snapshot(session)
+
+        headers = {"ETag": '"{}"'.format(etag), "Cache-Control": "public, max-age={}".format(CATEGORIES_MAX_AGE)}
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        return FastJSONResponse(
+            {"success": True, "categories": categories, "total_categories": len(categories)}, headers=headers
+        )
+
+    async def retrieve_questions(request):
+        try:
+            shape = question_shape(query_args(request).args)
+            check_cursor(query_args(request).args)
+        except ValueError:
+            return error(400)
+
+        try:
+            async with Session() as session:
+                selection = select(Question).order_by(Question.id)
+                current_questions, next_cursor = await paginate(session, request, selection)
+                if len(current_questions) == 0:
+                    return error(404)
+
+                categories, _, _ = await categories_snapshot(session)
+                return FastJSONResponse(page_response(query_args(request), next_cursor, {
+                    "questions": shape_questions(current_questions, shape),
+                    "total_questions": await session.scalar(total_selection()),
+                    "categories": categories,
+                    "current_category": "all"
+                }))
+        except ValueError:
+            return error(404)
+
+    async def delete_question(request):
+        question_id = request.path_params["question_id"]
+        async with Session() as session:
+            selected_question = await session.get(Question, question_id)
+            if selected_question is None:
+                return error(422)
+
+            await session.delete(selected_question)
+            await session.commit()
+            questions_version.bump()
+            if search_index is not None:
+                search_index.remove(question_id)
+
+            selection = select(Question).order_by(Question.id)
+            return FastJSONResponse({
+                "success": True,
+                "deleted_question": question_id,
+                "current_questions": (await paginate(session, request, selection))[0],
+                "total_questions": await session.scalar(total_selection())
+            })
+
+    async def find_duplicate(session, question):
+        # flaskr/duplicates.py, with the index caught up through the async session
+        question_signature = signature(question)
+        if question_signature is None:
+            return None
+        duplicates.load((await session.execute(sync_selection(duplicates))).all())
+        hash = question_hash(question)
+        candidates = duplicates.candidates(question_signature)
+        rows = (await session.execute(duplicate_selection(hash, candidates))).all()
+        return best_duplicate(duplicates, question, hash, candidates, rows)
+
+    async def add_new_question(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            return error(405)
+
+        async with Session() as session:
+            search = body.get("searchTerm", None)
+            if search is not None and not isinstance(search, str):
+                return error(400)
+            if search:
+                try:
+                    shape = question_shape(query_args(request).args)
+                    check_cursor(query_args(request).args)
+                except ValueError:
+                    return error(400)
+                selection = select(Question).order_by(Question.id).filter(
+                    Question.question.ilike("%{}%".format(search)))
+                current_questions, next_cursor = await paginate(session, request, selection)
+                return FastJSONResponse(page_response(query_args(request), next_cursor, {
+                    "success": True,
+                    "questions": shape_questions(current_questions, shape),
+                    "total_questions": await count(session, selection),
+                    "current_category": "all"
+                }))
+
+            values, message = question_values(body)
+            if message is not None:
+                return error(400)
+
+            try:
+                policy = duplicate_policy(query_args(request).args, DUPLICATE_POLICY)
+            except ValueError:
+                return error(400)
+            duplicate = await find_duplicate(session, values["question"])
+            if duplicate is not None and (duplicate["exact"] or policy == "reject"):
+                return FastJSONResponse(duplicate_error(duplicate))
+
+            try:
+                question = Question(**values)
+                session.add(question)
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                duplicate = await find_duplicate(session, values["question"])
+                return FastJSONResponse(duplicate_error(duplicate)) if duplicate else error(400)
+            except Exception:
+                return error(400)
+            questions_version.bump()
+
+            if search_index is not None:
+                search_index.add(question.id, question.question, question.answer)
+            response = {
+                "success": True,
+                "created_question_id": question.id,
+                "total_questions": await session.scalar(total_selection())
+            }
+            if duplicate is not None:
+                response["duplicate"] = duplicate
+            return FastJSONResponse(response)
+
+    async def search_questions(request):
+        if request.method == "POST":
+            try:
+                body = await request.json()
+            except ValueError:
+                body = {}
+            search_term = body.get("searchTerm", None) if isinstance(body, dict) else None
+        else:
+            search_term = request.query_params.get("q", None)
+        if not search_term or not isinstance(search_term, str):
+            return error(400)
+
+        try:
+            shape = question_shape(query_args(request).args, RANKED_FIELDS)
+        except ValueError:
+            return error(400)
+        page = query_args(request).args.get("page", 1, type=int)
+        if page < 1:
+            return error(404)
+
+        async with Session() as session:
+            if search_index is None:
+                offset = (page - 1) * QUESTIONS_PER_PAGE
+                rows = (await session.execute(
+                    POSTGRES_SEARCH, {"term": search_term, "limit": QUESTIONS_PER_PAGE, "offset": offset}
+                )).mappings().all()
+                if rows:
+                    total = rows[0]["total"]
+                elif offset:
+                    total = await session.scalar(POSTGRES_COUNT, {"term": search_term})
+                else:
+                    total = 0
+                current_questions = search_rows_to_questions(rows)
+            else:
+                if not search_index.built:
+                    rows = await session.execute(select(Question.id, Question.question, Question.answer))
+                    search_index.load(rows.all())
+                hits = search_index.search(search_term)
+                ranks = page_of_hits(hits, page)
+                rows = (await session.execute(select(*QUESTION_COLUMNS).filter(Question.id.in_(ranks)))).all()
+                current_questions, total = rank_questions(rows, ranks), len(hits)
+
+        return FastJSONResponse({
+            "success": True,
+            "questions": shape_questions(current_questions, shape),
+            "total_questions": total,
+            "search_term": search_term,
+            "current_category": "all"
+        })
+
+    async def retrieve_stats(request):
+        async with Session() as session:
+            categories, _, _ = await categories_snapshot(session)
+            rows = (await session.execute(counts_selection())).all()
+        return FastJSONResponse(format_stats(rows, categories))
+
+    async def questions_by_category(request):
+        category_id = request.path_params["category_id"]
+        try:
+            shape = question_shape(query_args(request).args)
+            check_cursor(query_args(request).args)
+        except ValueError:
+            return error(400)
+
+        try:
+            async with Session() as session:
+                selection = select(Question).order_by(Question.id).filter(Question.category == category_id)
+                current_questions, next_cursor = await paginate(session, request, selection)
+                return FastJSONResponse(page_response(query_args(request), next_cursor, {
+                    "success": True,
+                    "questions": shape_questions(current_questions, shape),
+                    "current_category": category_id,
+                    "total_questions": await session.scalar(total_selection(category_id))
+                }))
+        except ValueError:
+            return error(404)
+
+    async def get_quiz_questions(request):
+        try:
+            # a malformed body raises JSONDecodeError, a ValueError
+            body = await request.json()
+            quiz_category, previous_questions = quiz_request(body)
+            batch_size = quiz_batch_size(body)
+        except ValueError:
+            return error(400)
+        category_id = quiz_category.get("id")
+
+        if body.get("adaptive", False):
+            try:
+                if batch_size is not None:
+                    raise ValueError("count cannot be combined with adaptive")
+                category_id = int(category_id)
+                target = target_difficulty(body)
+            except (TypeError, ValueError):
+                return error(400)
+            return await adaptive_quiz_question(quiz_category, category_id, previous_questions, target)
+
+        async with Session() as session:
+            selection = quiz_selection(category_id, previous_questions, select(Question))
+
+            if batch_size is not None:
+                questions = format_rows((await session.execute(
+                    quiz_sample(selection.with_only_columns(*QUESTION_COLUMNS), batch_size))).all())
+                if len(questions) == 0 and await category_is_empty(session, category_id):
+                    return error(400)
+                return FastJSONResponse({
+                    "success": True,
+                    "questions": questions,
+                    "category": quiz_category
+                })
+
+            remaining = await count(session, selection)
+
+            if remaining == 0:
+                if await category_is_empty(session, category_id):
+                    return error(400)
+                return FastJSONResponse({"success": True})
+
+            question = await session.scalar(
+                selection.order_by(Question.id).offset(random.randrange(remaining)).limit(1))
+            return FastJSONResponse({"success": True, "question": question.format(), "category": quiz_category})
+
+    async def catch_up_pools(session):
+        # QuestionPools._catch_up through the async session, which only has the primary
+        bumped = questions_version.value
+        since = question_pools.behind(await session.scalar(pruned_version_selection()) or 0)
+        if since is not None:
+            changes = (await session.execute(pool_changes_selection(since))).all()
+            if len(changes) < POOL_CHANGES_LIMIT:
+                return question_pools.apply(changes, bumped)
+        version = await session.scalar(pool_version_selection()) or 0
+        return question_pools.load((await session.execute(pool_rows_selection())).all(), version, bumped)
+
+    async def adaptive_quiz_question(quiz_category, category_id, previous_questions, target):
+        # flaskr/adaptive_quiz.py, with the pools loaded through the async session
+        async with Session() as session:
+            played = list(previous_questions)
+            while True:
+                pools = question_pools.fresh()
+                if pools is None:
+                    pools = await catch_up_pools(session)
+
+                question_id, _ = pick_adaptive_id(pools, category_id, played, target)
+                if question_id is None:
+                    if not category_in_pools(pools, category_id):
+                        return error(400)
+                    return FastJSONResponse({"success": True, "target_difficulty": target})
+
+                question = await session.get(Question, question_id)
+                if question is not None:
+                    return FastJSONResponse({"success": True, "question": question.format(),
+                                             "category": quiz_category, "target_difficulty": target})
+                played.append(question_id)
+
+    async def http_error(request, exc):
+        return error(exc.status_code if exc.status_code in ERROR_MESSAGES else 404)
+
+    routes = [
+        Route("/categories", retrieve_categories),
+        Route("/questions", retrieve_questions, methods=["GET"]),
+        Route("/questions", add_new_question, methods=["POST"]),
+        Route("/questions/search", search_questions, methods=["GET", "POST"]),
+        Route("/questions/{question_id:int}", delete_question, methods=["DELETE"]),
+        Route("/stats", retrieve_stats),
+        Route("/categories/{category_id:int}/questions", questions_by_category),
+        Route("/quizzes", get_quiz_questions, methods=["POST"]),
+    ]
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    return Starlette(routes=routes, exception_handlers={HTTPException: http_error}, lifespan=lifespan,
+                     middleware=[Middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES)])
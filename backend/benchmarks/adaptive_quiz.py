@@ -0,0 +1,136 @@
+"""
+Simulation of adaptive quiz games.
+
+Seeds a synthetic bank (see benchmarks.load), then plays thousands of games concurrently
+through `POST /quizzes` with `"adaptive": true`. Every simulated player has a skill from
+1 to 5 and answers a question correctly with probability 1 / (1 + e^(difficulty - skill)),
+sending its recent answers back with each turn like the frontend would.
+
+The report has the pick latency percentiles and throughput, plus, per skill level, the
+mean difficulty over the second half of each game and the share of correct answers. With
+adaptation working, stronger players end up on harder questions and every level lands near
+the same accuracy.
+
+Run from the backend directory:
+    python -m benchmarks.adaptive_quiz --questions 100000 --games 2000 --concurrency 16 --output adaptive.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flaskr import create_app
+from benchmarks.load import HTTPClient, InProcessClient, git_commit, percentile, seed, vocabulary
+
+SKILLS = (1, 2, 3, 4, 5)
+
+
+def play(client, category_ids, skill, turns, rng):
+    """
+    play(client, category_ids, skill, turns, rng)
+        plays one game and returns (pick latencies, difficulties played, answers)
+    """
+    category_id = rng.choice([0] + category_ids)
+    previous_questions, answers, difficulties, latencies = [], [], [], []
+
+    for _ in range(turns):
+        body = {"quiz_category": {"type": "simulation", "id": category_id}, "adaptive": True,
+                "previous_questions": previous_questions, "recent_answers": answers[-5:]}
+        started = time.perf_counter()
+        status, data = client.request("POST", "/quizzes", body)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if status != 200 or not data or "question" not in data:
+            break
+
+        difficulty = data["question"]["difficulty"]
+        correct = rng.random() < 1 / (1 + math.exp(difficulty - skill))
+        previous_questions.append(data["question"]["id"])
+        answers.append(correct)
+        difficulties.append(difficulty)
+
+    return latencies, difficulties, answers
+
+
+def run(args):
+    path = None
+    database = args.database
+    if database is None:
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        database = "sqlite:///" + path
+
+    try:
+        app = create_app(database)
+        started = time.perf_counter()
+        category_ids, _, _ = seed(app, args.questions, vocabulary())
+        print("seeded {} questions in {:.1f}s".format(args.questions, time.perf_counter() - started), file=sys.stderr)
+        client = HTTPClient(args.url) if args.url else InProcessClient(app)
+
+        games = [(SKILLS[number % len(SKILLS)], random.Random(number)) for number in range(args.games)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(
+                lambda game: (game[0],) + play(client, category_ids, game[0], args.turns, game[1]), games))
+        wall_seconds = time.perf_counter() - started
+
+        latencies = sorted(latency for _, game_latencies, _, _ in results for latency in game_latencies)
+        by_skill = {}
+        for skill, _, difficulties, answers in results:
+            stats = by_skill.setdefault(skill, {"late_difficulties": [], "answers": []})
+            stats["late_difficulties"].extend(difficulties[len(difficulties) // 2:])
+            stats["answers"].extend(answers)
+
+        skills = {
+            str(skill): {
+                "mean_late_difficulty": round(statistics.mean(stats["late_difficulties"]), 3),
+                "accuracy": round(sum(stats["answers"]) / len(stats["answers"]), 3),
+            }
+            for skill, stats in sorted(by_skill.items()) if stats["answers"]
+        }
+        for skill, stats in skills.items():
+            print("skill {}: mean difficulty {mean_late_difficulty:>5}  accuracy {accuracy:>5}".format(
+                skill, **stats), file=sys.stderr)
+        print("{} picks, {:.1f} picks/s, p50 {} ms, p99 {} ms".format(
+            len(latencies), len(latencies) / wall_seconds, round(percentile(latencies, 0.5), 3),
+            round(percentile(latencies, 0.99), 3)), file=sys.stderr)
+
+        return {
+            "commit": git_commit(),
+            "config": {"questions": args.questions, "games": args.games, "turns": args.turns,
+                       "concurrency": args.concurrency, "target": args.url or "in-process"},
+            "picks": len(latencies),
+            "picks_per_second": round(len(latencies) / wall_seconds, 1),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "skills": skills,
+        }
+    finally:
+        if path is not None:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=None,
+                        help="SQLAlchemy URL of the database to seed, a throwaway SQLite file by default")
+    parser.add_argument("--url", default=None, help="base URL of a running server, in-process by default")
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=10, help="questions per game")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", default="-", help="file for the JSON report, stdout by default")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output == "-":
+        print(report)
+    else:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
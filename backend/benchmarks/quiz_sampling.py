@@ -0,0 +1,75 @@
+"""
+Benchmark for the /quizzes question picker.
+
+Seeds a throwaway SQLite database with a single large category and times POST /quizzes
+while previous_questions grows towards the size of the category. The per-request latency
+should stay flat up to the very last question.
+
+Run from the backend directory:
+    python -m benchmarks.quiz_sampling --questions 5000 --requests 50
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from flaskr import create_app
+from models import db, Question, Category
+
+
+def seed(app, total_questions, category_id=1):
+    with app.app_context():
+        db.session.add(Category(type="Science"))
+        db.session.commit()
+        db.session.execute(
+            Question.__table__.insert(),
+            [
+                {
+                    "question": "Synthetic question {}".format(i),
+                    "answer": "answer {}".format(i),
+                    "category": category_id,
+                    "difficulty": random.randint(1, 5),
+                }
+                for i in range(total_questions)
+            ],
+        )
+        db.session.commit()
+        return [row[0] for row in db.session.query(Question.id).order_by(Question.id)]
+
+
+def run(total_questions, requests_per_step):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        app = create_app("sqlite:///" + path)
+        ids = seed(app, total_questions)
+        client = app.test_client()
+
+        print("{:>10} {:>12} {:>12} {:>12}".format("played", "remaining", "p50 (ms)", "max (ms)"))
+        for fraction in (0.0, 0.5, 0.9, 0.99, 0.999):
+            played = min(int(total_questions * fraction), total_questions - 1)
+            body = {
+                "quiz_category": {"type": "Science", "id": 1},
+                "previous_questions": random.sample(ids, played),
+            }
+            timings = []
+            for _ in range(requests_per_step):
+                start = time.perf_counter()
+                response = client.post("/quizzes", json=body)
+                timings.append((time.perf_counter() - start) * 1000)
+                assert response.json["question"]["id"] not in body["previous_questions"]
+
+            print("{:>10} {:>12} {:>12.2f} {:>12.2f}".format(
+                played, total_questions - played, statistics.median(timings), max(timings)))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+    run(args.questions, args.requests)
@@ -0,0 +1,93 @@
+"""
+Microbenchmark for the question read path.
+
+Seeds a throwaway SQLite database and, for each row count, times two ways of turning a
+selection into a JSON response body:
+
+    orm      Question objects, Question.format() per row and jsonify with Flask's default
+             JSON provider
+    columns  QUESTION_COLUMNS selected as plain rows, format_rows() and the app's JSON
+             provider (orjson when it is installed)
+
+Run from the backend directory:
+    python -m benchmarks.serialization --rows 10 1000 100000 --repeat 5
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from flask.json.provider import DefaultJSONProvider
+
+from flaskr import create_app
+from models import db, Question, Category, QUESTION_COLUMNS, format_rows
+
+
+def seed(app, total_questions):
+    with app.app_context():
+        db.session.add(Category(type="Science"))
+        db.session.commit()
+        for start in range(0, total_questions, 10000):
+            db.session.execute(
+                Question.__table__.insert(),
+                [
+                    {
+                        "question": "Synthetic question {}".format(i),
+                        "answer": "answer {}".format(i),
+                        "category": 1,
+                        "difficulty": random.randint(1, 5),
+                    }
+                    for i in range(start, min(start + 10000, total_questions))
+                ],
+            )
+        db.session.commit()
+
+
+def orm_body(app, default_json, rows):
+    questions = Question.query.order_by(Question.id).limit(rows).all()
+    return default_json.response({"success": True, "questions": [question.format() for question in questions]}).get_data()
+
+
+def columns_body(app, default_json, rows):
+    selection = db.session.query(*QUESTION_COLUMNS).order_by(Question.id).limit(rows)
+    return app.json.response({"success": True, "questions": format_rows(selection)}).get_data()
+
+
+def timed(app, build, rows, repeat):
+    default_json = DefaultJSONProvider(app)
+    timings = []
+    for _ in range(repeat):
+        # a fresh session each round, so the identity map does not hand back cached objects
+        db.session.remove()
+        start = time.perf_counter()
+        build(app, default_json, rows)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run(row_counts, repeat):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        app = create_app("sqlite:///" + path)
+        seed(app, max(row_counts))
+
+        print("JSON provider: {}".format(type(app.json).__name__))
+        print("{:>10} {:>12} {:>14} {:>10}".format("rows", "orm (ms)", "columns (ms)", "speedup"))
+        with app.app_context():
+            for rows in row_counts:
+                orm = timed(app, orm_body, rows, repeat)
+                columns = timed(app, columns_body, rows, repeat)
+                print("{:>10} {:>12.2f} {:>14.2f} {:>9.1f}x".format(rows, orm, columns, orm / columns))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
@@ -0,0 +1,125 @@
+"""
+Startup time and memory of the preforking server.
+
+Seeds a synthetic bank into a throwaway SQLite file (see benchmarks.load), then starts
+gunicorn with gunicorn.conf.py twice, with and without preloading the app in the master,
+and waits for every worker to log that it is ready. For each run it reports the time until
+all workers were ready, every worker's own startup time, and its RSS and PSS (the
+proportional share of pages it shares with the master and the other workers, Linux only).
+
+Run from the backend directory:
+    python -m benchmarks.startup --questions 100000 --workers 4 --output startup.json
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from flaskr import create_app
+from benchmarks.load import git_commit, seed, vocabulary
+
+READY = re.compile(r"worker (\d+) ready in ([\d.]+)s")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def memory_kib(pid, field):
+    # a field of /proc/<pid>/smaps_rollup (Pss) or /proc/<pid>/status (VmRSS), in KiB
+    for name in ("smaps_rollup", "status"):
+        try:
+            with open("/proc/{}/{}".format(pid, name)) as stats:
+                for line in stats:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1])
+        except OSError:
+            continue
+    return None
+
+
+def start_server(database, workers, preload, timeout):
+    """
+    start_server(database, workers, preload, timeout)
+        starts gunicorn, waits for every worker and returns its measurements
+    """
+    env = dict(os.environ, DATABASE_URL=database, WEB_CONCURRENCY=str(workers),
+               PRELOAD_APP="true" if preload else "false", BIND="127.0.0.1:{}".format(free_port()),
+               # only startup is measured, no quiz is played
+               ALLOW_MEMORY_QUIZ_SESSIONS="true")
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+                              env=env, stderr=subprocess.PIPE, text=True)
+    ready = {}
+    try:
+        deadline = time.monotonic() + timeout
+        while len(ready) < workers and time.monotonic() < deadline:
+            line = server.stderr.readline()
+            if not line:
+                break
+            match = READY.search(line)
+            if match:
+                ready[int(match.group(1))] = float(match.group(2))
+        all_ready_seconds = time.perf_counter() - started
+        if len(ready) < workers:
+            raise RuntimeError("only {} of {} workers started".format(len(ready), workers))
+
+        return {
+            "preload": preload,
+            "all_workers_ready_seconds": round(all_ready_seconds, 3),
+            "master_rss_kib": memory_kib(server.pid, "VmRSS"),
+            "workers": [
+                {"pid": pid, "startup_seconds": seconds,
+                 "rss_kib": memory_kib(pid, "VmRSS"), "pss_kib": memory_kib(pid, "Pss")}
+                for pid, seconds in sorted(ready.items())
+            ],
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.communicate(timeout=30)
+
+
+def run(args):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        database = "sqlite:///" + path
+        seed(create_app(database), args.questions, vocabulary())
+
+        runs = [start_server(database, args.workers, preload, args.timeout) for preload in (True, False)]
+        for result in runs:
+            workers = result["workers"]
+            print("preload={!s:<5} all ready {:>7.3f}s  worker startup {:>7.3f}s  rss {:>8} KiB  pss {} KiB".format(
+                result["preload"], result["all_workers_ready_seconds"],
+                max(worker["startup_seconds"] for worker in workers),
+                max(worker["rss_kib"] or 0 for worker in workers),
+                max(worker["pss_kib"] or 0 for worker in workers)), file=sys.stderr)
+
+        return {"commit": git_commit(), "config": {"questions": args.questions, "workers": args.workers},
+                "runs": runs}
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=int, default=120, help="seconds to wait for the workers")
+    parser.add_argument("--output", default="-", help="file for the JSON report, stdout by default")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output == "-":
+        print(report)
+    else:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
@@ -1,28 +1,59 @@
-from flask import Flask, request, abort, jsonify
+import io
+import click
+from flask import Flask, Response, request, abort, jsonify, stream_with_context
 from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
-
-def paginate_questions(request, selection):
-    page = request.args.get("page", 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
-
-    return current_questions
+from sqlalchemy.exc import IntegrityError
+
+import migrations
+from metrics import render_metrics
+from models import db, setup_db, Question, category_registry
+from replicas import replica_reads
+from .pagination import check_cursor, paginate_questions, count_questions, page_response
+from .quiz import pick_quiz_question, pick_quiz_questions, quiz_request, quiz_batch_size, category_is_empty
+from .adaptive_quiz import setup_adaptive_quiz, target_difficulty, pick_adaptive_question, category_in_pools
+from .quiz_sessions import setup_quiz_sessions, session_length, shuffled_question_ids, next_session_question
+from .scores import setup_scores, score_row, leaderboard_category, leaderboard_limit, format_entry
+from .response_cache import setup_response_cache, cached_response
+from .json_provider import setup_json_provider
+from .stats import total_questions, question_stats
+from .instrumentation import setup_instrumentation, log_error
+from .rate_limit import setup_rate_limits
+from .search import setup_search, ranked_search
+from .duplicates import DUPLICATE_POLICIES, setup_duplicates, duplicate_policy, find_duplicate, duplicate_error, dedupe_questions
+from .importer import IMPORT_FORMATS, IMPORT_BATCH_SIZE, import_questions, question_values, text_stream, duplicate_message
+from .bulk import bulk_criteria, bulk_changes, delete_questions, update_questions
+from .formats import RANKED_FIELDS, question_shape, shape_questions, requested_fields
+from .compression import setup_compression
+from .changes import (QUESTION_CHANGES_KEEP, QUESTION_CHANGES_LIMIT, setup_changes, change_version, latest_version,
+                      pruned_version, changes_since, prune_changes, change_events)
+from .exporter import EXPORT_FORMATS, EXPORT_COLUMNS, EXPORT_MIMETYPES, export_filters, export_rows, export_chunks
+
+# seconds browsers and proxies may reuse a /categories response without revalidating
+CATEGORIES_MAX_AGE = 60
 
 def create_app(db_URI="", test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    if test_config:
+        # e.g. DB_POOL_SIZE / DB_MAX_OVERFLOW, applied before the engine is created
+        app.config.from_mapping(test_config)
     if db_URI:
         setup_db(app, db_URI)
     else:
         setup_db(app)
+    setup_search(app)
+    setup_duplicates(app)
+    setup_changes(app)
+    setup_instrumentation(app)
+    # after the instrumentation hooks, so rejected requests are timed and counted too
+    setup_rate_limits(app)
+    # after the instrumentation hooks, so the recorded response sizes are the compressed ones
+    setup_compression(app)
+    setup_quiz_sessions(app)
+    setup_adaptive_quiz(app)
+    setup_scores(app)
+    setup_response_cache(app)
+    setup_json_provider(app)
         
     """
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs == DONE
@@ -42,6 +73,21 @@ def create_app(db_URI="", test_config=None):
         )
         return response
     
+    @app.cli.command("upgrade-db")
+    def upgrade_db_command():
+        """Apply pending schema migrations, see migrations.py."""
+        for name in migrations.upgrade(db.engine):
+            click.echo("applied: {}".format(name))
+        click.echo("schema version {}".format(migrations.current_version(db.engine)))
+
+    """
+    Prometheus-style metrics: per-endpoint latency, SQL and response size from
+    flaskr/instrumentation.py and the connection pool statistics from models.py.
+    """
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
     # test connection and local setup
     @app.route("/hello")
     def hello():
@@ -57,21 +103,23 @@ def create_app(db_URI="", test_config=None):
     @app.route("/categories")
     def retrieve_categories():
         try:
-            selection = Category.query.order_by(Category.id).all()
-            categories = {}
-
-            for one_category in selection:
-                categories[one_category.id] = one_category.type
+            # served from the in-process registry in models.py, not the DB
+            categories = category_registry.all()
 
-            return jsonify(
+            response = jsonify(
                 {
                     "success": True,
                     "categories": categories,
-                    "total_categories": len(selection)
+                    "total_categories": len(categories)
                 }
             )
+            # let browsers and proxies revalidate with If-None-Match instead of refetching
+            response.set_etag(category_registry.etag())
+            response.cache_control.public = True
+            response.cache_control.max_age = CATEGORIES_MAX_AGE
+            return response.make_conditional(request)
         except Exception as e:
-            print(e)
+            log_error(e)
             abort(404)
 
     """
@@ -88,23 +136,31 @@ def create_app(db_URI="", test_config=None):
     """
 
     @app.route("/questions")
+    @cached_response
     def retrieve_questions(category = "all"):
         try:
-            selection_questions = Question.query.order_by(Question.id).all()
-            current_questions = paginate_questions(request, selection_questions)
+            shape = question_shape(request.args)
+            check_cursor(request.args)
+        except ValueError:
+            abort(400)
+
+        try:
+            selection_questions = Question.query.order_by(Question.id)
+            current_questions, next_cursor = paginate_questions(request, selection_questions)
 
             if len(current_questions) == 0:
                 abort(404)
 
-            return jsonify(
+            return jsonify(page_response(request, next_cursor,
                 {
-                    "questions": current_questions,
-                    "total_questions": len(Question.query.all()),
-                    "categories": retrieve_categories().json["categories"],
+                    "questions": shape_questions(current_questions, shape),
+                    "total_questions": total_questions(),
+                    "categories": category_registry.all(),
                     "current_category": category
                 }
-            )
-        except:
+            ))
+        except Exception as e:
+            log_error(e)
             abort(404)
 
 
@@ -130,18 +186,19 @@ def create_app(db_URI="", test_config=None):
             else:
                 #delete the question then fetch the page afresh from the DB
                 selected_question.delete()
-                selection = Question.query.order_by(Question.id).all()
-                current_questions = paginate_questions(request, selection)
+                selection = Question.query.order_by(Question.id)
+                current_questions, _ = paginate_questions(request, selection)
 
             return jsonify(
                 {
                     "success": True,
                     "deleted_question": question_id,
                     "current_questions": current_questions,
-                    "total_questions": len(selection)
+                    "total_questions": total_questions()
                 }
             )
-        except:
+        except Exception as e:
+            log_error(e)
             abort(422)
 
         
@@ -161,42 +218,60 @@ def create_app(db_URI="", test_config=None):
         #retrieve the data submitted on post
         new_question_body = request.get_json()
 
-        if new_question_body is None:
+        if not isinstance(new_question_body, dict):
             abort(405)
         else:
-            question = new_question_body.get("question", None)
-            answer = new_question_body.get("answer", None)
-            difficulty = new_question_body.get("difficulty", None)
-            category = new_question_body.get("category", None)
             search = new_question_body.get("searchTerm", None)
 
+            if search is not None and not isinstance(search, str):
+                abort(400)
+
             if search:
                 # user submitted a search term
+                try:
+                    shape = question_shape(request.args)
+                    check_cursor(request.args)
+                except ValueError:
+                    abort(400)
+
                 #search for search term
                 formatted_search_term = "%{}%".format(search)
                 selection = Question.query.order_by(Question.id).filter(Question.question.ilike(formatted_search_term))
                 category = "all"
                 #paginate the results
-                current_questions = paginate_questions(request, selection)
+                current_questions, next_cursor = paginate_questions(request, selection)
 
                 #return a jsonify
-                return jsonify(
+                return jsonify(page_response(request, next_cursor,
                     {
                         "success": True,
-                        "questions": current_questions,
-                        "total_questions": len(selection.all()),
+                        "questions": shape_questions(current_questions, shape),
+                        "total_questions": count_questions(selection),
                         "current_category": category
                     }
-                )
+                ))
 
             else: 
                 # user submitted a new question
                 # - Code Review Notes:
                 # -- Add in a check before inserting question in the DB so that the user is unable to insert empty entries as values for question or answer. 
                 # -- In case the user tries inserting empty string values for question or answer, raise an appropriate exception.
+                values, message = question_values(new_question_body)
+                if message is not None:
+                    abort(400)
+
+                # exact duplicates are refused, near duplicates too unless ?duplicates=flag, see flaskr/duplicates.py
+                try:
+                    policy = duplicate_policy(request.args, app.config["DUPLICATE_POLICY"])
+                except ValueError:
+                    abort(400)
+                duplicate = find_duplicate(values["question"])
+                if duplicate is not None and (duplicate["exact"] or policy == "reject"):
+                    return jsonify(duplicate_error(duplicate))
+
                 try:
                     #add to DB
-                    question = Question(question=question, answer=answer, difficulty=difficulty, category=category)
+                    question = Question(**values)
                     question.insert()
 
                     """ 
@@ -206,16 +281,248 @@ def create_app(db_URI="", test_config=None):
                     current_questions = paginate_questions(request, selection) 
                     """
 
-                    return jsonify(
-                        {
-                            "success": True,
-                            "created_question_id": question.id,
-                            "total_questions": len(Question.query.all())
-                        }
-                    )
-                except:
+                    response = {
+                        "success": True,
+                        "created_question_id": question.id,
+                        "total_questions": total_questions()
+                    }
+                    if duplicate is not None:
+                        response["duplicate"] = duplicate
+                    return jsonify(response)
+                except IntegrityError as e:
+                    # the same question inserted by another request since the check
+                    db.session.rollback()
+                    duplicate = find_duplicate(values["question"])
+                    if duplicate is None:
+                        log_error(e)
+                        abort(400)
+                    return jsonify(duplicate_error(duplicate))
+                except Exception as e:
+                    log_error(e)
                     abort(400)
 
+    """
+    Bulk import of a question pack, see flaskr/importer.py.
+    The request body is streamed as JSON Lines (default) or CSV (`?format=csv` or a text/csv
+    Content-Type) and inserted in batches of `?batch_size=` rows; `?duplicates=flag` inserts
+    near duplicates instead of rejecting them.
+    """
+    @app.route("/questions/bulk", methods=["POST"])
+    def bulk_import_questions():
+        format = request.args.get("format", None)
+        if format is None:
+            format = "csv" if request.mimetype == "text/csv" else "jsonl"
+        batch_size = request.args.get("batch_size", IMPORT_BATCH_SIZE, type=int)
+
+        try:
+            policy = duplicate_policy(request.args, app.config["DUPLICATE_POLICY"])
+        except ValueError:
+            abort(400)
+        if format not in IMPORT_FORMATS or batch_size < 1:
+            abort(400)
+
+        report = import_questions(text_stream(request.stream), format, batch_size, policy)
+
+        return jsonify(dict(report.format(), success=True))
+
+    """
+    Bulk delete and update, see flaskr/bulk.py. The JSON body picks questions by `ids`,
+    `category` and/or `difficulty`; PATCH also takes the new values under `set`.
+    Each request is a single DELETE or UPDATE statement and returns the affected count.
+    """
+    @app.route("/questions", methods=["DELETE"])
+    def bulk_delete_questions():
+        try:
+            criteria = bulk_criteria(request.get_json(silent=True))
+        except ValueError:
+            abort(400)
+
+        try:
+            deleted = delete_questions(criteria)
+        except Exception as e:
+            log_error(e)
+            db.session.rollback()
+            abort(422)
+
+        return jsonify(
+            {
+                "success": True,
+                "deleted": deleted,
+                "total_questions": total_questions()
+            }
+        )
+
+    @app.route("/questions", methods=["PATCH"])
+    def bulk_update_questions():
+        body = request.get_json(silent=True)
+        try:
+            criteria = bulk_criteria(body)
+            changes = bulk_changes(body)
+        except ValueError:
+            abort(400)
+
+        try:
+            updated = update_questions(criteria, changes)
+        except Exception as e:
+            log_error(e)
+            db.session.rollback()
+            abort(422)
+
+        return jsonify(
+            {
+                "success": True,
+                "updated": updated
+            }
+        )
+
+    @app.cli.command("import-questions")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+    @click.option("--format", "format", type=click.Choice(IMPORT_FORMATS), default=None,
+                  help="Input format, guessed from the file extension by default.")
+    @click.option("--batch-size", default=IMPORT_BATCH_SIZE, show_default=True, type=click.IntRange(min=1))
+    @click.option("--duplicates", type=click.Choice(DUPLICATE_POLICIES), default=None,
+                  help="Reject or flag near duplicates, DUPLICATE_POLICY by default.")
+    def import_questions_command(path, format, batch_size, duplicates):
+        """Import questions from a JSON Lines or CSV file (- for stdin)."""
+        if format is None:
+            format = "csv" if path.endswith(".csv") else "jsonl"
+
+        if path == "-":
+            stream = io.TextIOWrapper(click.get_binary_stream("stdin"), encoding="utf-8", newline="")
+        else:
+            stream = open(path, encoding="utf-8", newline="")
+        with stream:
+            report = import_questions(stream, format, batch_size, duplicates or app.config["DUPLICATE_POLICY"]).format()
+
+        for error in report["errors"]:
+            click.echo("row {}: {}".format(error["row"], error["error"]), err=True)
+        for duplicate in report["near_duplicates"]:
+            click.echo("row {}: {} (similarity {})".format(
+                duplicate["row"], duplicate_message(duplicate), duplicate["similarity"]), err=True)
+        click.echo("inserted {inserted} questions, {failed} failed, {flagged} flagged, in {seconds}s "
+                   "({rows_per_second} rows/s)".format(**report))
+
+    @app.cli.command("dedupe-questions")
+    @click.option("--threshold", type=click.FloatRange(0, 1), default=None,
+                  help="Similarity from which questions are near duplicates, NEAR_DUPLICATE_THRESHOLD by default.")
+    @click.option("--exact-only", is_flag=True, help="Only remove questions repeated word for word.")
+    @click.option("--dry-run", is_flag=True, help="Report the duplicates without deleting them.")
+    def dedupe_questions_command(threshold, exact_only, dry_run):
+        """Remove duplicate questions, keeping the oldest of each, see flaskr/duplicates.py."""
+        report = dedupe_questions(threshold, exact_only, dry_run)
+
+        for removed in report["removed"]:
+            click.echo("question {id}: duplicate of question {duplicate_of} (similarity {similarity})".format(**removed))
+        click.echo("scanned {scanned} questions, {} {exact} exact and {near} near duplicates, "
+                   "hashed {rehashed}".format("found" if dry_run else "removed", **report))
+
+    """
+    Streaming export of the question bank, see flaskr/exporter.py.
+    Optional `category` and `difficulty` filters and `fields` columns; `?format=csv` for CSV,
+    JSON Lines otherwise.
+    """
+    @app.route("/questions/export")
+    def export_questions():
+        format = request.args.get("format", "jsonl")
+        try:
+            columns = requested_fields(request.args, EXPORT_COLUMNS) or EXPORT_COLUMNS
+            category, difficulty = export_filters(request.args)
+        except ValueError:
+            abort(400)
+        if format not in EXPORT_FORMATS:
+            abort(400)
+
+        rows = export_rows(category=category, difficulty=difficulty, columns=columns)
+        response = Response(stream_with_context(export_chunks(rows, format, columns=columns)),
+                            mimetype=EXPORT_MIMETYPES[format])
+        response.headers["Content-Disposition"] = "attachment; filename=questions.{}".format(format)
+        return response
+
+    @app.cli.command("export-questions")
+    @click.argument("path", default="-", type=click.Path(dir_okay=False, allow_dash=True))
+    @click.option("--format", "format", type=click.Choice(EXPORT_FORMATS), default=None,
+                  help="Output format, guessed from the file extension by default.")
+    @click.option("--category", type=int, default=None)
+    @click.option("--difficulty", type=int, default=None)
+    @click.option("--fields", default=",".join(EXPORT_COLUMNS), show_default=True,
+                  help="Comma-separated columns to export.")
+    def export_questions_command(path, format, category, difficulty, fields):
+        """Export questions as JSON Lines or CSV to a file (- for stdout)."""
+        if format is None:
+            format = "csv" if path.endswith(".csv") else "jsonl"
+        try:
+            columns = requested_fields({"fields": fields}, EXPORT_COLUMNS)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--fields")
+
+        with click.open_file(path, "w", encoding="utf-8") as stream:
+            for chunk in export_chunks(export_rows(category, difficulty, columns=columns), format, columns=columns):
+                stream.write(chunk)
+
+    """
+    Change feed of the questions table, see flaskr/changes.py.
+    Every insert, update and delete is logged with an increasing version; clients keep the last
+    version they applied and ask for what changed after it, as JSON or as a Server-Sent Events
+    stream, instead of refetching pages.
+
+    Personal Notes
+    - Controller is QuestionView.js, method watchChanges()
+    """
+    @app.route("/questions/changes")
+    def question_changes():
+        try:
+            since = change_version(request.args.get("since", request.headers.get("Last-Event-ID")))
+        except ValueError:
+            abort(400)
+
+        if request.accept_mimetypes.best_match(["application/json", "text/event-stream"]) == "text/event-stream":
+            feed = app.extensions["question_changes"]
+            if not feed.open_stream():
+                # every stream holds a server thread, the client should retry later
+                abort(503)
+            response = Response(
+                stream_with_context(change_events(feed, since, app.config["QUESTION_CHANGES_STREAM_SECONDS"])),
+                mimetype="text/event-stream"
+            )
+            response.call_on_close(feed.close_stream)
+            response.headers["Cache-Control"] = "no-cache"
+            # nginx would otherwise buffer the stream
+            response.headers["X-Accel-Buffering"] = "no"
+            return response
+
+        if since is None:
+            # where to start: load the questions, then ask for the changes after this version
+            return jsonify(
+                {
+                    "success": True,
+                    "version": latest_version(),
+                    "changes": [],
+                    "more": False
+                }
+            )
+
+        if since < pruned_version():
+            # the events after `since` are gone, the client has to reload
+            abort(410)
+
+        changes = changes_since(since, QUESTION_CHANGES_LIMIT)
+        return jsonify(
+            {
+                "success": True,
+                "version": changes[-1]["version"] if changes else since,
+                "changes": changes,
+                "more": len(changes) == QUESTION_CHANGES_LIMIT
+            }
+        )
+
+    @app.cli.command("prune-question-changes")
+    @click.option("--keep", default=QUESTION_CHANGES_KEEP, show_default=True, type=click.IntRange(min=1),
+                  help="Versions of the change feed to keep.")
+    def prune_question_changes_command(keep):
+        """Remove old change feed events, see flaskr/changes.py."""
+        removed, pruned = prune_changes(keep)
+        click.echo("removed {} changes, clients behind version {} have to reload".format(removed, pruned))
+
     """
     @TODO: == DONE
     Create a POST endpoint to get questions based on a search term.
@@ -228,8 +535,59 @@ def create_app(db_URI="", test_config=None):
     - Controller is QuestionView.js, method submitSearch()
     """
     # the TODO above has been implemented as part of the add_new_question() method
+    # the ranked full-text search below is the separate route suggested in the code review notes
+
+    """
+    Ranked full-text search over both the question and the answer text, see flaskr/search.py.
+    Whole words are matched (the searchTerm branch above keeps substring matching), hits are
+    ordered by rank, and a page of hits plus the total count come from a single query.
+    """
+    @app.route("/questions/search", methods=["GET", "POST"])
+    @replica_reads
+    def search_questions():
+        if request.method == "POST":
+            body = request.get_json(silent=True)
+            search_term = body.get("searchTerm", None) if isinstance(body, dict) else None
+        else:
+            search_term = request.args.get("q", None)
+
+        if not search_term or not isinstance(search_term, str):
+            abort(400)
+
+        try:
+            shape = question_shape(request.args, RANKED_FIELDS)
+        except ValueError:
+            abort(400)
+
+        page = request.args.get("page", 1, type=int)
+        if page < 1:
+            abort(404)
+
+        current_questions, total_questions = ranked_search(search_term, page)
+
+        return jsonify(
+            {
+                "success": True,
+                "questions": shape_questions(current_questions, shape),
+                "total_questions": total_questions,
+                "search_term": search_term,
+                "current_category": "all"
+            }
+        )
 
 
+    """
+    Question totals per category and difficulty for the dashboard, read from the
+    trigger-maintained question_counts table instead of scanning the questions.
+    """
+    @app.route("/stats")
+    def retrieve_stats():
+        try:
+            return jsonify(question_stats(category_registry.all()))
+        except Exception as e:
+            log_error(e)
+            abort(422)
+
     """
     @TODO: == DONE
     Create a GET endpoint to get questions based on category.
@@ -242,20 +600,28 @@ def create_app(db_URI="", test_config=None):
     """
 
     @app.route("/categories/<int:category_id>/questions")
+    @cached_response
     def questions_by_category(category_id):
         try:
-            selection = Question.query.order_by(Question.id).filter(Question.category == category_id).all()
-            current_questions = paginate_questions(request, selection)
+            shape = question_shape(request.args)
+            check_cursor(request.args)
+        except ValueError:
+            abort(400)
 
-            return jsonify(
+        try:
+            selection = Question.query.order_by(Question.id).filter(Question.category == category_id)
+            current_questions, next_cursor = paginate_questions(request, selection)
+
+            return jsonify(page_response(request, next_cursor,
                 {
                     "success": True,
-                    "questions": current_questions,
+                    "questions": shape_questions(current_questions, shape),
                     "current_category": category_id,
-                    "total_questions":len(selection)
+                    "total_questions": total_questions(category_id)
                 }
-            )
-        except:
+            ))
+        except Exception as e:
+            log_error(e)
             abort(404) #resource not found, if URL is not correct
 
 
@@ -273,61 +639,220 @@ def create_app(db_URI="", test_config=None):
     """
 
     @app.route("/quizzes", methods=["POST"])
+    @replica_reads
     def get_quiz_questions():
         
         # set-the-stage) get the selected category details from the previous page
-        body = request.get_json()  
-        previous_questions = body.get("previous_questions", []) # returns a list
-        quiz_category = body.get("quiz_category", None) # returns a dict eg==> {'type': 'Science', 'id': '1'}
-
-        # 1) get the category_id selected
-        if quiz_category:
-            category_id = quiz_category.get("id")
-        else:
+        body = request.get_json(silent=True)
+        try:
+            # previous_questions is a list, quiz_category a dict eg==> {'type': 'Science', 'id': '1'}
+            quiz_category, previous_questions = quiz_request(body)
+        except ValueError:
             abort(400) # since game needs a category to be selected to continue
 
-        # 2) get the questions, based on the category selected
-        # PS: category_id = 0 == all categories, is not stored in the DB, hence if-else block below
-        if category_id == 0: 
-            questions = Question.query.all()
-        else:
-            questions = Question.query.filter(Question.category == category_id).all()
+        # 1) get the category_id selected
+        category_id = quiz_category.get("id")
 
-        # 3) get the total number of questions, based on category selected
-        if len(questions) == 0:
-            # no questions to play
+        # 1)a) optional batch size, to prefetch several questions in one round trip
+        try:
+            count = quiz_batch_size(body)
+        except ValueError:
             abort(400)
-        else:
-            total_questions = len(questions)
 
-            # 4) compare total number of questions with list of prev questions
-            # 4)a) if equal, end game
-            if total_questions == len(previous_questions):
-                return jsonify(
-                    {
-                        "success": True
-                    }
-                )
+        # 1)b) adaptive mode, aimed at a difficulty set by the player's recent answers
+        if body.get("adaptive", False):
+            try:
+                if count is not None:
+                    raise ValueError("count cannot be combined with adaptive")
+                category_id = int(category_id)
+                target = target_difficulty(body)
+            except (TypeError, ValueError):
+                abort(400)
+
+            pools = app.extensions["quiz_pools"]
+            adaptive_question = pick_adaptive_question(pools, category_id, previous_questions, target)
+            if adaptive_question is None:
+                if not category_in_pools(pools.current(), category_id):
+                    # no questions to play
+                    abort(400)
+                return jsonify({"success": True, "target_difficulty": target})
 
-            # 4)b) if not equal, randomized game continues
-            random_question_formatted = (random.choice(questions)).format()
+            return jsonify(
+                {
+                    "success": True,
+                    "question": adaptive_question.format(),
+                    "category": quiz_category,
+                    "target_difficulty": target
+                }
+            )
 
-            # CODE REVIEW NOTES
-            # Check out notin_ method of the SQLAlchemy to filter out the questions which have already appeared in previous_questions list 
-            # in a much more leaner and cleaner way by keeping track of the questions in the previous_questions
-           
-            # while the random question is in the list of previous questions, continue randomizing
-            while random_question_formatted.get("id") in previous_questions: 
-                random_question_formatted = (random.choice(questions)).format()
+        if count is not None:
+            questions = pick_quiz_questions(category_id, previous_questions, count)
+            if len(questions) == 0 and category_is_empty(category_id):
+                # no questions to play
+                abort(400)
 
+            # an empty list means every question has been played
             return jsonify(
                 {
                     "success": True,
-                    "question": random_question_formatted,
+                    "questions": questions,
                     "category": quiz_category
                 }
             )
 
+        # 2) pick a random question in the category that has not been played yet
+        # CODE REVIEW NOTES: previous_questions are filtered out in SQL with notin_, see flaskr/quiz.py
+        random_question = pick_quiz_question(category_id, previous_questions)
+
+        # 3) nothing left to pick
+        if random_question is None:
+            if category_is_empty(category_id):
+                # no questions to play
+                abort(400)
+
+            # 3)a) every question has been played, end game
+            return jsonify(
+                {
+                    "success": True
+                }
+            )
+
+        # 3)b) randomized game continues
+        return jsonify(
+            {
+                "success": True,
+                "question": random_question.format(),
+                "category": quiz_category
+            }
+        )
+
+
+    """
+    Server-side quiz sessions, see flaskr/quiz_sessions.py.
+    The session holds a shuffled queue of the category's question ids, so the client only sends
+    the session id and every turn is a single primary-key lookup.
+
+    Personal Notes:
+    - View; QuizView.js ... methods; startQuiz() and getNextQuestion()
+    """
+
+    @app.route("/quizzes/sessions", methods=["POST"])
+    @replica_reads
+    def start_quiz_session():
+        body = request.get_json(silent=True)
+        try:
+            quiz_category, _ = quiz_request(body)
+            length = session_length(body, app.config["QUIZ_SESSION_LENGTH"])
+        except ValueError:
+            abort(400)
+
+        question_ids, spare_ids = shuffled_question_ids(quiz_category.get("id"), length)
+        if len(question_ids) == 0:
+            # no questions to play
+            abort(400)
+
+        return jsonify(
+            {
+                "success": True,
+                "session_id": app.extensions["quiz_sessions"].create(question_ids, spare_ids),
+                "total_questions": len(question_ids),
+                "category": quiz_category
+            }
+        )
+
+    @app.route("/quizzes/sessions/<session_id>/next")
+    def next_quiz_question(session_id):
+        try:
+            question, remaining = next_session_question(app.extensions["quiz_sessions"], session_id)
+        except KeyError:
+            # unknown or expired session
+            abort(404)
+
+        if question is None:
+            # every question has been played, end game
+            return jsonify(
+                {
+                    "success": True,
+                    "remaining": 0
+                }
+            )
+
+        return jsonify(
+            {
+                "success": True,
+                "question": question.format(),
+                "remaining": remaining
+            }
+        )
+
+    @app.route("/quizzes/sessions/<session_id>", methods=["DELETE"])
+    def end_quiz_session(session_id):
+        if not app.extensions["quiz_sessions"].delete(session_id):
+            abort(404)
+
+        return jsonify(
+            {
+                "success": True,
+                "deleted_session": session_id
+            }
+        )
+
+    """
+    Scores and leaderboards, see flaskr/scores.py.
+    A finished quiz is queued and written to the database in batches by a background thread,
+    so the response only carries the rank the score would take on the current leaderboard.
+    Leaderboards are served from memory, without sorting the scores table.
+
+    Personal Notes:
+    - View; QuizView.js ... method; saveScore()
+    """
+
+    @app.route("/scores", methods=["POST"])
+    def add_score():
+        try:
+            row = score_row(request.get_json(silent=True), category_registry.all())
+        except ValueError:
+            abort(400)
+
+        rank = app.extensions["leaderboards"].rank(row["category"], row["score"])
+        if not app.extensions["score_buffer"].add(row):
+            # the database does not take the writes, the client should retry later
+            abort(503)
+
+        return jsonify(
+            {
+                "success": True,
+                "queued": True,
+                "rank": rank
+            }
+        )
+
+    @app.route("/leaderboard")
+    def retrieve_leaderboard():
+        leaderboards = app.extensions["leaderboards"]
+        try:
+            limit = leaderboard_limit(request.args, leaderboards.size)
+        except ValueError:
+            abort(400)
+
+        # no category is the overall leaderboard, 0 the quizzes over all categories
+        category = request.args.get("category", None)
+        if category is not None:
+            try:
+                category = leaderboard_category(category, category_registry.all())
+            except ValueError:
+                abort(404)
+
+        entries = leaderboards.top(category, limit)
+        return jsonify(
+            {
+                "success": True,
+                "category": category,
+                "leaderboard": [format_entry(rank, entry) for rank, entry in enumerate(entries, start=1)]
+            }
+        )
+
 
     """
     @TODO: == DONE
@@ -374,4 +899,28 @@ def create_app(db_URI="", test_config=None):
             }
         )
 
+    @app.errorhandler(410)
+    def gone(error):
+        return jsonify(
+            {
+                "error": 410,
+                "message": "Gone",
+                "success": False
+            }
+        )
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        # a real 503, like the rate limiter's 429, so clients and proxies know to retry
+        response = jsonify(
+            {
+                "error": 503,
+                "message": "Service Unavailable",
+                "success": False
+            }
+        )
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+
     return app
@@ -0,0 +1,226 @@
+"""
+Difficulty-adaptive quiz picks, for `POST /quizzes` with `"adaptive": true`.
+
+The player's recent answers set a target difficulty (1 to 5): the share of correct
+answers among the last ADAPTIVE_WINDOW ones, scaled onto the difficulty range, so a
+player who keeps answering correctly is moved towards harder questions and one who keeps
+missing towards easier ones. The pick comes from the target difficulty, or the nearest
+one that still has unplayed questions.
+
+Picks never scan the questions table: every question id is kept in an in-memory pool per
+(category, difficulty), plus one per difficulty for "all categories" (category 0). A draw
+is a random index into the pool, retried a few times when it lands on an already played
+question. Pools are built once from a single (id, category, difficulty) query and keyed on
+the version of the change feed (flaskr/changes.py) read before it. After a write in this
+process, or QUIZ_POOL_TTL seconds for writes made by other processes, they catch up by
+applying the change events since that version; only a backlog longer than
+POOL_CHANGES_LIMIT, or one pruned from the feed, rebuilds them. Every pool read goes to
+the primary, so a lagging read replica never leaves the pools behind their version.
+"""
+import os
+import random
+import threading
+import time
+from array import array
+
+from sqlalchemy import func, select
+
+from models import db, Question, QuestionChange, PrunedQuestionChanges, questions_version
+
+QUIZ_POOL_TTL = int(os.getenv('QUIZ_POOL_TTL', 60))  # seconds, see the module docstring
+ADAPTIVE_WINDOW = 5
+DEFAULT_DIFFICULTY = 3
+MIN_DIFFICULTY, MAX_DIFFICULTY = 1, 5
+# random draws before a pool is filtered for the few ids left unplayed
+DRAW_ATTEMPTS = 8
+POOL_CHANGES_LIMIT = 1000  # change events applied at once, a longer backlog rebuilds the pools
+
+def target_difficulty(body):
+    """
+    target_difficulty(body)
+        the difficulty to aim for from the `recent_answers` of a request body, a list of
+        booleans with the most recent answer last; raises ValueError for anything else
+    """
+    recent_answers = body.get("recent_answers", [])
+    if not isinstance(recent_answers, list) or not all(isinstance(answer, bool) for answer in recent_answers):
+        raise ValueError("recent_answers must be a list of booleans")
+
+    window = recent_answers[-ADAPTIVE_WINDOW:]
+    if not window:
+        return DEFAULT_DIFFICULTY
+    accuracy = sum(window) / len(window)
+    return MIN_DIFFICULTY + round(accuracy * (MAX_DIFFICULTY - MIN_DIFFICULTY))
+
+def difficulty_bands(target):
+    # the target first, then the others by distance, the harder one first on ties
+    difficulties = range(MIN_DIFFICULTY, MAX_DIFFICULTY + 1)
+    return sorted(difficulties, key=lambda difficulty: (abs(difficulty - target), -difficulty))
+
+def pool_keys(category, difficulty):
+    # the pools a question belongs in, none without a difficulty
+    if difficulty is None:
+        return []
+    return [(0, difficulty)] if category is None else [(0, difficulty), (category, difficulty)]
+
+def pool_rows_selection():
+    return select(Question.id, Question.category, Question.difficulty)
+
+def pool_version_selection():
+    return select(func.max(QuestionChange.version))
+
+def pruned_version_selection():
+    return select(PrunedQuestionChanges.version)
+
+def pool_changes_selection(version):
+    # the events after `version` with the question's current category and difficulty, both
+    # None once it has been deleted
+    return (select(QuestionChange.version, QuestionChange.question_id, Question.category, Question.difficulty)
+            .outerjoin(Question, Question.id == QuestionChange.question_id)
+            .where(QuestionChange.version > version)
+            .order_by(QuestionChange.version)
+            .limit(POOL_CHANGES_LIMIT))
+
+"""
+QuestionPools
+    {(category, difficulty): array of question ids}. Every load or catch-up swaps in a new
+    dict, copying only the pools it changes, so readers never see a half-updated set of pools
+"""
+class QuestionPools:
+
+    def __init__(self, ttl=QUIZ_POOL_TTL):
+        self.ttl = ttl
+        # (pools, change feed version, questions version, loaded at)
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def fresh(self):
+        # the current pools, or None once they have to catch up
+        snapshot = self._snapshot
+        if (snapshot is None or snapshot[2] != questions_version.value
+                or time.monotonic() - snapshot[3] > self.ttl):
+            return None
+        return snapshot[0]
+
+    def behind(self, pruned_version):
+        """
+        behind(pruned_version)
+            the change feed version to catch up from, or None when the pools have to be
+            loaded, because there are none yet or the events after them were pruned
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[1] < pruned_version:
+            return None
+        return snapshot[1]
+
+    def load(self, rows, version, bumped):
+        """
+        load(rows, version, bumped)
+            builds the pools from (id, category, difficulty) rows read after the change
+            feed was at `version` and the questions version at `bumped`, and returns them
+        """
+        ids = {}
+        for question_id, category, difficulty in rows:
+            for key in pool_keys(category, difficulty):
+                ids.setdefault(key, []).append(question_id)
+
+        pools = {key: array("q", question_ids) for key, question_ids in ids.items()}
+        self._snapshot = (pools, version, bumped, time.monotonic())
+        return pools
+
+    def apply(self, changes, bumped):
+        """
+        apply(changes, bumped)
+            moves the questions of pool_changes_selection rows to the pools they belong in
+            now and returns the pools. Applying an event twice changes nothing, so events
+            read again after a load are harmless.
+        """
+        pools, version = self._snapshot[:2]
+        if changes:
+            moved = {question_id for _, question_id, _, _ in changes}
+            # one pass over each pool, and a copy of only those holding a moved question
+            copied = {key for key, pool in pools.items() if not moved.isdisjoint(pool)}
+            pools = {key: array("q", (question_id for question_id in pool if question_id not in moved))
+                     if key in copied else pool for key, pool in pools.items()}
+            for _, question_id, category, difficulty in changes:
+                if question_id not in moved:
+                    continue
+                moved.discard(question_id)
+                for key in pool_keys(category, difficulty):
+                    if key not in copied:
+                        pools[key] = array("q", pools.get(key, ()))
+                        copied.add(key)
+                    pools[key].append(question_id)
+            version = changes[-1][0]
+
+        self._snapshot = (pools, version, bumped, time.monotonic())
+        return pools
+
+    def current(self):
+        pools = self.fresh()
+        if pools is None:
+            with self._lock:
+                pools = self.fresh()
+                if pools is None:
+                    pools = self._catch_up()
+        return pools
+
+    def _catch_up(self):
+        # bound to the primary engine, since replica reads could be behind the versions
+        def read(statement):
+            return db.session.execute(statement, bind_arguments={"bind": db.engine})
+
+        bumped = questions_version.value
+        since = self.behind(read(pruned_version_selection()).scalar() or 0)
+        if since is not None:
+            changes = read(pool_changes_selection(since)).all()
+            if len(changes) < POOL_CHANGES_LIMIT:
+                return self.apply(changes, bumped)
+        version = read(pool_version_selection()).scalar() or 0
+        return self.load(read(pool_rows_selection()).all(), version, bumped)
+
+def draw(pool, played, rng=random):
+    # a random id of the pool that is not in played, or None
+    for _ in range(DRAW_ATTEMPTS):
+        question_id = pool[rng.randrange(len(pool))]
+        if question_id not in played:
+            return question_id
+    remaining = [question_id for question_id in pool if question_id not in played]
+    return rng.choice(remaining) if remaining else None
+
+def pick_adaptive_id(pools, category_id, previous_questions, target, rng=random):
+    """
+    pick_adaptive_id(pools, category_id, previous_questions, target)
+        returns (question id, difficulty) of an unplayed question as close to the target
+        difficulty as the category allows, or (None, None) once every one has been played
+    """
+    played = set(previous_questions)
+    for difficulty in difficulty_bands(target):
+        pool = pools.get((category_id, difficulty))
+        if pool:
+            question_id = draw(pool, played, rng)
+            if question_id is not None:
+                return question_id, difficulty
+    return None, None
+
+def category_in_pools(pools, category_id):
+    return any(pools.get((category_id, difficulty)) for difficulty in difficulty_bands(DEFAULT_DIFFICULTY))
+
+def setup_adaptive_quiz(app):
+    app.config.setdefault("QUIZ_POOL_TTL", QUIZ_POOL_TTL)
+    app.extensions["quiz_pools"] = QuestionPools(app.config["QUIZ_POOL_TTL"])
+
+def pick_adaptive_question(pools, category_id, previous_questions, target):
+    """
+    pick_adaptive_question(pools, category_id, previous_questions, target)
+        the Question to play next, loaded by primary key; ids deleted since the pools were
+        built are skipped
+    """
+    played = list(previous_questions)
+    while True:
+        question_id, _ = pick_adaptive_id(pools.current(), category_id, played, target)
+        if question_id is None:
+            return None
+        question = db.session.get(Question, question_id)
+        if question is not None:
+            return question
+        played.append(question_id)
@@ -0,0 +1,101 @@
+"""
+Bulk delete and update of questions, for `DELETE /questions` and `PATCH /questions`.
+
+The questions are chosen by a list of ids and/or a category and difficulty, and every
+request runs as one DELETE or UPDATE statement in a single transaction; the affected rows
+are counted by the database rather than loaded. At least one criterion is required, so an
+empty body can never touch the whole bank.
+"""
+from sqlalchemy import delete, update
+
+from models import db, Question, category_registry, questions_version
+from .search import reset_search_index
+
+# most ids a single request can list; larger clean-ups should filter by category or difficulty
+MAX_BULK_IDS = 10000
+# the columns PATCH /questions may set
+BULK_UPDATE_FIELDS = ("category", "difficulty")
+
+def _integer(value, name):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("{} must be an integer".format(name))
+    return value
+
+def _check_category(category):
+    if _integer(category, "category") not in category_registry.all():
+        raise ValueError("unknown category {}".format(category))
+
+def _check_difficulty(difficulty):
+    if not 1 <= _integer(difficulty, "difficulty") <= 5:
+        raise ValueError("difficulty must be between 1 and 5")
+
+def bulk_criteria(body):
+    """
+    bulk_criteria(body)
+        the WHERE clauses for the `ids`, `category` and `difficulty` of a request body;
+        raises ValueError when none is given or one is malformed
+    """
+    if not isinstance(body, dict):
+        raise ValueError("expected a JSON object")
+
+    criteria = []
+    ids = body.get("ids", None)
+    if ids is not None:
+        if not isinstance(ids, list) or len(ids) > MAX_BULK_IDS:
+            raise ValueError("ids must be a list of at most {} question ids".format(MAX_BULK_IDS))
+        criteria.append(Question.id.in_([_integer(question_id, "ids") for question_id in ids]))
+    if body.get("category", None) is not None:
+        criteria.append(Question.category == _integer(body["category"], "category"))
+    if body.get("difficulty", None) is not None:
+        criteria.append(Question.difficulty == _integer(body["difficulty"], "difficulty"))
+
+    if not criteria:
+        raise ValueError("ids, category or difficulty is required")
+    return criteria
+
+def bulk_changes(body):
+    """
+    bulk_changes(body)
+        the validated column values of the `set` object of a PATCH body
+    """
+    changes = body.get("set", None)
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError("set must be an object with the columns to change")
+    unknown = set(changes) - set(BULK_UPDATE_FIELDS)
+    if unknown:
+        raise ValueError("only {} can be set".format(", ".join(BULK_UPDATE_FIELDS)))
+
+    if "category" in changes:
+        _check_category(changes["category"])
+    if "difficulty" in changes:
+        _check_difficulty(changes["difficulty"])
+    return changes
+
+def delete_questions(criteria):
+    """
+    delete_questions(criteria)
+        deletes every question matching all the criteria and returns how many were deleted
+    """
+    result = db.session.execute(delete(Question).where(*criteria).execution_options(synchronize_session=False))
+    db.session.commit()
+
+    # set-based statements bypass the ORM events that keep the search index current
+    if result.rowcount:
+        reset_search_index()
+        questions_version.bump()
+    return result.rowcount
+
+def update_questions(criteria, changes):
+    """
+    update_questions(criteria, changes)
+        sets the changed columns on every question matching all the criteria and returns
+        how many rows were updated
+    """
+    result = db.session.execute(
+        update(Question).where(*criteria).values(**changes).execution_options(synchronize_session=False))
+    db.session.commit()
+
+    # category and difficulty are not indexed for search, only the cached pages go stale
+    if result.rowcount:
+        questions_version.bump()
+    return result.rowcount
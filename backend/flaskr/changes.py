@@ -0,0 +1,199 @@
+"""
+Change feed of the questions table, for `GET /questions/changes`.
+
+Triggers on questions (see migrations.py) append an event to question_changes for every
+inserted, updated and deleted row, on Postgres as the writing transaction commits, whoever
+writes it: the Question methods, the bulk
+import, update and delete paths, dedupe-questions and the ASGI app alike. An event's
+version is its primary key, so a client or cache that remembers the last version it
+applied asks for the events after it and applies them, instead of re-reading pages.
+
+With `Accept: text/event-stream` the same route is a Server-Sent Events stream. ChangeFeed
+runs one thread per process, only while streams are open, that reads the latest version
+every QUESTION_CHANGES_POLL seconds, or right after a write in this process, and wakes the
+streams waiting for it; a stream only queries the events once there are new ones. Every
+stream holds a server thread, so at most QUESTION_CHANGES_MAX_STREAMS are open per process
+and each ends after QUESTION_CHANGES_STREAM_SECONDS; browsers reconnect on their own, from
+the Last-Event-ID they got.
+"""
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import func
+
+from models import db, Question, QuestionChange, PrunedQuestionChanges, QUESTION_FIELDS, QUESTION_COLUMNS, questions_version
+
+QUESTION_CHANGES_POLL = float(os.getenv('QUESTION_CHANGES_POLL', 1))  # seconds between checks for other processes' writes
+QUESTION_CHANGES_STREAM_SECONDS = int(os.getenv('QUESTION_CHANGES_STREAM_SECONDS', 300))
+QUESTION_CHANGES_MAX_STREAMS = int(os.getenv('QUESTION_CHANGES_MAX_STREAMS', 2))  # per process, see the module docstring
+QUESTION_CHANGES_KEEP = int(os.getenv('QUESTION_CHANGES_KEEP', 100000))  # versions kept by prune-question-changes
+QUESTION_CHANGES_LIMIT = 1000  # events per response
+STREAM_KEEPALIVE = 15  # seconds, so proxies do not close an idle stream
+STREAM_RETRY_MS = 1000  # how long browsers wait before reconnecting
+
+def change_version(value):
+    # the `since` query parameter or Last-Event-ID header; None when neither was sent
+    if value is None:
+        return None
+    version = int(value)
+    if version < 0:
+        raise ValueError("versions start at 0")
+    return version
+
+def latest_version():
+    return db.session.query(func.max(QuestionChange.version)).scalar() or 0
+
+def pruned_version():
+    # events up to this version were pruned, clients behind it have to reload
+    return db.session.query(PrunedQuestionChanges.version).scalar() or 0
+
+def format_change(row):
+    version, op, question_id = row[:3]
+    question = dict(zip(QUESTION_FIELDS, row[3:])) if op != "delete" and row[3] is not None else None
+    return {"version": version, "op": op, "id": question_id, "question": question}
+
+def changes_since(version, limit=QUESTION_CHANGES_LIMIT):
+    """
+    changes_since(version, limit)
+        the events after `version`, oldest first. Inserts and updates carry the question as
+        it is now, or None once it has been deleted, since its delete event follows.
+    """
+    rows = (db.session.query(QuestionChange.version, QuestionChange.op, QuestionChange.question_id, *QUESTION_COLUMNS)
+            .outerjoin(Question, Question.id == QuestionChange.question_id)
+            .filter(QuestionChange.version > version)
+            .order_by(QuestionChange.version)
+            .limit(limit))
+    return [format_change(row) for row in rows]
+
+def prune_changes(keep=QUESTION_CHANGES_KEEP):
+    """
+    prune_changes(keep)
+        deletes the events older than the last `keep` versions and returns
+        (events removed, version clients now have to be at)
+    """
+    pruned = latest_version() - keep
+    if pruned <= pruned_version():
+        return 0, pruned_version()
+
+    removed = db.session.query(QuestionChange).filter(QuestionChange.version <= pruned).delete(synchronize_session=False)
+    db.session.query(PrunedQuestionChanges).update({PrunedQuestionChanges.version: pruned}, synchronize_session=False)
+    db.session.commit()
+    return removed, pruned
+
+def _event(version, data, event=None):
+    lines = ["event: {}".format(event)] if event else []
+    lines += ["id: {}".format(version), "data: {}".format(json.dumps(data))]
+    return "\n".join(lines) + "\n\n"
+
+def change_events(feed, since, seconds, limit=QUESTION_CHANGES_LIMIT):
+    """
+    change_events(feed, since, seconds)
+        the text/event-stream body: the events after `since` (the latest version when
+        None), then new ones as they are logged, for `seconds`. A client behind the pruned
+        versions gets a `reset` event instead, and should reload before it reconnects.
+    """
+    deadline = time.monotonic() + seconds
+    if since is None:
+        since = latest_version()
+    elif since < pruned_version():
+        yield "retry: {}\n\n".format(STREAM_RETRY_MS)
+        version = latest_version()
+        yield _event(version, {"version": version}, event="reset")
+        return
+    # an id without data moves the browser's Last-Event-ID, so a reconnect resumes here
+    yield "retry: {}\nid: {}\n\n".format(STREAM_RETRY_MS, since)
+
+    while True:
+        changes = changes_since(since, limit)
+        # no connection is held while the stream waits
+        db.session.close()
+        for change in changes:
+            yield _event(change["version"], change)
+        if changes:
+            since = changes[-1]["version"]
+        if len(changes) == limit:
+            continue
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if not feed.wait(since, min(remaining, STREAM_KEEPALIVE)):
+            yield ": keepalive\n\n"
+
+"""
+ChangeFeed
+    the latest version seen by this process, and the thread that keeps it current while
+    streams are open. Streams wait on it instead of each polling the database.
+"""
+class ChangeFeed:
+
+    def __init__(self, app, poll=QUESTION_CHANGES_POLL, max_streams=QUESTION_CHANGES_MAX_STREAMS):
+        self.app = app
+        self.poll = poll
+        self.max_streams = max_streams
+        self.version = 0
+        self.streams = 0
+        self._poller = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+
+    def notify(self):
+        # a write in this process, checked without waiting for the next poll
+        self._wake.set()
+
+    def open_stream(self):
+        """
+        open_stream()
+            counts a new stream and makes sure the poller runs; False when
+            max_streams are already open
+        """
+        with self._lock:
+            if self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            # a poller inherited through fork is not alive in the child
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._run, name="question-changes", daemon=True)
+                self._poller.start()
+        return True
+
+    def close_stream(self):
+        with self._lock:
+            self.streams -= 1
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            with self._lock:
+                if self.streams <= 0:
+                    self._poller = None
+                    return
+            try:
+                with self.app.app_context():
+                    version = latest_version()
+                    db.session.remove()
+            except Exception:
+                self.app.logger.exception("could not read the latest question change")
+                continue
+            with self._changed:
+                if version != self.version:
+                    self.version = version
+                    self._changed.notify_all()
+
+    def wait(self, version, timeout):
+        # True once a version after `version` was seen, False after timeout seconds
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version > version, timeout)
+
+def setup_changes(app):
+    app.config.setdefault("QUESTION_CHANGES_POLL", QUESTION_CHANGES_POLL)
+    app.config.setdefault("QUESTION_CHANGES_STREAM_SECONDS", QUESTION_CHANGES_STREAM_SECONDS)
+    app.config.setdefault("QUESTION_CHANGES_MAX_STREAMS", QUESTION_CHANGES_MAX_STREAMS)
+
+    feed = ChangeFeed(app, app.config["QUESTION_CHANGES_POLL"], app.config["QUESTION_CHANGES_MAX_STREAMS"])
+    questions_version.on_bump(feed.notify)
+    app.extensions["question_changes"] = feed
@@ -0,0 +1,96 @@
+"""
+Negotiated response compression.
+
+An after_request hook compresses JSON, JSON Lines, CSV and text bodies of at least
+COMPRESS_MIN_BYTES with brotli, when the brotli package is installed and the client
+accepts it, or gzip otherwise. Streamed responses, like the exports, are compressed chunk
+by chunk as they are produced. COMPRESS_MIN_BYTES=0 compresses everything; set
+COMPRESSION_ENABLED=false when a proxy in front of the app already compresses.
+
+Compressed responses keep their ETag as a weak validator (W/"..."), so If-None-Match
+revalidation keeps working whatever encoding the client got.
+"""
+import gzip
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    # optional dependency, see requirements.txt
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))  # gzip 1-9; brotli quality is capped at 11
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/csv", "text/plain")
+
+def choose_encoding(accept_encodings):
+    # brotli over gzip; None when the client accepts neither
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+def compress(body, encoding, level=COMPRESS_LEVEL):
+    if encoding == "br":
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=level)
+
+def compress_stream(chunks, encoding, level=COMPRESS_LEVEL):
+    """
+    compress_stream(chunks, encoding, level)
+        yields the compressed form of a body produced as an iterable of chunks
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=min(level, 11))
+        flush, finish = compressor.flush, compressor.finish
+        compress_chunk = compressor.process
+    else:
+        # wbits=31 writes a gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        flush, finish = (lambda: compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+        compress_chunk = compressor.compress
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        # flushed per chunk, so a slow export still reaches the client as it is produced
+        data = compress_chunk(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+def setup_compression(app):
+    app.config.setdefault("COMPRESSION_ENABLED", COMPRESSION_ENABLED)
+    app.config.setdefault("COMPRESS_MIN_BYTES", COMPRESS_MIN_BYTES)
+    if not app.config["COMPRESSION_ENABLED"]:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        response.vary.add("Accept-Encoding")
+        if (request.method == "HEAD" or response.status_code != 200 or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+        else:
+            body = response.get_data()
+            if len(body) < app.config["COMPRESS_MIN_BYTES"]:
+                return response
+            response.set_data(compress(body, encoding))
+
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
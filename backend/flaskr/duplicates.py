@@ -0,0 +1,372 @@
+"""
+Duplicate questions, checked by `POST /questions`, the bulk import and `flask dedupe-questions`.
+
+Exact duplicates: every question stores `question_hash`, the sha1 of its normalized text
+(see migrations.question_hash), under a unique index, so the database refuses a second copy
+whichever process writes it.
+
+Near duplicates ("What is the capital of France?" / "What's the capital of France") are
+scored by the Jaccard similarity of the 3-character shingles of their normalized text. To
+find them without comparing every question, each one also gets a MinHash signature of
+SIGNATURE_SIZE minimums taken in one pass (one-permutation hashing: every shingle is hashed
+once and lands in one bin); the share of equal bins estimates the similarity, and the
+signatures are split into BANDS bands that key an LSH table. A lookup only scores the
+questions sharing a band with the new one, and only those estimated within
+ESTIMATE_MARGIN of the threshold have their text read back for the exact score, short
+questions being too few shingles for the estimate alone.
+
+The index lives in memory. Before every check it catches up with the rows inserted since
+the last one (`id > last_id`, from any process); ORM updates and deletes are applied as
+they happen, and matches deleted by other writers are dropped when their text is read.
+"""
+import os
+import random
+import threading
+from array import array
+from operator import eq
+
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, delete, event, or_, select, update
+
+from migrations import normalize_text, question_hash
+from models import db, Question, questions_version
+from .search import reset_search_index
+
+# reject: near duplicates are refused like exact ones; flag: they are inserted and reported
+DUPLICATE_POLICIES = ("reject", "flag")
+DUPLICATE_POLICY = os.getenv('DUPLICATE_POLICY', 'reject')
+# estimated Jaccard similarity from which two questions count as near duplicates
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8))
+
+SHINGLE_SIZE = 3
+SIGNATURE_SIZE = 40
+# 8 bands of 5 bins: pairs at 0.8 similarity share a band 96% of the time, pairs at 0.3 2%
+BANDS = 8
+# candidates estimated this far below the threshold still get their exact score
+ESTIMATE_MARGIN = 0.15
+ROWS_PER_BAND = SIGNATURE_SIZE // BANDS
+HASH_MASK = (1 << 64) - 1
+BIN_MASK = (1 << 32) - 1
+# odd constant that tells a value borrowed from another bin from the bin's own
+DENSIFY_OFFSET = 0x9E3779B1
+# for every bin, the fixed random order in which an empty one looks for a value to borrow
+PROBE_ORDERS = [
+    random.Random(slot).sample([other for other in range(SIGNATURE_SIZE) if other != slot], SIGNATURE_SIZE - 1)
+    for slot in range(SIGNATURE_SIZE)
+]
+DEDUPE_CHUNK_SIZE = 1000
+# removals are counted in full but only the first ones are echoed back
+MAX_REPORTED_DUPLICATES = 100
+
+def shingles(question):
+    normalized = normalize_text(question)
+    if not normalized:
+        return set()
+    return {normalized[start:start + SHINGLE_SIZE] for start in range(max(len(normalized) - SHINGLE_SIZE, 0) + 1)}
+
+def jaccard(question_shingles, other_shingles):
+    if not question_shingles or not other_shingles:
+        return 0.0
+    return len(question_shingles & other_shingles) / len(question_shingles | other_shingles)
+
+def signature(question):
+    """
+    signature(question)
+        the MinHash signature of a question text, an array of SIGNATURE_SIZE 32-bit
+        values, or None for a text without any words. Shingles go through Python's
+        string hash, so signatures only compare within one process.
+    """
+    question_shingles = shingles(question)
+    if not question_shingles:
+        return None
+
+    bins = [None] * SIGNATURE_SIZE
+    for shingle in question_shingles:
+        value = hash(shingle) & HASH_MASK
+        slot = value % SIGNATURE_SIZE
+        value = (value // SIGNATURE_SIZE) & BIN_MASK
+        if bins[slot] is None or value < bins[slot]:
+            bins[slot] = value
+
+    # an empty bin borrows the value of the first filled one in its probe order, shifted by
+    # the attempts it took; probing in a different order per bin keeps short texts, with
+    # many empty bins, from filling them all from the same few shingles
+    filled = list(bins)
+    for slot, value in enumerate(filled):
+        if value is None:
+            for attempt, other in enumerate(PROBE_ORDERS[slot], start=1):
+                if filled[other] is not None:
+                    bins[slot] = (filled[other] + attempt * DENSIFY_OFFSET) & BIN_MASK
+                    break
+    return array("I", bins)
+
+def similarity(signature, other):
+    # estimated Jaccard similarity of the shingle sets behind two signatures
+    return sum(map(eq, signature, other)) / SIGNATURE_SIZE
+
+def band_keys(signature):
+    return [
+        hash(bytes([band]) + signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes())
+        for band in range(BANDS)
+    ]
+
+"""
+NearDuplicateIndex
+    question_id -> signature, plus an LSH table of band key -> question ids. A bucket holds
+    a bare id until a second question shares it, as most never do.
+"""
+class NearDuplicateIndex:
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.last_id = 0
+        self._signatures = {}
+        self._buckets = {}
+        # re-entrant: an autoflush while catching up fires the mapper events below
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def load(self, rows):
+        # (id, question) rows, in id order, of the questions inserted since last_id
+        with self._lock:
+            for question_id, question in rows:
+                self.add(question_id, signature(question))
+                self.last_id = max(self.last_id, question_id)
+
+    def add(self, key, signature):
+        with self._lock:
+            self.remove(key)
+            if signature is None:
+                return
+            self._signatures[key] = signature
+            for band_key in band_keys(signature):
+                bucket = self._buckets.get(band_key)
+                if bucket is None:
+                    self._buckets[band_key] = key
+                elif isinstance(bucket, set):
+                    bucket.add(key)
+                else:
+                    self._buckets[band_key] = {bucket, key}
+
+    def remove(self, key):
+        with self._lock:
+            signature = self._signatures.pop(key, None)
+            if signature is None:
+                return
+            for band_key in band_keys(signature):
+                bucket = self._buckets.get(band_key)
+                if isinstance(bucket, set):
+                    bucket.discard(key)
+                    if len(bucket) == 1:
+                        self._buckets[band_key] = bucket.pop()
+                elif bucket == key:
+                    del self._buckets[band_key]
+
+    def reset(self):
+        with self._lock:
+            self.last_id = 0
+            self._signatures = {}
+            self._buckets = {}
+
+    def candidates(self, signature):
+        """
+        candidates(signature)
+            [(key, estimated similarity)] of the indexed questions that may reach the
+            threshold, the most similar first
+        """
+        if signature is None:
+            return []
+        with self._lock:
+            candidates = set()
+            for band_key in band_keys(signature):
+                bucket = self._buckets.get(band_key)
+                if isinstance(bucket, set):
+                    candidates.update(bucket)
+                elif bucket is not None:
+                    candidates.add(bucket)
+            scored = [(key, similarity(signature, self._signatures[key])) for key in candidates]
+        return sorted(
+            [(key, score) for key, score in scored if score >= self.threshold - ESTIMATE_MARGIN],
+            key=lambda candidate: (-candidate[1], candidate[0])
+        )
+
+def sync_selection(index):
+    return select(Question.id, Question.question).where(Question.id > index.last_id).order_by(Question.id)
+
+def duplicate_selection(hash, candidates):
+    # the question with this hash and the candidates still there, as (id, question_hash, question)
+    criteria = [Question.id.in_([question_id for question_id, _ in candidates])] if candidates else []
+    if hash is not None:
+        criteria.append(Question.question_hash == hash)
+    return select(Question.id, Question.question_hash, Question.question).where(or_(*criteria))
+
+def closest(question, candidates, texts, threshold):
+    """
+    closest(question, candidates, texts, threshold)
+        (key, similarity) of the candidate most similar to the question text, by the exact
+        score over the {key: text} of the candidates, or (None, None) below the threshold
+    """
+    question_shingles = shingles(question)
+    scored = [(key, jaccard(question_shingles, shingles(texts[key]))) for key, _ in candidates if key in texts]
+    scored = [(key, score) for key, score in scored if score >= threshold]
+    if not scored:
+        return None, None
+    return max(scored, key=lambda match: (match[1], -match[0]))
+
+def best_duplicate(index, question, hash, candidates, rows):
+    """
+    best_duplicate(index, question, hash, candidates, rows)
+        the duplicate to report from the index candidates and the duplicate_selection rows,
+        or None; candidates deleted since they were indexed are dropped from the index
+    """
+    texts = {}
+    for question_id, stored_hash, text in rows:
+        if hash is not None and stored_hash == hash:
+            return {"question_id": question_id, "similarity": 1.0, "exact": True}
+        texts[question_id] = text
+    for question_id, _ in candidates:
+        if question_id not in texts:
+            index.remove(question_id)
+
+    question_id, score = closest(question, candidates, texts, index.threshold)
+    if question_id is None:
+        return None
+    return {"question_id": question_id, "similarity": round(score, 3), "exact": False}
+
+def duplicate_error(duplicate):
+    # like the error handlers: the error is in the body, the HTTP status stays 200
+    return {"success": False, "error": 409, "message": "Conflict", "duplicate": duplicate}
+
+def duplicate_policy(args, default=DUPLICATE_POLICY):
+    # ?duplicates= of a request, or the default; raises ValueError for anything else
+    policy = args.get("duplicates", default)
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError("duplicates must be one of {}".format(", ".join(DUPLICATE_POLICIES)))
+    return policy
+
+def setup_duplicates(app):
+    app.config.setdefault("DUPLICATE_POLICY", DUPLICATE_POLICY)
+    app.config.setdefault("NEAR_DUPLICATE_THRESHOLD", NEAR_DUPLICATE_THRESHOLD)
+    app.extensions["question_duplicates"] = NearDuplicateIndex(app.config["NEAR_DUPLICATE_THRESHOLD"])
+
+def duplicate_index():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("question_duplicates")
+
+def sync_index(index):
+    # adds the questions inserted since the last check, streamed in id order
+    index.load(db.session.execute(sync_selection(index).execution_options(yield_per=DEDUPE_CHUNK_SIZE)))
+
+def find_duplicate(question, question_signature=None, sync=True, check_hash=True):
+    """
+    find_duplicate(question)
+        {"question_id", "similarity", "exact"} of an existing duplicate of the question
+        text, or None. The bulk import catches the index up once per batch (sync=False) and
+        leaves exact duplicates to a per-batch hash lookup (check_hash=False).
+    """
+    if question_signature is None:
+        question_signature = signature(question)
+    if question_signature is None:
+        return None
+
+    index = duplicate_index()
+    if sync:
+        sync_index(index)
+    hash = question_hash(question)
+    candidates = index.candidates(question_signature)
+    if not check_hash and not candidates:
+        return None
+    rows = db.session.execute(duplicate_selection(hash if check_hash else None, candidates)).all()
+    return best_duplicate(index, question, hash, candidates, rows)
+
+@event.listens_for(Question, "before_insert")
+@event.listens_for(Question, "before_update")
+def _hash_question(mapper, connection, target):
+    target.question_hash = question_hash(target.question)
+
+@event.listens_for(Question, "after_update")
+def _reindex_question(mapper, connection, target):
+    index = duplicate_index()
+    if index is not None and target.id <= index.last_id:
+        index.add(target.id, signature(target.question))
+
+@event.listens_for(Question, "after_delete")
+def _unindex_question(mapper, connection, target):
+    index = duplicate_index()
+    if index is not None:
+        index.remove(target.id)
+
+def dedupe_questions(threshold=None, exact_only=False, dry_run=False, chunk_size=DEDUPE_CHUNK_SIZE):
+    """
+    dedupe_questions(threshold, exact_only, dry_run, chunk_size)
+        one pass over the questions in id order, in chunks of chunk_size rows, keeping the
+        oldest of every set of duplicates and deleting the others chunk by chunk. Kept
+        questions that lack their question_hash (copies that existed before the unique
+        index) get it at the end. Returns a report dict.
+    """
+    kept = NearDuplicateIndex(threshold or current_app.config["NEAR_DUPLICATE_THRESHOLD"])
+    kept_hashes = {}
+    rehashed = []
+    report = {"scanned": 0, "exact": 0, "near": 0, "rehashed": 0, "removed": []}
+    last_id = 0
+
+    while True:
+        rows = db.session.execute(
+            select(Question.id, Question.question, Question.question_hash)
+            .where(Question.id > last_id).order_by(Question.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        removed = []
+        for question_id, question, stored_hash in rows:
+            report["scanned"] += 1
+            hash = question_hash(question)
+            if hash is None:
+                continue
+
+            duplicate_of, score = kept_hashes.get(hash), 1.0
+            question_signature = signature(question)
+            if duplicate_of is None and not exact_only:
+                candidates = kept.candidates(question_signature)
+                if candidates:
+                    texts = dict(db.session.execute(select(Question.id, Question.question).where(
+                        Question.id.in_([question_id for question_id, _ in candidates]))).all())
+                    duplicate_of, score = closest(question, candidates, texts, kept.threshold)
+            if duplicate_of is not None:
+                removed.append(question_id)
+                report["exact" if hash in kept_hashes else "near"] += 1
+                if len(report["removed"]) < MAX_REPORTED_DUPLICATES:
+                    report["removed"].append(
+                        {"id": question_id, "duplicate_of": duplicate_of, "similarity": round(score, 3)})
+                continue
+
+            kept_hashes[hash] = question_id
+            kept.add(question_id, question_signature)
+            if stored_hash != hash:
+                rehashed.append({"id": question_id, "hash": hash})
+
+        if removed and not dry_run:
+            db.session.execute(delete(Question).where(Question.id.in_(removed)),
+                               execution_options={"synchronize_session": False})
+            db.session.commit()
+
+    report["rehashed"] = len(rehashed)
+    if rehashed and not dry_run:
+        # cleared first, so a stale hash cannot collide with the one another row is getting
+        statement = update(Question.__table__).where(Question.__table__.c.id == bindparam("row_id"))
+        parameters = [{"row_id": row["id"], "hash": row["hash"]} for row in rehashed]
+        db.session.execute(statement.values(question_hash=None), parameters)
+        db.session.execute(statement.values(question_hash=bindparam("hash")), parameters)
+        db.session.commit()
+
+    if (report["exact"] or report["near"]) and not dry_run:
+        # the DELETEs bypass the ORM events that keep the in-memory indexes current
+        reset_search_index()
+        duplicate_index().reset()
+        questions_version.bump()
+    return report
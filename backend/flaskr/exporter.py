@@ -0,0 +1,73 @@
+"""
+Streaming question export, shared by `GET /questions/export` and `flask export-questions`.
+
+Rows are read as plain column tuples through a server-side cursor (`yield_per`), never as
+ORM objects, and encoded into JSON Lines or CSV chunks as they arrive. Memory stays flat
+however large the questions table grows.
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import select
+
+from models import db, Question
+from .importer import IMPORT_FORMATS
+
+EXPORT_FORMATS = IMPORT_FORMATS
+EXPORT_COLUMNS = ("id", "question", "answer", "category", "difficulty")
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_MIMETYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+
+def export_filters(args):
+    """
+    export_filters(args)
+        the (category, difficulty) filters of the query args, None for the ones not given;
+        raises ValueError for a value that is not an integer, rather than exporting everything
+    """
+    filters = []
+    for name in ("category", "difficulty"):
+        value = args.get(name, None)
+        filters.append(int(value) if value is not None else None)
+    return tuple(filters)
+
+def export_rows(category=None, difficulty=None, chunk_size=EXPORT_CHUNK_SIZE, columns=EXPORT_COLUMNS):
+    statement = select(*[getattr(Question, column) for column in columns]).order_by(Question.id)
+    if category is not None:
+        statement = statement.filter(Question.category == category)
+    if difficulty is not None:
+        statement = statement.filter(Question.difficulty == difficulty)
+
+    return db.session.execute(statement.execution_options(yield_per=chunk_size))
+
+def export_chunks(rows, format="jsonl", chunk_size=EXPORT_CHUNK_SIZE, columns=EXPORT_COLUMNS):
+    """
+    export_chunks(rows, format, chunk_size, columns)
+        yields the encoded export, chunk_size rows per string; columns names the
+        values of each row, as selected by export_rows
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError("unsupported export format: {}".format(format))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if format == "csv" else None
+    if writer:
+        writer.writerow(columns)
+
+    pending = 0
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row))))
+            buffer.write("\n")
+
+        pending += 1
+        if pending >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
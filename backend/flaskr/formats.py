@@ -0,0 +1,50 @@
+"""
+Response shapes for question lists.
+
+Every list endpoint takes two optional query args:
+
+    ?fields=id,question    only these fields of every question
+    ?format=columnar       "questions" as an object of parallel arrays, one per field,
+                           instead of a list of objects; the field names are sent once
+                           rather than once per row
+
+Both only change how the page is written out; paging, totals and cursors are unchanged.
+"""
+from models import QUESTION_FIELDS
+
+QUESTION_LIST_FORMATS = ("rows", "columnar")
+# ranked search results carry their rank as one more field
+RANKED_FIELDS = QUESTION_FIELDS + ("rank",)
+
+def requested_fields(args, available=QUESTION_FIELDS):
+    """
+    requested_fields(args, available)
+        the fields listed in ?fields=, or None when absent; raises ValueError for an
+        empty list or a field that is not available
+    """
+    fields = args.get("fields", None)
+    if fields is None:
+        return None
+    fields = tuple(field.strip() for field in fields.split(",") if field.strip())
+    if not fields or any(field not in available for field in fields):
+        raise ValueError("fields must be a comma-separated list of {}".format(", ".join(available)))
+    return fields
+
+def question_shape(args, available=QUESTION_FIELDS):
+    # (format, fields) of a list request, validated before any query runs
+    format = args.get("format", "rows")
+    if format not in QUESTION_LIST_FORMATS:
+        raise ValueError("format must be one of {}".format(", ".join(QUESTION_LIST_FORMATS)))
+    return format, requested_fields(args, available) or available
+
+def shape_questions(questions, shape):
+    """
+    shape_questions(questions, shape)
+        the formatted questions of a page written out in the (format, fields) shape
+    """
+    format, fields = shape
+    if format == "columnar":
+        return {field: [question.get(field) for question in questions] for field in fields}
+    if questions and set(fields) >= set(questions[0]):
+        return questions
+    return [{field: question.get(field) for field in fields} for question in questions]
@@ -0,0 +1,272 @@
+"""
+Bulk question import, shared by `POST /questions/bulk` and `flask import-questions`.
+
+Input is streamed one row at a time from JSON Lines or CSV, validated, and written in
+batches with a single executemany INSERT and one commit per batch instead of one
+transaction per question. A batch that the database rejects is retried row by row so
+every bad row is reported with its line number.
+
+Duplicates are checked as rows are read, see flaskr/duplicates.py: against the existing
+questions, caught up once per batch, and against the rows of the current batch. Rows that
+repeat a question word for word are always rejected; near duplicates are rejected, or with
+the "flag" policy inserted and listed in the report.
+"""
+import csv
+import io
+import json
+import time
+
+from sqlalchemy import select
+
+from migrations import question_hash
+from models import db, Question, category_registry, questions_version
+from .duplicates import NearDuplicateIndex, closest, duplicate_index, find_duplicate, signature, sync_index
+from .search import reset_search_index
+
+IMPORT_FORMATS = ("jsonl", "csv")
+IMPORT_BATCH_SIZE = 1000
+# errors are counted in full but only the first ones are echoed back
+MAX_REPORTED_ERRORS = 100
+
+def read_rows(stream, format):
+    """
+    read_rows(stream, format)
+        yields (row_number, row) from a text stream; row is a dict, or an error
+        message string for lines that could not be parsed
+    """
+    if format == "csv":
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, row
+        return
+
+    for row_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, "invalid JSON: {}".format(e)
+            continue
+        if not isinstance(row, dict):
+            yield row_number, "expected a JSON object"
+            continue
+        yield row_number, row
+
+def question_values(row):
+    """
+    question_values(row)
+        the stripped text and integer category and difficulty of an import row or a
+        POST /questions body, as (values, None), or (None, error message) when a field is
+        missing or of the wrong type
+    """
+    question, answer = row.get("question"), row.get("answer")
+    if not isinstance(question or "", str) or not isinstance(answer or "", str):
+        return None, "question and answer must be text"
+    question, answer = (question or "").strip(), (answer or "").strip()
+    if not question or not answer:
+        return None, "question and answer must not be empty"
+
+    category, difficulty = row.get("category"), row.get("difficulty")
+    # numbers in JSON, text in CSV; true is not a category, nor 2.5
+    if not all(isinstance(value, (int, str)) and not isinstance(value, bool) for value in (category, difficulty)):
+        return None, "category and difficulty must be integers"
+    try:
+        category, difficulty = int(category), int(difficulty)
+    except ValueError:
+        return None, "category and difficulty must be integers"
+
+    return {"question": question, "answer": answer, "category": category, "difficulty": difficulty}, None
+
+def validate_row(row, category_ids):
+    """
+    validate_row(row, category_ids)
+        returns (values, None) ready for the INSERT, or (None, error message)
+    """
+    values, message = question_values(row)
+    if message is not None:
+        return None, message
+
+    if values["category"] not in category_ids:
+        return None, "unknown category {}".format(values["category"])
+    if not 1 <= values["difficulty"] <= 5:
+        return None, "difficulty must be between 1 and 5"
+
+    values["question_hash"] = question_hash(values["question"])
+    return values, None
+
+class ImportReport:
+
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.flagged = 0
+        self.near_duplicates = []
+        self._started = time.perf_counter()
+
+    def error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def flag(self, row_number, duplicate):
+        self.flagged += 1
+        if len(self.near_duplicates) < MAX_REPORTED_ERRORS:
+            self.near_duplicates.append(dict(duplicate, row=row_number))
+
+    def format(self):
+        seconds = time.perf_counter() - self._started
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "flagged": self.flagged,
+            "near_duplicates": self.near_duplicates,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.inserted / seconds, 1) if seconds else 0
+        }
+
+"""
+BatchDuplicates
+    the rows of the batch being read, to check the next rows against before they reach the
+    database: by question_hash for exact copies, in a NearDuplicateIndex keyed by row number
+    for near ones
+"""
+class BatchDuplicates:
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.clear()
+
+    def clear(self):
+        self.hashes = {}
+        self.texts = {}
+        self.index = NearDuplicateIndex(self.threshold)
+
+    def add(self, row_number, values, question_signature):
+        self.hashes[values["question_hash"]] = row_number
+        self.texts[row_number] = values["question"]
+        self.index.add(row_number, question_signature)
+
+    def find(self, values, question_signature):
+        # the duplicate of the values among the rows of the batch, or None
+        row_number = self.hashes.get(values["question_hash"])
+        if row_number is not None:
+            return {"row_of_duplicate": row_number, "similarity": 1.0, "exact": True}
+        row_number, score = closest(values["question"], self.index.candidates(question_signature),
+                                    self.texts, self.threshold)
+        if row_number is None:
+            return None
+        return {"row_of_duplicate": row_number, "similarity": round(score, 3), "exact": False}
+
+def duplicate_message(duplicate):
+    # e.g. "near-duplicate of question 12", "duplicate of row 3"
+    if "question_id" in duplicate:
+        target = "question {}".format(duplicate["question_id"])
+    else:
+        target = "row {}".format(duplicate["row_of_duplicate"])
+    return "{}duplicate of {}".format("" if duplicate["exact"] else "near-", target)
+
+def _check_duplicate(row_number, values, pending, policy, report):
+    """
+    _check_duplicate(row_number, values, pending, policy, report)
+        True when the row may be inserted; rejected rows are reported as errors and
+        flagged ones recorded
+    """
+    question_signature = signature(values["question"])
+    duplicate = (find_duplicate(values["question"], question_signature, sync=False, check_hash=False)
+                 or pending.find(values, question_signature))
+
+    if duplicate is not None:
+        if duplicate["exact"] or policy == "reject":
+            report.error(row_number, duplicate_message(duplicate))
+            return False
+        report.flag(row_number, duplicate)
+
+    pending.add(row_number, values, question_signature)
+    return True
+
+def _drop_existing(batch, report):
+    # rows whose question_hash is already taken, in one lookup per batch
+    hashes = [values["question_hash"] for _, values in batch]
+    existing = dict(db.session.execute(
+        select(Question.question_hash, Question.id).where(Question.question_hash.in_(hashes))).all())
+    if not existing:
+        return batch
+    for row_number, values in batch:
+        if values["question_hash"] in existing:
+            report.error(row_number, "duplicate of question {}".format(existing[values["question_hash"]]))
+    return [(row_number, values) for row_number, values in batch if values["question_hash"] not in existing]
+
+def _flush(batch, report):
+    batch = _drop_existing(batch, report) if batch else batch
+    if not batch:
+        return
+    try:
+        db.session.execute(Question.__table__.insert(), [values for _, values in batch])
+        db.session.commit()
+        report.inserted += len(batch)
+    except Exception:
+        db.session.rollback()
+        for row_number, values in batch:
+            try:
+                db.session.execute(Question.__table__.insert(), [values])
+                db.session.commit()
+                report.inserted += 1
+            except Exception as e:
+                db.session.rollback()
+                report.error(row_number, str(getattr(e, "orig", e)))
+
+def import_questions(stream, format="jsonl", batch_size=IMPORT_BATCH_SIZE, duplicates="reject"):
+    """
+    import_questions(stream, format, batch_size, duplicates)
+        inserts every valid row from the text stream and returns an ImportReport;
+        duplicates is the policy for near duplicates, "reject" or "flag"
+    """
+    if format not in IMPORT_FORMATS:
+        raise ValueError("unsupported import format: {}".format(format))
+
+    category_ids = set(category_registry.all())
+    report = ImportReport()
+    batch = []
+    index = duplicate_index()
+    sync_index(index)
+    pending = BatchDuplicates(index.threshold)
+
+    row_number = 0
+    try:
+        try:
+            for row_number, row in read_rows(stream, format):
+                if isinstance(row, str):
+                    report.error(row_number, row)
+                    continue
+
+                values, message = validate_row(row, category_ids)
+                if message:
+                    report.error(row_number, message)
+                    continue
+                if not _check_duplicate(row_number, values, pending, duplicates, report):
+                    continue
+
+                batch.append((row_number, values))
+                if len(batch) >= batch_size:
+                    _flush(batch, report)
+                    batch = []
+                    pending.clear()
+                    sync_index(index)
+        except UnicodeDecodeError:
+            # the text is decoded ahead in chunks, so the bad bytes are at or after this row;
+            # the stream cannot be resumed past them, the rows read so far are still written
+            report.error(row_number + 1, "not UTF-8 text from here on, the rest of the input was not read")
+
+        _flush(batch, report)
+    finally:
+        # the batched INSERTs bypass the ORM events that keep the search index current
+        if report.inserted:
+            reset_search_index()
+            questions_version.bump()
+
+    return report
+
+def text_stream(binary_stream):
+    return io.TextIOWrapper(io.BufferedReader(binary_stream), encoding="utf-8", newline="")
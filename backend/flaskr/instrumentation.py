@@ -0,0 +1,108 @@
+"""
+Per-request instrumentation, exposed with the other metrics at /metrics.
+
+before_request/after_request hooks time every request; SQLAlchemy cursor events count the
+queries a request runs and the time spent in them; response sizes are recorded per endpoint.
+With PROFILING_ENABLED set, `?profile=1` runs the request under cProfile and replaces the
+response with a plain-text summary, to track down N+1 queries and full scans.
+"""
+import cProfile
+import io
+import os
+import pstats
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import HTTPException
+
+from metrics import Counter, Histogram
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_LINES = 40
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+requests_total = Counter(
+    "http_requests_total", "Requests handled", labels=("endpoint", "method", "status"))
+request_seconds = Histogram(
+    "http_request_duration_seconds", "Request latency", LATENCY_BUCKETS, labels=("endpoint",))
+request_sql_queries = Histogram(
+    "http_request_sql_queries", "SQL statements executed per request", (0, 1, 2, 5, 10, 25, 50, 100),
+    labels=("endpoint",))
+request_sql_seconds = Histogram(
+    "http_request_sql_seconds", "Time spent in SQL per request", LATENCY_BUCKETS, labels=("endpoint",))
+response_bytes = Histogram(
+    "http_response_size_bytes", "Response body size", (100, 1000, 10000, 100000, 1000000, 10000000),
+    labels=("endpoint",))
+exceptions_total = Counter(
+    "http_request_exceptions_total", "Unexpected exceptions caught by the route handlers", labels=("endpoint",))
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    started = connection.info["query_started"].pop()
+    if has_request_context() and "sql_queries" in g:
+        g.sql_queries += 1
+        g.sql_seconds += time.perf_counter() - started
+
+def endpoint_label():
+    # unmatched URLs share one label so the series cannot grow without bound
+    return request.endpoint or "unmatched"
+
+def log_error(error):
+    """
+    log_error(error)
+        records an exception swallowed by a route before it is turned into an error response;
+        aborts raised on purpose (HTTPException) are not logged
+    """
+    if isinstance(error, HTTPException):
+        return
+    exceptions_total.inc(endpoint=endpoint_label())
+    current_app.logger.exception("unexpected error in %s", endpoint_label())
+
+def _profile_summary(response, duration):
+    stream = io.StringIO()
+    stream.write("{} {} -> {}\n".format(request.method, request.full_path, response.status))
+    stream.write("duration: {:.6f}s, sql queries: {}, sql time: {:.6f}s\n\n".format(
+        duration, g.sql_queries, g.sql_seconds))
+    pstats.Stats(g.profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    return Response(stream.getvalue(), mimetype="text/plain")
+
+def setup_instrumentation(app):
+    app.config.setdefault("PROFILING_ENABLED", PROFILING_ENABLED)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+        g.profiler = None
+
+        if app.config["PROFILING_ENABLED"] and request.args.get("profile") == "1":
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record_request(response):
+        if "request_started" not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_started
+        endpoint = endpoint_label()
+
+        requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        request_seconds.observe(duration, endpoint=endpoint)
+        request_sql_queries.observe(g.sql_queries, endpoint=endpoint)
+        request_sql_seconds.observe(g.sql_seconds, endpoint=endpoint)
+        if response.content_length is not None:
+            response_bytes.observe(response.content_length, endpoint=endpoint)
+
+        if g.profiler is not None:
+            g.profiler.disable()
+            return _profile_summary(response, duration)
+        return response
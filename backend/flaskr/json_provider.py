@@ -0,0 +1,64 @@
+"""
+JSON encoding for API responses.
+
+When orjson is installed the app's JSON provider is swapped for one built on it, which
+encodes large question pages and quiz batches several times faster than the standard
+library; otherwise Flask's default provider is kept. The JSON_PROVIDER setting forces
+one or the other ("orjson" or "default"); "auto" picks orjson when it is available.
+"""
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    # optional dependency, see requirements.txt
+    orjson = None
+
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto')
+
+def _default(value):
+    return DefaultJSONProvider.default(value)
+
+def fast_dumps(obj):
+    """
+    fast_dumps(obj)
+        encodes obj to JSON bytes with orjson when it is installed; int dict keys, like the
+        category ids, are written as strings either way
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+class OrjsonProvider(DefaultJSONProvider):
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # callers asking for json.dumps options (indent, sort_keys, ...) get the stdlib
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS) + b"\n", mimetype=self.mimetype
+        )
+
+def setup_json_provider(app):
+    app.config.setdefault("JSON_PROVIDER", JSON_PROVIDER)
+    provider = app.config["JSON_PROVIDER"]
+
+    if provider not in ("auto", "orjson", "default"):
+        raise ValueError("unsupported JSON_PROVIDER: {}".format(provider))
+    if provider == "orjson" and orjson is None:
+        raise RuntimeError("JSON_PROVIDER is orjson but orjson is not installed")
+
+    if provider != "default" and orjson is not None:
+        app.json = OrjsonProvider(app)
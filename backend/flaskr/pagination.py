@@ -0,0 +1,79 @@
+"""
+Pagination helpers shared by every list endpoint.
+
+Pages are sliced in SQL (LIMIT/OFFSET) instead of loading the whole table and slicing
+the formatted list in python. Clients that walk deep into a listing can opt in to keyset
+pagination by sending `?cursor=` (empty on the first page); the response then carries a
+`next_cursor` token which filters on `id > last_seen` so every page costs the same.
+"""
+import base64
+import binascii
+
+from sqlalchemy import func
+
+from models import Question, QUESTION_COLUMNS, format_rows
+
+QUESTIONS_PER_PAGE = 10
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+def decode_cursor(token):
+    try:
+        return int(base64.urlsafe_b64decode(token.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("invalid cursor: {}".format(token))
+
+def check_cursor(args):
+    # raises ValueError for a cursor that next_cursor did not hand out, so the routes can
+    # answer 400 before they query anything
+    cursor = args.get("cursor", None)
+    if cursor:
+        decode_cursor(cursor)
+
+def page_selection(args, selection):
+    """
+    page_selection(args, selection)
+        narrows a Question query or select() ordered by Question.id to the page asked for in
+        the query args, or returns None for a page before the first one
+    """
+    cursor = args.get("cursor", None)
+    # a keyset page reads one row past its end, which split_page uses to tell whether
+    # another page follows
+    limit = QUESTIONS_PER_PAGE if cursor is None else QUESTIONS_PER_PAGE + 1
+
+    if cursor:
+        return selection.filter(Question.id > decode_cursor(cursor)).limit(limit)
+
+    page = args.get("page", 1, type=int)
+    if page < 1:
+        return None
+    return selection.offset((page - 1) * QUESTIONS_PER_PAGE).limit(limit)
+
+def split_page(args, rows):
+    """
+    split_page(args, rows)
+        returns (current_questions, next_cursor) for the rows read with page_selection;
+        next_cursor is None unless keyset pagination was asked for and another page follows
+    """
+    if "cursor" not in args or len(rows) <= QUESTIONS_PER_PAGE:
+        return rows, None
+    rows = rows[:QUESTIONS_PER_PAGE]
+    return rows, encode_cursor(rows[-1]["id"])
+
+def paginate_questions(request, selection):
+    # selection is a Question query ordered by Question.id; returns (current_questions, next_cursor)
+    selection = page_selection(request.args, selection)
+    if selection is None:
+        return [], None
+    return split_page(request.args, format_rows(selection.with_entities(*QUESTION_COLUMNS)))
+
+def count_questions(selection):
+    # SELECT count(id) with the same filters, without fetching any rows
+    return selection.order_by(None).with_entities(func.count(Question.id)).scalar()
+
+def page_response(request, next_cursor, body):
+    # next_cursor is only returned to clients that asked for keyset pagination
+    if "cursor" in request.args:
+        body["next_cursor"] = next_cursor
+    return body
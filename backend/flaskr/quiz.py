@@ -0,0 +1,97 @@
+"""
+Question picker for the quiz endpoint.
+
+Instead of loading the whole category and retrying `random.choice` until it misses
+`previous_questions`, the already-played ids are excluded in SQL with `notin_` and a
+single row is fetched at a random offset into what is left. Every pick is one count plus
+one single-row select, however close the player is to exhausting the category.
+With `count`, a batch of unseen questions comes back from one ORDER BY random() LIMIT query.
+"""
+import random
+
+from sqlalchemy import func
+
+from models import Question, QUESTION_COLUMNS, format_rows
+from .pagination import count_questions
+from .stats import total_questions
+
+# most questions a single /quizzes request can prefetch
+MAX_QUIZ_BATCH = 50
+
+def quiz_selection(category_id, previous_questions, selection=None):
+    # PS: category_id = 0 == all categories, is not stored in the DB
+    # selection defaults to Question.query, the ASGI app passes a select(Question)
+    if selection is None:
+        selection = Question.query
+    if category_id != 0:
+        selection = selection.filter(Question.category == category_id)
+    if previous_questions:
+        selection = selection.filter(Question.id.notin_(previous_questions))
+    return selection
+
+def pick_quiz_question(category_id, previous_questions):
+    """
+    pick_quiz_question(category_id, previous_questions)
+        returns a random Question from the category that is not in previous_questions,
+        or None when every question in the category has been played
+    """
+    selection = quiz_selection(category_id, previous_questions)
+    remaining = count_questions(selection)
+
+    if remaining == 0:
+        return None
+
+    return selection.order_by(Question.id).offset(random.randrange(remaining)).limit(1).first()
+
+def quiz_request(body):
+    """
+    quiz_request(body)
+        the (quiz_category, previous_questions) of a /quizzes request body, with the category
+        id as an int; raises ValueError when the body is not an object, quiz_category is not
+        an object with an integer id, or previous_questions is not a list of question ids
+    """
+    if not isinstance(body, dict):
+        raise ValueError("the body must be a JSON object")
+    quiz_category = body.get("quiz_category", None)
+    if not isinstance(quiz_category, dict):
+        raise ValueError("quiz_category must be an object with an id")
+    # "1" from the frontend, 1 from other clients; compared with an integer column, so
+    # a string would reach the database as VARCHAR
+    category_id = quiz_category.get("id")
+    if isinstance(category_id, bool) or not isinstance(category_id, (int, str)):
+        raise ValueError("quiz_category must be an object with an id")
+    quiz_category = dict(quiz_category, id=int(category_id))
+    previous_questions = body.get("previous_questions", [])
+    if not isinstance(previous_questions, list) or not all(
+            isinstance(question_id, int) and not isinstance(question_id, bool) for question_id in previous_questions):
+        raise ValueError("previous_questions must be a list of question ids")
+    return quiz_category, previous_questions
+
+def quiz_batch_size(body):
+    """
+    quiz_batch_size(body)
+        the optional `count` of a /quizzes request: None when absent, otherwise an int
+        between 1 and MAX_QUIZ_BATCH; raises ValueError for anything else
+    """
+    count = body.get("count", None)
+    if count is None:
+        return None
+    if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= MAX_QUIZ_BATCH:
+        raise ValueError("count must be an integer between 1 and {}".format(MAX_QUIZ_BATCH))
+    return count
+
+def quiz_sample(selection, count):
+    # up to count distinct rows in random order, in a single query
+    return selection.order_by(func.random()).limit(count)
+
+def pick_quiz_questions(category_id, previous_questions, count):
+    """
+    pick_quiz_questions(category_id, previous_questions, count)
+        returns up to count distinct random questions, formatted, from the category that
+        are not in previous_questions, so a client can prefetch a whole quiz in one round trip
+    """
+    selection = quiz_selection(category_id, previous_questions).with_entities(*QUESTION_COLUMNS)
+    return format_rows(quiz_sample(selection, count))
+
+def category_is_empty(category_id):
+    return total_questions(None if category_id == 0 else category_id) == 0
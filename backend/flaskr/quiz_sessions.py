@@ -0,0 +1,193 @@
+"""
+Server-side quiz sessions.
+
+Starting a quiz draws as many random question ids of the category as the quiz has turns
+(QUIZ_SESSION_LENGTH by default), plus QUIZ_SESSION_SPARES spares that stand in for
+questions deleted while the quiz is played, and keeps them in a session store; every
+following turn pops the next id and loads that one question by primary key. Clients only
+send the session id, instead of the growing previous_questions list that POST /quizzes
+needs, and a session stays the same small size however large the category is.
+
+The store is pluggable through the QUIZ_SESSION_STORE setting: "memory" (the default) is
+an in-process LRU with expiry, and a redis:// URL keeps sessions in Redis, or anything that
+speaks its protocol, so they can be shared between worker processes.
+"""
+import os
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+from models import db, Question
+from .quiz import quiz_selection
+
+QUIZ_SESSION_STORE = os.getenv('QUIZ_SESSION_STORE', 'memory')
+QUIZ_SESSION_TTL = int(os.getenv('QUIZ_SESSION_TTL', 3600))  # seconds since the last turn
+QUIZ_SESSION_MAX = int(os.getenv('QUIZ_SESSION_MAX', 10000))  # sessions kept by the memory store
+QUIZ_SESSION_LENGTH = int(os.getenv('QUIZ_SESSION_LENGTH', 10))  # turns of a quiz that does not ask for a length
+QUIZ_SESSION_SPARES = 5
+MAX_QUIZ_SESSION_LENGTH = 100
+
+"""
+MemoryQuizStore
+    session id -> reversed queue and spares of question ids, as arrays of 8-byte ints, so a
+    turn is array.pop(). The least recently used sessions are dropped beyond max_sessions,
+    and idle ones after ttl seconds.
+"""
+class MemoryQuizStore:
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # session id -> (queue, spares, last used)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        # the least recently used sessions are at the front
+        while self._sessions:
+            session_id, (_, _, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def create(self, question_ids, spare_ids=()):
+        session_id = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (array("q", reversed(question_ids)), array("q", spare_ids), now)
+            self._expire(now)
+        return session_id
+
+    def pop(self, session_id, spare=False):
+        """
+        pop(session_id, spare=False)
+            returns (question_id, remaining turns) from the queue, or from the spares;
+            question_id is None once that is empty. Raises KeyError for unknown or expired
+            sessions.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            queue, spares, _ = self._sessions[session_id]
+            self._sessions[session_id] = (queue, spares, now)
+            self._sessions.move_to_end(session_id)
+            source = spares if spare else queue
+            question_id = source.pop() if source else None
+            return question_id, len(queue)
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+"""
+RedisQuizStore
+    one Redis list per session (LPOP per turn) plus a marker key, both expiring after ttl
+    seconds without a turn.
+"""
+class RedisQuizStore:
+
+    def __init__(self, url, ttl=QUIZ_SESSION_TTL):
+        # optional dependency, only needed when QUIZ_SESSION_STORE is a redis:// URL
+        import redis
+
+        self.ttl = ttl
+        self.redis = redis.Redis.from_url(url)
+
+    def _keys(self, session_id):
+        return ("quiz:session:{}".format(session_id), "quiz:session:{}:spares".format(session_id),
+                "quiz:session:{}:open".format(session_id))
+
+    def create(self, question_ids, spare_ids=()):
+        session_id = secrets.token_urlsafe(16)
+        queue_key, spares_key, open_key = self._keys(session_id)
+        pipeline = self.redis.pipeline()
+        if question_ids:
+            pipeline.rpush(queue_key, *question_ids)
+        if spare_ids:
+            pipeline.rpush(spares_key, *spare_ids)
+        pipeline.set(open_key, 1)
+        for key in (queue_key, spares_key, open_key):
+            pipeline.expire(key, self.ttl)
+        pipeline.execute()
+        return session_id
+
+    def pop(self, session_id, spare=False):
+        queue_key, spares_key, open_key = self._keys(session_id)
+        pipeline = self.redis.pipeline()
+        pipeline.lpop(spares_key if spare else queue_key)
+        pipeline.llen(queue_key)
+        for key in (queue_key, spares_key, open_key):
+            pipeline.expire(key, self.ttl)
+        question_id, remaining, _, _, session_open = pipeline.execute()
+        if not session_open:
+            raise KeyError(session_id)
+        return (int(question_id) if question_id is not None else None), remaining
+
+    def delete(self, session_id):
+        return self.redis.delete(*self._keys(session_id)) > 0
+
+def make_quiz_store(setting, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_MAX):
+    if setting == "memory":
+        return MemoryQuizStore(ttl, max_sessions)
+    if setting.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQuizStore(setting, ttl)
+    raise ValueError("unsupported QUIZ_SESSION_STORE: {}".format(setting))
+
+def setup_quiz_sessions(app):
+    app.config.setdefault("QUIZ_SESSION_STORE", QUIZ_SESSION_STORE)
+    app.config.setdefault("QUIZ_SESSION_TTL", QUIZ_SESSION_TTL)
+    app.config.setdefault("QUIZ_SESSION_MAX", QUIZ_SESSION_MAX)
+    app.config.setdefault("QUIZ_SESSION_LENGTH", QUIZ_SESSION_LENGTH)
+    app.extensions["quiz_sessions"] = make_quiz_store(
+        app.config["QUIZ_SESSION_STORE"], app.config["QUIZ_SESSION_TTL"], app.config["QUIZ_SESSION_MAX"]
+    )
+
+def session_length(body, default=QUIZ_SESSION_LENGTH):
+    """
+    session_length(body, default)
+        the optional `length` of a POST /quizzes/sessions body, the number of turns: the
+        default when absent, otherwise an int between 1 and MAX_QUIZ_SESSION_LENGTH;
+        raises ValueError for anything else
+    """
+    length = body.get("length", None)
+    if length is None:
+        return default
+    if isinstance(length, bool) or not isinstance(length, int) or not 1 <= length <= MAX_QUIZ_SESSION_LENGTH:
+        raise ValueError("length must be an integer between 1 and {}".format(MAX_QUIZ_SESSION_LENGTH))
+    return length
+
+def shuffled_question_ids(category_id, length, spares=QUIZ_SESSION_SPARES):
+    """
+    shuffled_question_ids(category_id, length, spares)
+        (question ids, spare ids): `length` random questions of the category, or all of
+        them in a smaller one, and up to `spares` more to stand in for deleted questions
+    """
+    selection = (quiz_selection(category_id, []).with_entities(Question.id)
+                 .order_by(func.random()).limit(length + spares))
+    question_ids = [question_id for (question_id,) in selection]
+    return question_ids[:length], question_ids[length:]
+
+def next_session_question(store, session_id):
+    """
+    next_session_question(store, session_id)
+        returns (question, remaining); question is None when the quiz is over. Ids of
+        questions deleted since the session started are skipped.
+    """
+    spare = False
+    while True:
+        question_id, remaining = store.pop(session_id, spare)
+        if question_id is None:
+            if not spare:
+                return None, 0
+            # out of spares, the deleted question's turn is skipped
+            spare = False
+            continue
+        question = db.session.get(Question, question_id)
+        if question is not None:
+            return question, remaining
+        # deleted since the session started, a spare takes its turn
+        spare = True
@@ -0,0 +1,132 @@
+"""
+Token-bucket rate limiting per client and route.
+
+Every (client, endpoint) pair gets a bucket of `burst` tokens refilled at `rate` tokens a
+second; a request spends one token and is answered with 429 Too Many Requests, and a
+Retry-After header, when the bucket is empty. That keeps a burst from a few clients from
+queueing every other request behind the database pool.
+
+Limits are configured per endpoint (the view function name) with RATE_LIMITS, e.g.
+"retrieve_questions=20/40;get_quiz_questions=5/10", and RATE_LIMIT_DEFAULT applies to the
+rest ("none", the default, leaves them unlimited). Clients are told apart by their remote
+address, or by the first value of the RATE_LIMIT_CLIENT_HEADER header (e.g. X-Forwarded-For
+behind a proxy). Buckets live in each worker process, so N workers allow up to N times the
+configured rate.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+
+from metrics import Counter
+
+RATE_LIMITS = os.getenv('RATE_LIMITS', '')
+RATE_LIMIT_DEFAULT = os.getenv('RATE_LIMIT_DEFAULT', 'none')
+RATE_LIMIT_CLIENT_HEADER = os.getenv('RATE_LIMIT_CLIENT_HEADER', '')
+# buckets kept per process; the least recently used clients are forgotten (and start full again)
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv('RATE_LIMIT_MAX_CLIENTS', 100000))
+
+rate_limited = Counter(
+    "http_rate_limited_total", "Requests rejected by the rate limiter", labels=("endpoint",))
+
+def parse_limit(value):
+    """
+    parse_limit(value)
+        (rate per second, burst) from "rate/burst" (burst defaults to rate), a
+        (rate, burst) pair, or None for "none"; raises ValueError otherwise
+    """
+    if value is None or isinstance(value, (tuple, list)):
+        limit = value
+    elif value.strip().lower() in ("", "none"):
+        limit = None
+    else:
+        rate, _, burst = value.partition("/")
+        limit = (float(rate), float(burst or rate))
+    if limit is not None and (limit[0] <= 0 or limit[1] < 1):
+        raise ValueError("rate limits need a positive rate and a burst of at least 1: {}".format(value))
+    return limit
+
+def parse_limits(value):
+    # {endpoint: (rate, burst)} from a dict or "endpoint=rate/burst;..."
+    if isinstance(value, dict):
+        return {endpoint: parse_limit(limit) for endpoint, limit in value.items()}
+    limits = {}
+    for item in value.split(";"):
+        if item.strip():
+            endpoint, _, limit = item.partition("=")
+            limits[endpoint.strip()] = parse_limit(limit)
+    return limits
+
+"""
+TokenBuckets
+    (client, endpoint) -> [tokens, last refill], in an LRU of at most max_clients buckets
+"""
+class TokenBuckets:
+
+    def __init__(self, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """
+        take(key, rate, burst)
+            spends a token and returns 0, or returns the seconds until one is available
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+def client_id(header):
+    if header:
+        value = request.headers.get(header, "")
+        if value:
+            return value.split(",")[0].strip()
+    return request.remote_addr
+
+def setup_rate_limits(app):
+    app.config.setdefault("RATE_LIMITS", RATE_LIMITS)
+    app.config.setdefault("RATE_LIMIT_DEFAULT", RATE_LIMIT_DEFAULT)
+    app.config.setdefault("RATE_LIMIT_CLIENT_HEADER", RATE_LIMIT_CLIENT_HEADER)
+    limits = parse_limits(app.config["RATE_LIMITS"])
+    default = parse_limit(app.config["RATE_LIMIT_DEFAULT"])
+    if not any(limits.values()) and default is None:
+        return
+
+    buckets = TokenBuckets()
+    app.extensions["rate_limits"] = buckets
+
+    @app.before_request
+    def limit_rate():
+        endpoint = request.endpoint or "unmatched"
+        limit = limits.get(endpoint, default)
+        if limit is None:
+            return None
+
+        rate, burst = limit
+        wait = buckets.take((client_id(current_app.config["RATE_LIMIT_CLIENT_HEADER"]), endpoint), rate, burst)
+        if not wait:
+            return None
+
+        rate_limited.inc(endpoint=endpoint)
+        # unlike the other errors this one keeps its HTTP status, so clients and proxies back off
+        response = jsonify({"success": False, "error": 429, "message": "Too Many Requests"})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(math.ceil(wait))
+        return response
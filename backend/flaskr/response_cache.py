@@ -0,0 +1,256 @@
+"""
+Response cache for the question list endpoints.
+
+Entries are keyed on a questions table version, the path and the sorted query args, so a
+write to the bank makes older entries unreachable and they age out on their own. The
+version has to move in every worker process on any write: the memory backend reads the
+primary's latest question_changes version (logged by triggers for every write, see
+changes.py), the Redis one keeps a shared counter. Every cached response carries a strong ETag
+computed from its body; a matching If-None-Match is answered with an empty 304.
+
+Misses are coalesced: while one request renders a page, concurrent requests for the same
+key wait for it and share its body instead of running the same queries (single flight).
+This also applies with RESPONSE_CACHE=none, which only turns off keeping the entries.
+
+With read replicas, a client that reads the primary after its own write (see replicas.py)
+neither gets cached pages nor stores the ones it renders, and a page rendered from a
+replica is only stored once that replica has applied every question change the primary
+has, so a lagging replica never fills the cache with pages older than their key.
+
+The backend is pluggable through the RESPONSE_CACHE setting: "memory" (the default) is an
+in-process LRU capped at RESPONSE_CACHE_MAX_BYTES, one per worker process, a redis:// URL
+shares entries (and the table version) between worker processes, and "none" turns caching
+off.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, request
+from sqlalchemy import func, select
+
+from metrics import Counter
+from models import db, questions_version, QuestionChange
+
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'memory')
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 600))  # seconds, shared backend only
+
+# query args that change how a response is produced but not its content
+UNCACHED_ARGS = ("profile",)
+
+cache_requests = Counter(
+    "response_cache_requests_total", "Response cache lookups", labels=("endpoint", "result"))
+
+"""
+MemoryResponseCache
+    in-process LRU of (body, etag, mimetype) entries, evicting the least recently used ones
+    once the cached bodies add up to more than max_bytes
+"""
+class MemoryResponseCache:
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self):
+        # a max over the primary key, read on the primary so replicas cannot lag it
+        return latest_change_version(db.engine)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        body = entry[0]
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[key] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[0])
+
+"""
+RedisResponseCache
+    entries and the table version in Redis, shared by every worker process. Each process
+    increments the shared version on its own writes.
+"""
+class RedisResponseCache:
+
+    VERSION_KEY = "trivia:questions:version"
+
+    def __init__(self, url, ttl=RESPONSE_CACHE_TTL):
+        # optional dependency, only needed when RESPONSE_CACHE is a redis:// URL
+        import redis
+
+        self.ttl = ttl
+        self.redis = redis.Redis.from_url(url)
+        questions_version.on_bump(lambda: self.redis.incr(self.VERSION_KEY))
+
+    def version(self):
+        return int(self.redis.get(self.VERSION_KEY) or 0)
+
+    def _key(self, key):
+        return "trivia:response:" + hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get(self, key):
+        entry = self.redis.hmget(self._key(key), "body", "etag", "mimetype")
+        if entry[0] is None:
+            return None
+        return entry[0], entry[1].decode(), entry[2].decode()
+
+    def set(self, key, entry):
+        body, etag, mimetype = entry
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._key(key), mapping={"body": body, "etag": etag, "mimetype": mimetype})
+        pipeline.expire(self._key(key), self.ttl)
+        pipeline.execute()
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+"""
+SingleFlight
+    runs one call per key at a time; callers arriving while it is in flight wait for
+    it and get the same result, or the same exception
+"""
+class SingleFlight:
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, call):
+        """
+        do(key, call)
+            returns (result, shared); shared is True for the callers that waited
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = call()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+def make_response_cache(setting, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+    if setting == "none":
+        return None
+    if setting == "memory":
+        return MemoryResponseCache(max_bytes)
+    if setting.startswith(("redis://", "rediss://", "unix://")):
+        return RedisResponseCache(setting)
+    raise ValueError("unsupported RESPONSE_CACHE: {}".format(setting))
+
+def setup_response_cache(app):
+    app.config.setdefault("RESPONSE_CACHE", RESPONSE_CACHE)
+    app.config.setdefault("RESPONSE_CACHE_MAX_BYTES", RESPONSE_CACHE_MAX_BYTES)
+    app.extensions["response_cache"] = make_response_cache(
+        app.config["RESPONSE_CACHE"], app.config["RESPONSE_CACHE_MAX_BYTES"]
+    )
+    app.extensions["single_flight"] = SingleFlight()
+
+def cache_key(cache):
+    args = sorted((key, value) for key, value in request.args.items(multi=True) if key not in UNCACHED_ARGS)
+    version = cache.version() if cache is not None else questions_version.value
+    return (version, request.path, tuple(args))
+
+def latest_change_version(engine):
+    statement = select(func.max(QuestionChange.version))
+    return db.session.execute(statement, bind_arguments={"bind": engine}).scalar() or 0
+
+def replica_caught_up(router):
+    """
+    replica_caught_up(router)
+        False when this request reads from a replica that is behind the primary's question
+        changes; checked before rendering, since replicas only move forward
+    """
+    replica = router.request_replica(db.engines) if router is not None else None
+    if replica is None:
+        return True
+    return latest_change_version(replica) >= latest_change_version(db.engine)
+
+def conditional_response(entry):
+    body, etag, mimetype = entry
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # clients may keep the body but must revalidate it, which costs a 304 at most
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def cached_response(view):
+    """
+    cached_response(view)
+        serves a GET view from the response cache, rendering each missing entry once for
+        all the concurrent requests that ask for it; only 200 responses are stored, and
+        errors raised with abort() pass straight through
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get("response_cache")
+        router = current_app.extensions.get("db_replicas")
+        if request.args.get("profile") == "1":
+            return view(*args, **kwargs)
+        if router is not None and not router.read_only_request():
+            # reads its own writes from the primary, which cached pages may predate
+            cache_requests.inc(endpoint=request.endpoint, result="bypass")
+            return view(*args, **kwargs)
+
+        key = cache_key(cache)
+        entry = cache.get(key) if cache is not None else None
+        if entry is not None:
+            cache_requests.inc(endpoint=request.endpoint, result="hit")
+            return conditional_response(entry)
+
+        def render():
+            storable = replica_caught_up(router)
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                # only this request can use it
+                return response
+            body = response.get_data()
+            entry = (body, hashlib.sha1(body).hexdigest(), response.mimetype)
+            if cache is not None and storable:
+                cache.set(key, entry)
+            return entry
+
+        result, shared = current_app.extensions["single_flight"].do(key, render)
+        cache_requests.inc(endpoint=request.endpoint, result="coalesced" if shared else "miss")
+        if isinstance(result, tuple):
+            return conditional_response(result)
+        if shared:
+            return view(*args, **kwargs)
+        return result
+
+    return wrapper
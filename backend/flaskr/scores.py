@@ -0,0 +1,312 @@
+"""
+Quiz scores and leaderboards, for `POST /scores` and `GET /leaderboard`.
+
+Scores are not inserted by the request that posts them: ScoreBuffer keeps them in memory
+and a background thread writes them in batched transactions, every SCORE_FLUSH_INTERVAL
+seconds or as soon as SCORE_BATCH_SIZE are waiting. A request only blocks on the database
+when SCORE_BUFFER_LIMIT scores are already waiting, and then flushes them itself.
+
+Leaderboards keeps the top LEADERBOARD_SIZE scores of every category (0 for quizzes over
+all categories) in sorted lists, plus an overall one. The lists are loaded once per
+process from the (category, score) index, then kept current by reading only the scores
+inserted since, by primary key, so a leaderboard read never sorts the scores table. The
+catch-up runs after every local flush and at least every LEADERBOARD_REFRESH seconds, for
+the scores written by other processes. It reads from the lowest id not seen yet: past the
+highest id when every lower one has been read, so a catch-up with nothing new reads no rows.
+"""
+import atexit
+import heapq
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+from flask import current_app, has_app_context
+from sqlalchemy import func, insert
+
+from metrics import Counter, Gauge
+from models import db, Score, category_registry
+
+SCORE_FLUSH_INTERVAL = float(os.getenv('SCORE_FLUSH_INTERVAL', 0.5))  # seconds between background flushes
+SCORE_BATCH_SIZE = int(os.getenv('SCORE_BATCH_SIZE', 500))  # scores per insert transaction
+SCORE_BUFFER_LIMIT = int(os.getenv('SCORE_BUFFER_LIMIT', 10000))  # waiting scores before requests flush inline
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', 100))  # scores kept per leaderboard
+LEADERBOARD_REFRESH = float(os.getenv('LEADERBOARD_REFRESH', 1))  # seconds before other processes' scores are read
+LEADERBOARD_LIMIT = 10  # entries returned when the request does not ask for a number
+MAX_PLAYER_LENGTH = 64
+
+# concurrent flushes commit their ids out of order, so a lower id can become visible after a
+# higher one; ids missing up to this far below the highest one seen are read again until they show
+CATCH_UP_OVERLAP = 1000
+
+SCORE_COLUMNS = (Score.score, Score.created_at, Score.id, Score.player, Score.category, Score.total_questions)
+
+scores_flushed = Counter("scores_flushed_total", "Scores written to the database by the score buffer")
+
+def _buffer_size():
+    if not has_app_context():
+        return None
+    buffer = current_app.extensions.get("score_buffer")
+    return len(buffer) if buffer is not None else None
+
+Gauge("score_buffer_size", "Scores waiting in memory to be written", _buffer_size)
+
+def score_row(body, category_ids):
+    """
+    score_row(body, category_ids)
+        the scores row for a POST /scores body: `player`, `score`, `total_questions` and the
+        `quiz_category` the quiz was played in, as sent to POST /quizzes/sessions (id 0 for
+        all categories). Raises ValueError for anything missing or out of range.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("the body must be a JSON object")
+    player = body.get("player")
+    if not isinstance(player, str) or not player.strip() or len(player.strip()) > MAX_PLAYER_LENGTH:
+        raise ValueError("player must be a name of 1 to {} characters".format(MAX_PLAYER_LENGTH))
+
+    score, total = body.get("score"), body.get("total_questions")
+    for value in (score, total):
+        # bool is a subclass of int, and true is not a score
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError("score and total_questions must be integers")
+    if total < 1 or not 0 <= score <= total:
+        raise ValueError("score must be between 0 and total_questions")
+
+    quiz_category = body.get("quiz_category")
+    if not isinstance(quiz_category, dict):
+        raise ValueError("quiz_category is required")
+    category = leaderboard_category(quiz_category.get("id"), category_ids)
+
+    return {
+        "player": player.strip(),
+        "category": category,
+        "score": score,
+        "total_questions": total,
+        "created_at": datetime.now(timezone.utc).replace(tzinfo=None),
+    }
+
+def leaderboard_category(value, category_ids):
+    # a category id as sent by clients, "1" or 1; 0 for all categories
+    if isinstance(value, bool) or value is None:
+        raise ValueError("category must be an id")
+    category = int(value)
+    if category != 0 and category not in category_ids:
+        raise ValueError("unknown category")
+    return category
+
+def leaderboard_limit(args, size):
+    # the `limit` query parameter, at most the leaderboard size
+    limit = args.get("limit", LEADERBOARD_LIMIT, type=int)
+    if not 1 <= limit <= size:
+        raise ValueError("limit must be between 1 and {}".format(size))
+    return limit
+
+"""
+Leaderboards
+    {category: entries}, plus the overall board under None. An entry is the tuple
+    (-score, created_at, id, player, category, total_questions), so a sorted list is best
+    first, earlier scores winning ties. Lists are cut to `size`; a score that falls off
+    one is never needed again, since scores are only ever added.
+"""
+class Leaderboards:
+
+    def __init__(self, size=LEADERBOARD_SIZE, refresh=LEADERBOARD_REFRESH):
+        self.size = size
+        self.refresh = refresh
+        self.last_id = 0
+        # the lowest id the next catch-up reads
+        self.read_from = 1
+        # None until the first read loads them
+        self._boards = None
+        self._refreshed_at = 0
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        # called after a flush, so the next read catches up without waiting for refresh
+        self._stale = True
+
+    def _add(self, entry):
+        for key in (entry[4], None):
+            board = self._boards.setdefault(key, [])
+            position = bisect_left(board, entry)
+            if position >= self.size or (position < len(board) and board[position] == entry):
+                # below the cut, or read again by an overlapping catch-up
+                continue
+            board.insert(position, entry)
+            del board[self.size:]
+
+    def _load(self):
+        # the highest id first: scores inserted while the boards load are read by the catch-up
+        self.last_id = db.session.query(func.max(Score.id)).scalar() or 0
+        # which ids below it are still uncommitted is not known yet
+        self.read_from = max(1, self.last_id - CATCH_UP_OVERLAP + 1)
+        boards = {}
+        for category in [0, *category_registry.all()]:
+            rows = (db.session.query(*SCORE_COLUMNS)
+                    .filter(Score.category == category)
+                    .order_by(Score.score.desc(), Score.created_at, Score.id)
+                    .limit(self.size))
+            board = [(-row[0], *row[1:]) for row in rows]
+            if board:
+                boards[category] = board
+        # every overall top score is in the top of its own category
+        boards[None] = list(heapq.merge(*boards.values()))[:self.size]
+        self._boards = boards
+
+    def _catch_up(self):
+        seen = set()
+        rows = db.session.query(*SCORE_COLUMNS).filter(Score.id >= self.read_from)
+        for row in rows:
+            self._add((-row[0], *row[1:]))
+            seen.add(row[2])
+            self.last_id = max(self.last_id, row[2])
+        # an id below last_id that was not read belongs to a flush that has not committed yet,
+        # or was rolled back; the next catch-up starts from the lowest one within the overlap
+        window = range(max(self.read_from, self.last_id - CATCH_UP_OVERLAP + 1), self.last_id + 1)
+        self.read_from = next((score_id for score_id in window if score_id not in seen), self.last_id + 1)
+
+    def top(self, category=None, limit=None):
+        """
+        top(category=None, limit=None)
+            the best entries of a category, or of every score with category None
+        """
+        with self._lock:
+            if self._boards is None:
+                self._refreshed_at = time.monotonic()
+                self._stale = False
+                self._load()
+            elif self._stale or time.monotonic() - self._refreshed_at > self.refresh:
+                self._refreshed_at = time.monotonic()
+                self._stale = False
+                self._catch_up()
+            return self._boards.get(category, [])[:limit]
+
+    def rank(self, category, score):
+        # where a new score would place on its category's board, None below the cut
+        board = self.top(category)
+        position = bisect_right(board, (-score, datetime.max))
+        return position + 1 if position < self.size else None
+
+def format_entry(rank, entry):
+    negative_score, created_at, _, player, category, total = entry
+    return {
+        "rank": rank,
+        "player": player,
+        "category": category,
+        "score": -negative_score,
+        "total_questions": total,
+        "created_at": created_at.isoformat()
+    }
+
+"""
+ScoreBuffer
+    scores waiting to be inserted, and the daemon thread that inserts them. The thread is
+    started by the first score a process receives, so a server that forks after building
+    the app gets one per worker.
+"""
+class ScoreBuffer:
+
+    def __init__(self, app, interval=SCORE_FLUSH_INTERVAL, batch_size=SCORE_BATCH_SIZE, limit=SCORE_BUFFER_LIMIT):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.limit = limit
+        self._pending = []
+        self._listeners = []
+        self._pid = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        # one flush at a time, so batches are inserted in the order they were received
+        self._flush_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def on_flush(self, listener):
+        self._listeners.append(listener)
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # forked: the parent process still owns, and flushes, what it had buffered
+                self._pending = []
+            else:
+                atexit.register(self.flush)
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="score-flusher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def add(self, row):
+        """
+        add(row)
+            queues a scores row; returns False when the buffer stays full even after the
+            request flushed it itself, i.e. when the database does not take the writes
+        """
+        if self._pid != os.getpid():
+            self._start()
+        with self._lock:
+            self._pending.append(row)
+            waiting = len(self._pending)
+        if waiting >= self.limit:
+            self.flush()
+            return len(self._pending) < self.limit
+        if waiting >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """
+        flush()
+            inserts every waiting score, SCORE_BATCH_SIZE per transaction, and returns how
+            many were written. Scores of a failed transaction are queued again.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+
+            written = 0
+            with self.app.app_context():
+                try:
+                    while written < len(rows):
+                        batch = rows[written:written + self.batch_size]
+                        db.session.execute(insert(Score), batch)
+                        db.session.commit()
+                        written += len(batch)
+                except Exception:
+                    db.session.rollback()
+                    with self._lock:
+                        self._pending[:0] = rows[written:]
+                    self.app.logger.exception("could not write %d scores", len(rows) - written)
+                finally:
+                    db.session.remove()
+
+        if written:
+            scores_flushed.inc(written)
+            for listener in self._listeners:
+                listener()
+        return written
+
+def setup_scores(app):
+    app.config.setdefault("SCORE_FLUSH_INTERVAL", SCORE_FLUSH_INTERVAL)
+    app.config.setdefault("SCORE_BATCH_SIZE", SCORE_BATCH_SIZE)
+    app.config.setdefault("SCORE_BUFFER_LIMIT", SCORE_BUFFER_LIMIT)
+    app.config.setdefault("LEADERBOARD_SIZE", LEADERBOARD_SIZE)
+    app.config.setdefault("LEADERBOARD_REFRESH", LEADERBOARD_REFRESH)
+
+    leaderboards = Leaderboards(app.config["LEADERBOARD_SIZE"], app.config["LEADERBOARD_REFRESH"])
+    buffer = ScoreBuffer(app, app.config["SCORE_FLUSH_INTERVAL"], app.config["SCORE_BATCH_SIZE"],
+                         app.config["SCORE_BUFFER_LIMIT"])
+    buffer.on_flush(leaderboards.invalidate)
+    app.extensions["leaderboards"] = leaderboards
+    app.extensions["score_buffer"] = buffer
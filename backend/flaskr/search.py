@@ -0,0 +1,231 @@
+"""
+Full-text search over question and answer text.
+
+On Postgres the questions table has a GIN index over a weighted tsvector expression
+(question text weighted above the answer, created by migrations.py), hits are ranked with
+ts_rank, and the page of hits plus the total come back from one query through
+`count(*) OVER ()`. A trigram index on the question text also backs the legacy substring
+search in `POST /questions`.
+
+Other databases (the SQLite test runs) fall back to an in-memory inverted index, built on
+the first search and kept in step with ORM writes through mapper events.
+"""
+import math
+import re
+import threading
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+
+from models import db, Question, QUESTION_COLUMNS, format_rows
+from migrations import SEARCH_VECTOR_SQL
+from .pagination import QUESTIONS_PER_PAGE
+
+TOKEN_PATTERN = re.compile(r"\w+")
+QUESTION_WEIGHT = 1.0
+ANSWER_WEIGHT = 0.4
+
+
+POSTGRES_SEARCH = text("""
+    SELECT id, question, answer, category, difficulty,
+           ts_rank({vector}, search_query) AS rank,
+           count(*) OVER () AS total
+    FROM questions, plainto_tsquery('english', :term) AS search_query
+    WHERE {vector} @@ search_query
+    ORDER BY rank DESC, id
+    LIMIT :limit OFFSET :offset
+""".format(vector=SEARCH_VECTOR_SQL))
+
+POSTGRES_COUNT = text("""
+    SELECT count(*)
+    FROM questions, plainto_tsquery('english', :term) AS search_query
+    WHERE {vector} @@ search_query
+""".format(vector=SEARCH_VECTOR_SQL))
+
+def tokenize(value):
+    return TOKEN_PATTERN.findall((value or "").lower())
+
+"""
+InvertedIndex
+    token -> {question_id: weight} postings for databases without full-text search.
+    A query matches questions containing every token and is ranked by tf-idf.
+"""
+class InvertedIndex:
+
+    def __init__(self):
+        self._postings = {}
+        self._documents = {}
+        self._built = False
+        # re-entrant: an autoflush while building fires the mapper events below
+        self._lock = threading.RLock()
+
+    @property
+    def built(self):
+        return self._built
+
+    def load(self, rows):
+        # rows of (id, question, answer) covering the whole table
+        with self._lock:
+            if self._built:
+                return
+            for question_id, question, answer in rows:
+                self._add(question_id, question, answer)
+            self._built = True
+
+    def _build(self):
+        if not self._built:
+            with self._lock:
+                self.load(db.session.query(Question.id, Question.question, Question.answer))
+
+    def _add(self, question_id, question, answer):
+        self._remove(question_id)
+
+        weights = {}
+        for token in tokenize(question):
+            weights[token] = weights.get(token, 0) + QUESTION_WEIGHT
+        for token in tokenize(answer):
+            weights[token] = weights.get(token, 0) + ANSWER_WEIGHT
+
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[question_id] = weight
+        self._documents[question_id] = tuple(weights)
+
+    def _remove(self, question_id):
+        for token in self._documents.pop(question_id, ()):
+            postings = self._postings[token]
+            postings.pop(question_id, None)
+            if not postings:
+                del self._postings[token]
+
+    def add(self, question_id, question, answer):
+        # before the first search there is nothing to maintain, _build() reads everything
+        with self._lock:
+            if self._built:
+                self._add(question_id, question, answer)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._built:
+                self._remove(question_id)
+
+    def reset(self):
+        # dropped wholesale after writes that bypass the ORM, rebuilt on the next search
+        with self._lock:
+            self._postings = {}
+            self._documents = {}
+            self._built = False
+
+    def search(self, term):
+        """
+        search(term)
+            returns a list of (question_id, rank) pairs, best match first
+        """
+        tokens = set(tokenize(term))
+        if not tokens:
+            return []
+
+        self._build()
+        with self._lock:
+            postings = [self._postings.get(token) for token in tokens]
+            if not all(postings):
+                return []
+
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            total_documents = len(self._documents)
+            ranks = {
+                question_id: sum(
+                    posting[question_id] * math.log(1 + total_documents / len(posting))
+                    for posting in postings
+                )
+                for question_id in candidates
+            }
+
+        return sorted(ranks.items(), key=lambda hit: (-hit[1], hit[0]))
+
+def _fallback_index():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("question_search")
+
+@event.listens_for(Question, "after_insert")
+@event.listens_for(Question, "after_update")
+def _index_question(mapper, connection, target):
+    index = _fallback_index()
+    if index is not None:
+        index.add(target.id, target.question, target.answer)
+
+@event.listens_for(Question, "after_delete")
+def _unindex_question(mapper, connection, target):
+    index = _fallback_index()
+    if index is not None:
+        index.remove(target.id)
+
+def reset_search_index():
+    index = _fallback_index()
+    if index is not None:
+        index.reset()
+
+def setup_search(app):
+    """
+    setup_search(app)
+        attaches an in-memory index to the app unless the database is Postgres
+    """
+    with app.app_context():
+        if db.engine.dialect.name == "postgresql":
+            app.extensions["question_search"] = None
+        else:
+            app.extensions["question_search"] = InvertedIndex()
+
+def search_rows_to_questions(rows):
+    return [
+        {
+            "id": row["id"],
+            "question": row["question"],
+            "answer": row["answer"],
+            "category": row["category"],
+            "difficulty": row["difficulty"],
+            "rank": round(row["rank"], 4),
+        }
+        for row in rows
+    ]
+
+def page_of_hits(hits, page):
+    # {question_id: rank} for one page of the (question_id, rank) hits
+    offset = (page - 1) * QUESTIONS_PER_PAGE
+    return dict(hits[offset:offset + QUESTIONS_PER_PAGE])
+
+def rank_questions(rows, ranks):
+    # rows selected with QUESTION_COLUMNS for the question ids in ranks
+    current_questions = format_rows(rows)
+    for question in current_questions:
+        question["rank"] = round(ranks[question["id"]], 4)
+    current_questions.sort(key=lambda question: (-question["rank"], question["id"]))
+    return current_questions
+
+def ranked_search(term, page):
+    """
+    ranked_search(term, page)
+        returns (current_questions, total_questions) for one page of ranked hits;
+        each question dict carries its `rank`
+    """
+    offset = (page - 1) * QUESTIONS_PER_PAGE
+    index = _fallback_index()
+
+    if index is None:
+        rows = db.session.execute(
+            POSTGRES_SEARCH, {"term": term, "limit": QUESTIONS_PER_PAGE, "offset": offset}
+        ).mappings().all()
+        if rows:
+            total = rows[0]["total"]
+        elif offset:
+            # paged past the last hit, so the window count is not available
+            total = db.session.execute(POSTGRES_COUNT, {"term": term}).scalar()
+        else:
+            total = 0
+        return search_rows_to_questions(rows), total
+
+    hits = index.search(term)
+    ranks = page_of_hits(hits, page)
+    rows = db.session.query(*QUESTION_COLUMNS).filter(Question.id.in_(ranks)).all() if ranks else []
+    return rank_questions(rows, ranks), len(hits)
@@ -0,0 +1,63 @@
+"""
+Question totals read from the question_counts table.
+
+The table holds one row per (category, difficulty) and is kept current by database
+triggers (see migrations.py), so a total is a SUM over a handful of rows instead of a
+count over the questions table. Filtered listings, like the ilike search, still count
+their own selection with pagination.count_questions.
+"""
+from sqlalchemy import func, select
+
+from models import db, QuestionCount
+
+def total_selection(category_id=None):
+    """
+    total_selection(category_id)
+        SELECT of the number of questions in the category, or in the whole bank when
+        category_id is None; shared with the ASGI app
+    """
+    selection = select(func.coalesce(func.sum(QuestionCount.total), 0))
+    if category_id is not None:
+        selection = selection.where(QuestionCount.category == category_id)
+    return selection
+
+def counts_selection():
+    return select(QuestionCount.category, QuestionCount.difficulty, QuestionCount.total).where(
+        QuestionCount.total > 0).order_by(QuestionCount.category, QuestionCount.difficulty)
+
+def total_questions(category_id=None):
+    return db.session.scalar(total_selection(category_id))
+
+def format_stats(rows, categories):
+    """
+    format_stats(rows, categories)
+        the GET /stats body from (category, difficulty, total) rows and the {id: type}
+        categories; every category is listed, empty ones with a total of 0
+    """
+    by_category = {
+        category_id: {"type": category_type, "total_questions": 0, "difficulties": {}}
+        for category_id, category_type in categories.items()
+    }
+    difficulties = {}
+    total = uncategorized = 0
+
+    for category_id, difficulty, count in rows:
+        total += count
+        difficulties[difficulty] = difficulties.get(difficulty, 0) + count
+        if category_id not in by_category:
+            # NULL category, or one deleted from a database without foreign keys
+            uncategorized += count
+            continue
+        by_category[category_id]["total_questions"] += count
+        by_category[category_id]["difficulties"][difficulty] = count
+
+    return {
+        "success": True,
+        "total_questions": total,
+        "categories": by_category,
+        "difficulties": difficulties,
+        "uncategorized": uncategorized
+    }
+
+def question_stats(categories):
+    return format_stats(db.session.execute(counts_selection()).all(), categories)
@@ -0,0 +1,73 @@
+"""
+Cache warm-up for preforking servers, see wsgi.py and gunicorn.conf.py.
+
+warm_caches loads what the first requests of every worker would otherwise load on their
+own: the category registry, the per-(category, difficulty) question id pools, the
+near-duplicate index, the leaderboards and, without Postgres, the search index. Done once
+in the master before it forks, the workers start with the same memory shared
+copy-on-write instead of N cold copies.
+"""
+import os
+import resource
+import time
+
+from metrics import Gauge
+from models import db, Question, category_registry
+from .duplicates import sync_index
+
+def process_rss_bytes():
+    # resident set size of this process, from /proc where available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is the peak, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# seconds from fork (or process start) until the worker could serve, set by gunicorn.conf.py
+worker_startup = {"seconds": None}
+
+Gauge("process_resident_memory_bytes", "Resident memory of the process serving the scrape", process_rss_bytes)
+Gauge("worker_startup_seconds", "Time the serving worker took to start", lambda: worker_startup["seconds"])
+
+def warm_caches(app):
+    """
+    warm_caches(app)
+        loads the in-process caches and returns the seconds each one took
+    """
+    timings = {}
+    with app.app_context():
+        started = time.perf_counter()
+        category_registry.all()
+        timings["categories"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        app.extensions["quiz_pools"].current()
+        timings["quiz_pools"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        sync_index(app.extensions["question_duplicates"])
+        timings["duplicates"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        app.extensions["leaderboards"].top()
+        timings["leaderboards"] = time.perf_counter() - started
+
+        index = app.extensions.get("question_search")
+        if index is not None:
+            started = time.perf_counter()
+            index.load(db.session.query(Question.id, Question.question, Question.answer))
+            timings["search_index"] = time.perf_counter() - started
+
+        db.session.remove()
+    return timings
+
+def dispose_engines(app):
+    """
+    dispose_engines(app)
+        drops the pooled connections inherited from the master, without closing them
+        under its feet; call in every freshly forked worker
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,66 @@
+"""
+gunicorn settings for the Flask app, see wsgi.py.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+WEB_CONCURRENCY workers (default: one per core) are forked from a master that has already
+migrated the schema and warmed the caches. kill -HUP <master> replaces the workers one
+by one, letting in-flight requests finish within GRACEFUL_TIMEOUT seconds; since the app
+is preloaded, deploying new code takes a new master (kill -USR2, then -TERM the old one).
+Every worker logs its startup time and resident memory once it is ready, and the master
+warns when RESPONSE_CACHE=memory leaves each of several workers its own response cache.
+Quiz sessions in QUIZ_SESSION_STORE=memory only exist in the worker that started them, so
+the master refuses to start several workers with it, unless ALLOW_MEMORY_QUIZ_SESSIONS=true
+says no client plays through sessions (the startup benchmark, for one).
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+from flaskr.warmup import process_rss_bytes, worker_startup, dispose_engines
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# the app is thread-safe; threads let one worker overlap requests waiting on the database
+worker_class = "gthread"
+threads = int(os.getenv("THREADS", 4))
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+max_requests = int(os.getenv("MAX_REQUESTS", 0))  # recycle workers after this many requests, 0 = never
+max_requests_jitter = max_requests // 10
+quiz_session_store = os.getenv("QUIZ_SESSION_STORE", "memory")
+allow_memory_quiz_sessions = os.getenv("ALLOW_MEMORY_QUIZ_SESSIONS", "false").lower() == "true"
+
+def _mib(size):
+    return size / (1024 * 1024)
+
+def on_starting(server):
+    if workers > 1 and quiz_session_store == "memory" and not allow_memory_quiz_sessions:
+        # the next turn of a session would land on another worker 1 - 1/workers of the time, and 404
+        server.log.error("QUIZ_SESSION_STORE=memory keeps quiz sessions inside one of the %d workers; "
+                         "set QUIZ_SESSION_STORE to a redis:// URL or WEB_CONCURRENCY=1", workers)
+        sys.exit(1)
+
+def when_ready(server):
+    if workers > 1 and os.getenv("RESPONSE_CACHE", "memory") == "memory":
+        # still correct, the version comes from the database, but every worker renders and keeps its own copy
+        server.log.warning("RESPONSE_CACHE=memory gives each of the %d workers its own response cache; "
+                           "set RESPONSE_CACHE to a redis:// URL to share it", workers)
+    wsgi = sys.modules.get("wsgi")
+    if wsgi is not None:
+        server.log.info("app preloaded in %.3fs (caches %s), master rss %.1f MiB", wsgi.startup_seconds,
+                        {name: round(seconds, 3) for name, seconds in wsgi.cache_seconds.items()},
+                        _mib(process_rss_bytes()))
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+    wsgi = sys.modules.get("wsgi")
+    if wsgi is not None:
+        dispose_engines(wsgi.app)
+
+def post_worker_init(worker):
+    worker_startup["seconds"] = time.perf_counter() - worker.forked_at
+    worker.log.info("worker %s ready in %.3fs, rss %.1f MiB", worker.pid, worker_startup["seconds"],
+                    _mib(process_rss_bytes()))
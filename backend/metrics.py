@@ -0,0 +1,103 @@
+"""
+Minimal Prometheus-style metrics, rendered in the text exposition format at /metrics.
+
+Counters and histograms are kept in process memory; gauges are read from a callback at
+render time. Every metric registers itself in REGISTRY when it is created.
+"""
+import threading
+
+REGISTRY = []
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in pairs) + "}"
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(label, "") for label in self.labels), 0)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name)]
+        for key, value in sorted(self._values.items()):
+            lines.append("{}{} {}".format(self.name, _format_labels(self.labels, key), value))
+        return lines
+
+class Gauge:
+
+    def __init__(self, name, help, read):
+        # read() returns the current value, or None when it is not available
+        self.name = name
+        self.help = help
+        self.read = read
+        REGISTRY.append(self)
+
+    def render(self):
+        value = self.read()
+        if value is None:
+            return []
+        return ["# HELP {} {}".format(self.name, self.help), "# TYPE {} gauge".format(self.name),
+                "{} {}".format(self.name, value)]
+
+class Histogram:
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[position] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels.get(label, "") for label in self.labels))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, observed in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += observed
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _format_labels(self.labels, key, [("le", bound)]), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, _format_labels(self.labels, key), round(series[-1], 6)))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(self.labels, key), cumulative))
+        return lines
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,330 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, in order, inside its own transaction, and the number of the
+last one applied is kept in the single-row `schema_version` table. On startup setup_db
+only reads that row; the schema is not introspected with db.create_all() on every boot.
+To change the schema, append a new migration to MIGRATIONS; never edit an applied one.
+"""
+import hashlib
+import re
+import unicodedata
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+# the search WHERE clause must repeat this expression verbatim for Postgres to use the index
+SEARCH_VECTOR_SQL = (
+    "(setweight(to_tsvector('english', coalesce(question, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(answer, '')), 'B'))"
+)
+
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+def normalize_text(value):
+    # case, accents composed the same way, punctuation and spacing do not tell questions apart
+    value = unicodedata.normalize("NFKC", value or "").casefold()
+    return NON_WORD_PATTERN.sub(" ", value).strip()
+
+def question_hash(question):
+    """
+    question_hash(question)
+        the questions.question_hash of a question text, None for one without any words.
+        Stored hashes are compared with new ones, so changing the normalization takes a
+        migration that recomputes them.
+    """
+    normalized = normalize_text(question)
+    return hashlib.sha1(normalized.encode()).hexdigest() if normalized else None
+
+def _execute(connection, *statements):
+    for statement in statements:
+        connection.execute(text(statement))
+
+def _initial_schema(connection):
+    # the shape of the tables in trivia.psql, for databases that start out empty
+    primary_key = "SERIAL PRIMARY KEY" if connection.dialect.name == "postgresql" else "INTEGER PRIMARY KEY"
+    _execute(
+        connection,
+        "CREATE TABLE IF NOT EXISTS categories (id {}, type TEXT)".format(primary_key),
+        "CREATE TABLE IF NOT EXISTS questions (id {}, question TEXT, answer TEXT, "
+        "difficulty INTEGER, category INTEGER)".format(primary_key),
+    )
+
+def _indexed_category_foreign_key(connection):
+    has_foreign_key = any(
+        foreign_key["constrained_columns"] == ["category"]
+        for foreign_key in inspect(connection).get_foreign_keys("questions")
+    )
+
+    if connection.dialect.name == "postgresql":
+        _execute(
+            connection,
+            "ALTER TABLE questions ALTER COLUMN category TYPE integer USING category::integer",
+            "CREATE INDEX IF NOT EXISTS ix_questions_category ON questions (category)",
+            "CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON questions (difficulty)",
+        )
+        if not has_foreign_key:
+            # NOT VALID keeps any existing orphaned rows, new writes are checked
+            _execute(
+                connection,
+                "ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY (category) "
+                "REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL NOT VALID",
+            )
+        return
+
+    # SQLite cannot alter a column or add a constraint in place, so the table is rebuilt
+    _execute(
+        connection,
+        "CREATE TABLE questions_migrated (id INTEGER PRIMARY KEY, question TEXT, answer TEXT, "
+        "difficulty INTEGER, category INTEGER "
+        "REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL)",
+        "INSERT INTO questions_migrated (id, question, answer, difficulty, category) "
+        "SELECT id, question, answer, difficulty, CAST(category AS INTEGER) FROM questions",
+        "DROP TABLE questions",
+        "ALTER TABLE questions_migrated RENAME TO questions",
+        "CREATE INDEX ix_questions_category ON questions (category)",
+        "CREATE INDEX ix_questions_difficulty ON questions (difficulty)",
+    )
+
+def _search_indexes(connection):
+    # full-text and trigram indexes used by flaskr/search.py, Postgres only
+    if connection.dialect.name != "postgresql":
+        return
+    _execute(
+        connection,
+        "CREATE INDEX IF NOT EXISTS ix_questions_search ON questions USING GIN ({})".format(SEARCH_VECTOR_SQL),
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions USING GIN (question gin_trgm_ops)",
+    )
+
+def _question_counts(connection):
+    # question totals per (category, difficulty), kept current by triggers on questions so
+    # that every writer (ORM, bulk import, other processes) updates them; a NULL category
+    # or difficulty is counted under 0
+    _execute(
+        connection,
+        "CREATE TABLE question_counts (category INTEGER NOT NULL, difficulty INTEGER NOT NULL, "
+        "total INTEGER NOT NULL, PRIMARY KEY (category, difficulty))",
+        "INSERT INTO question_counts (category, difficulty, total) "
+        "SELECT coalesce(category, 0), coalesce(difficulty, 0), count(*) FROM questions "
+        "GROUP BY coalesce(category, 0), coalesce(difficulty, 0)",
+    )
+
+    if connection.dialect.name == "postgresql":
+        _execute(
+            connection,
+            """CREATE OR REPLACE FUNCTION question_counts_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'TRUNCATE' THEN
+                    DELETE FROM question_counts;
+                    RETURN NULL;
+                END IF;
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    UPDATE question_counts SET total = total - 1
+                    WHERE category = coalesce(OLD.category, 0) AND difficulty = coalesce(OLD.difficulty, 0);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO question_counts (category, difficulty, total)
+                    VALUES (coalesce(NEW.category, 0), coalesce(NEW.difficulty, 0), 1)
+                    ON CONFLICT (category, difficulty) DO UPDATE SET total = question_counts.total + 1;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql""",
+            "CREATE TRIGGER question_counts_rows AFTER INSERT OR DELETE OR UPDATE OF category, difficulty "
+            "ON questions FOR EACH ROW EXECUTE FUNCTION question_counts_trigger()",
+            "CREATE TRIGGER question_counts_truncate AFTER TRUNCATE ON questions "
+            "FOR EACH STATEMENT EXECUTE FUNCTION question_counts_trigger()",
+        )
+        return
+
+    increment = (
+        "INSERT OR IGNORE INTO question_counts (category, difficulty, total) "
+        "VALUES (coalesce(NEW.category, 0), coalesce(NEW.difficulty, 0), 0); "
+        "UPDATE question_counts SET total = total + 1 "
+        "WHERE category = coalesce(NEW.category, 0) AND difficulty = coalesce(NEW.difficulty, 0);"
+    )
+    decrement = (
+        "UPDATE question_counts SET total = total - 1 "
+        "WHERE category = coalesce(OLD.category, 0) AND difficulty = coalesce(OLD.difficulty, 0);"
+    )
+    _execute(
+        connection,
+        "CREATE TRIGGER question_counts_insert AFTER INSERT ON questions BEGIN {} END".format(increment),
+        "CREATE TRIGGER question_counts_delete AFTER DELETE ON questions BEGIN {} END".format(decrement),
+        "CREATE TRIGGER question_counts_update AFTER UPDATE OF category, difficulty ON questions "
+        "BEGIN {} {} END".format(decrement, increment),
+    )
+
+def _question_hashes(connection):
+    # a unique index over the normalized question text, see flaskr/duplicates.py. Of several
+    # existing copies only the first gets its hash; the others keep NULL, which the index
+    # allows, until `flask dedupe-questions` removes them
+    _execute(connection, "ALTER TABLE questions ADD COLUMN question_hash VARCHAR(40)")
+
+    seen, updates = set(), []
+    for question_id, question in connection.execute(text("SELECT id, question FROM questions ORDER BY id")):
+        hash = question_hash(question)
+        if hash is not None and hash not in seen:
+            seen.add(hash)
+            updates.append({"id": question_id, "hash": hash})
+    if updates:
+        connection.execute(text("UPDATE questions SET question_hash = :hash WHERE id = :id"), updates)
+
+    _execute(connection, "CREATE UNIQUE INDEX ix_questions_question_hash ON questions (question_hash)")
+
+def _scores(connection):
+    # finished quizzes, see flaskr/scores.py; category 0 is a quiz over all categories, so
+    # the column has no foreign key. Leaderboards read the top rows of each category off
+    # the (category, score) index
+    primary_key = "SERIAL PRIMARY KEY" if connection.dialect.name == "postgresql" else "INTEGER PRIMARY KEY"
+    _execute(
+        connection,
+        "CREATE TABLE scores (id {}, player VARCHAR(64) NOT NULL, category INTEGER NOT NULL, "
+        "score INTEGER NOT NULL, total_questions INTEGER NOT NULL, "
+        "created_at TIMESTAMP NOT NULL)".format(primary_key),
+        "CREATE INDEX ix_scores_category_score ON scores (category, score)",
+    )
+
+def _question_changes(connection):
+    # an ordered log of the writes to questions, for the change feed in flaskr/changes.py.
+    # Like the question counts it is appended by triggers, so that every writer is logged;
+    # question_changes_pruned keeps the highest version `flask prune-question-changes` removed
+    if connection.dialect.name == "postgresql":
+        _execute(
+            connection,
+            "CREATE TABLE question_changes (version SERIAL PRIMARY KEY, op VARCHAR(6) NOT NULL, "
+            "question_id INTEGER NOT NULL)",
+            # one writer at a time until it commits, so versions become visible in order and
+            # a reader that saw version N never gets a lower one later
+            """CREATE OR REPLACE FUNCTION question_changes_lock() RETURNS trigger AS $$
+            BEGIN
+                LOCK TABLE question_changes IN SHARE ROW EXCLUSIVE MODE;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql""",
+            """CREATE OR REPLACE FUNCTION question_changes_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO question_changes (op, question_id) VALUES ('delete', OLD.id);
+                ELSE
+                    INSERT INTO question_changes (op, question_id) VALUES (lower(TG_OP), NEW.id);
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql""",
+            # before the statement touches any row, so writers queue up without holding row locks
+            "CREATE TRIGGER question_changes_lock BEFORE INSERT OR UPDATE OR DELETE ON questions "
+            "FOR EACH STATEMENT EXECUTE FUNCTION question_changes_lock()",
+            "CREATE TRIGGER question_changes_rows AFTER INSERT OR DELETE "
+            "OR UPDATE OF question, answer, category, difficulty ON questions "
+            "FOR EACH ROW EXECUTE FUNCTION question_changes_trigger()",
+        )
+    else:
+        # AUTOINCREMENT, so a version is never reused once pruned; SQLite has a single writer
+        _execute(
+            connection,
+            "CREATE TABLE question_changes (version INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "op VARCHAR(6) NOT NULL, question_id INTEGER NOT NULL)",
+            "CREATE TRIGGER question_changes_insert AFTER INSERT ON questions "
+            "BEGIN INSERT INTO question_changes (op, question_id) VALUES ('insert', NEW.id); END",
+            "CREATE TRIGGER question_changes_delete AFTER DELETE ON questions "
+            "BEGIN INSERT INTO question_changes (op, question_id) VALUES ('delete', OLD.id); END",
+            "CREATE TRIGGER question_changes_update AFTER UPDATE OF question, answer, category, difficulty "
+            "ON questions BEGIN INSERT INTO question_changes (op, question_id) VALUES ('update', NEW.id); END",
+        )
+
+    _execute(
+        connection,
+        "CREATE TABLE question_changes_pruned (version INTEGER PRIMARY KEY)",
+        "INSERT INTO question_changes_pruned (version) VALUES (0)",
+    )
+
+def _question_change_versions(connection):
+    # Postgres only: instead of a table lock that queued every writer of questions from its
+    # first statement until it committed, the row triggers log into question_changes_pending
+    # and a deferred trigger numbers the transaction's events as it commits, under an advisory
+    # lock held only from then until the commit. Versions still become visible in order, and
+    # a reader that saw version N never gets a lower one later. SQLite has a single writer.
+    if connection.dialect.name != "postgresql":
+        return
+    _execute(
+        connection,
+        "DROP TRIGGER question_changes_lock ON questions",
+        "DROP FUNCTION question_changes_lock()",
+        "CREATE TABLE question_changes_pending (seq BIGSERIAL PRIMARY KEY, "
+        "txid BIGINT NOT NULL DEFAULT txid_current(), op VARCHAR(6) NOT NULL, question_id INTEGER NOT NULL)",
+        "CREATE INDEX ix_question_changes_pending_txid ON question_changes_pending (txid)",
+        """CREATE OR REPLACE FUNCTION question_changes_trigger() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO question_changes_pending (op, question_id) VALUES ('delete', OLD.id);
+            ELSE
+                INSERT INTO question_changes_pending (op, question_id) VALUES (lower(TG_OP), NEW.id);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        # fires once per pending row at commit; the first firing moves all of them
+        """CREATE OR REPLACE FUNCTION question_changes_assign() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('trivia.question_changes_assigned', true) = txid_current()::text THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('trivia.question_changes_assigned', txid_current()::text, true);
+            PERFORM pg_advisory_xact_lock(hashtext('question_changes'));
+            WITH moved AS (
+                DELETE FROM question_changes_pending WHERE txid = txid_current() RETURNING seq, op, question_id
+            )
+            INSERT INTO question_changes (op, question_id) SELECT op, question_id FROM moved ORDER BY seq;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        "CREATE CONSTRAINT TRIGGER question_changes_assign AFTER INSERT ON question_changes_pending "
+        "DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION question_changes_assign()",
+    )
+
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "indexed integer foreign key for questions.category, index on difficulty", _indexed_category_foreign_key),
+    (3, "full-text search indexes", _search_indexes),
+    (4, "question counts per category and difficulty", _question_counts),
+    (5, "unique hash of the normalized question text", _question_hashes),
+    (6, "quiz scores", _scores),
+    (7, "change log of the questions table", _question_changes),
+    (8, "question change versions assigned at commit", _question_change_versions),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def current_version(engine):
+    """
+    current_version(engine)
+        returns the number of the last applied migration, 0 for an unversioned database
+    """
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT max(version) FROM schema_version")).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return 0
+
+def upgrade(engine):
+    """
+    upgrade(engine)
+        applies every pending migration and returns the names of the ones applied
+    """
+    version = current_version(engine)
+    applied = []
+
+    for number, name, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as connection:
+            if number == 1:
+                _execute(connection, "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            migration(connection)
+            _execute(connection, "DELETE FROM schema_version")
+            connection.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": number})
+        applied.append(name)
+
+    return applied
@@ -1,7 +1,18 @@
 import os
-from sqlalchemy import Column, String, Integer
+import json
+import time
+import hashlib
+import threading
+from flask import has_app_context
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
 
+import migrations
+from metrics import Gauge, Histogram
+from replicas import RoutingSession, setup_replicas, watch_replicas
+
 # Connect to the database
 # declaring environment variables to use on the db URI below
 DB_USER = os.getenv('DB_USER', 'student')
@@ -11,19 +22,123 @@ DB_NAME = os.getenv('DB_NAME', 'trivia')
 
 DB_PATH = 'postgresql://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
 
-db = SQLAlchemy()
+# connection pool settings, each can also be overridden per app through create_app(test_config=...)
+POOL_DEFAULTS = {
+    'DB_POOL_SIZE': int(os.getenv('DB_POOL_SIZE', 5)),
+    'DB_MAX_OVERFLOW': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+    'DB_POOL_TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 30)),  # seconds to wait for a free connection
+    'DB_POOL_RECYCLE': int(os.getenv('DB_POOL_RECYCLE', 1800)),  # seconds before a connection is replaced
+    'DB_POOL_PRE_PING': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    'DB_STATEMENT_TIMEOUT': int(os.getenv('DB_STATEMENT_TIMEOUT', 0)),  # milliseconds, 0 = no limit (Postgres only)
+}
+
+# seconds a loaded copy of the categories table is served before it is re-read
+CATEGORY_CACHE_TTL = int(os.getenv('CATEGORY_CACHE_TTL', 300))
+
+# reads of read-only requests can be routed to replicas, see replicas.py
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+pool_wait_seconds = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+)
+
+"""
+InstrumentedQueuePool
+    the default QueuePool, timing how long every checkout waits for a connection
+"""
+class InstrumentedQueuePool(QueuePool):
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - started)
+
+def _pool_stat(name):
+    def read():
+        if not has_app_context():
+            return None
+        stat = getattr(db.engine.pool, name, None)
+        return stat() if stat else None
+    return read
+
+Gauge("db_pool_size", "Connections the pool keeps open", _pool_stat("size"))
+Gauge("db_pool_checked_out", "Connections currently checked out of the pool", _pool_stat("checkedout"))
+Gauge("db_pool_checked_in", "Idle connections in the pool", _pool_stat("checkedin"))
+Gauge("db_pool_overflow", "Connections open beyond the pool size", _pool_stat("overflow"))
+
+"""
+engine_options(config, database_path)
+    SQLALCHEMY_ENGINE_OPTIONS built from the DB_POOL_* settings
+"""
+def engine_options(config, database_path):
+    url = make_url(database_path)
+    options = {
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+    }
+
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # in-memory SQLite keeps its single shared connection
+        return options
+
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=config["DB_POOL_SIZE"],
+        max_overflow=config["DB_MAX_OVERFLOW"],
+        pool_timeout=config["DB_POOL_TIMEOUT"],
+    )
+    if url.get_backend_name() == "postgresql" and config["DB_STATEMENT_TIMEOUT"]:
+        options["connect_args"] = {"options": "-c statement_timeout={}".format(config["DB_STATEMENT_TIMEOUT"])}
+    return options
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, with any DB_REPLICAS as extra
+    binds, and applies any pending schema migrations, see migrations.py
 """
 def setup_db(app, database_path=DB_PATH):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    for key, value in POOL_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    # explicit SQLALCHEMY_ENGINE_OPTIONS from the app config win over the DB_POOL_* settings
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(
+        engine_options(app.config, database_path), **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    )
+    setup_replicas(app, lambda uri: engine_options(app.config, uri))
     db.app = app
     db.init_app(app)
     with app.app_context():
-        db.create_all()
+        # replicas are copies of the primary and get its schema through replication
+        migrations.upgrade(db.engine)
+        watch_replicas(app, db.engines)
+    category_registry.invalidate()
+
+"""
+TableVersion
+    a counter bumped after every committed write to a table. Caches key their entries on
+    it, so a write makes every older entry unreachable without tracking what it touched.
+"""
+class TableVersion:
+
+    def __init__(self):
+        self.value = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+        for listener in self._listeners:
+            listener()
+
+    def on_bump(self, listener):
+        self._listeners.append(listener)
+
+questions_version = TableVersion()
 
 """
 Question
@@ -35,8 +150,10 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
-    difficulty = Column(Integer)
+    category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'), index=True)
+    difficulty = Column(Integer, index=True)
+    # sha1 of the normalized question text, see migrations.question_hash and flaskr/duplicates.py
+    question_hash = Column(String(40), index=True, unique=True)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -47,13 +164,16 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        questions_version.bump()
 
     def update(self):
         db.session.commit()
+        questions_version.bump()
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        questions_version.bump()
 
     def format(self):
         return {
@@ -64,6 +184,64 @@ class Question(db.Model):
             'difficulty': self.difficulty
             }
 
+# the columns Question.format() returns, for read paths that select plain rows
+# instead of building a Question object per row
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = [getattr(Question, field) for field in QUESTION_FIELDS]
+
+def format_rows(rows):
+    # rows selected with QUESTION_COLUMNS -> the same dicts as Question.format()
+    return [dict(zip(QUESTION_FIELDS, row)) for row in rows]
+
+"""
+QuestionCount
+    number of questions per (category, difficulty), 0 standing in for NULL. Read only: the
+    rows are maintained by database triggers on questions, see migrations.py
+"""
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, primary_key=True)
+    difficulty = Column(Integer, primary_key=True)
+    total = Column(Integer, nullable=False)
+
+"""
+QuestionChange
+    one inserted, updated or deleted question, see flaskr/changes.py. Read only: the rows
+    are appended by database triggers on questions, see migrations.py
+"""
+class QuestionChange(db.Model):
+    __tablename__ = 'question_changes'
+
+    version = Column(Integer, primary_key=True)
+    op = Column(String(6), nullable=False)
+    question_id = Column(Integer, nullable=False)
+
+"""
+PrunedQuestionChanges
+    single row holding the highest version removed from question_changes
+"""
+class PrunedQuestionChanges(db.Model):
+    __tablename__ = 'question_changes_pruned'
+
+    version = Column(Integer, primary_key=True)
+
+"""
+Score
+    a finished quiz. Rows are written in batches by flaskr/scores.py, not one by one;
+    category 0 is a quiz over all categories
+"""
+class Score(db.Model):
+    __tablename__ = 'scores'
+    __table_args__ = (Index('ix_scores_category_score', 'category', 'score'),)
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String(64), nullable=False)
+    category = Column(Integer, nullable=False)
+    score = Column(Integer, nullable=False)
+    total_questions = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
 """
 Category
 
@@ -82,3 +260,74 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
             }
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        category_registry.invalidate()
+
+    def update(self):
+        db.session.commit()
+        category_registry.invalidate()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        category_registry.invalidate()
+
+"""
+CategoryRegistry
+    in-process copy of the categories table, loaded once and served from memory.
+    It is re-read after `ttl` seconds or as soon as a Category is written; every
+    invalidation bumps `version`.
+"""
+class CategoryRegistry:
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        # (categories, etag, loaded_at), swapped as a whole so readers never see a mix
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _stale(self, snapshot):
+        return snapshot is None or time.monotonic() - snapshot[2] > self.ttl
+
+    def fresh_snapshot(self):
+        # the cached (categories, etag, loaded_at), or None once it has to be re-read
+        snapshot = self._snapshot
+        return None if self._stale(snapshot) else snapshot
+
+    def store(self, categories, version):
+        # categories is a dict of {id: type} read while self.version was `version`;
+        # it is only cached if no write invalidated the registry in the meantime
+        payload = json.dumps(categories, sort_keys=True).encode()
+        snapshot = (categories, hashlib.sha1(payload).hexdigest(), time.monotonic())
+        if version == self.version:
+            self._snapshot = snapshot
+        return snapshot
+
+    def _current(self):
+        snapshot = self.fresh_snapshot()
+        if snapshot is None:
+            with self._lock:
+                snapshot = self.fresh_snapshot()
+                if snapshot is None:
+                    version = self.version
+                    selection = Category.query.order_by(Category.id).all()
+                    snapshot = self.store({category.id: category.type for category in selection}, version)
+        return snapshot
+
+    def all(self):
+        # returns a dict of {id: type}, ordered by id
+        return self._current()[0]
+
+    def etag(self):
+        return self._current()[1]
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self.version += 1
+
+category_registry = CategoryRegistry()
@@ -0,0 +1,187 @@
+"""
+Read-replica routing for db.session.
+
+With DB_REPLICAS set (a comma-separated list of database URIs, or a list in the app
+config), SELECTs issued while serving a read-only request go to the replicas in turn;
+everything else, and every statement outside a request, goes to the primary engine built
+from DB_PATH. A request is read-only when it is a GET or HEAD, or when its view is marked
+with @replica_reads (the POST routes that only read, like quiz picks).
+
+Replicas are checked with a `SELECT 1` at most every DB_REPLICA_HEALTH_INTERVAL seconds
+and dropped from the rotation on a failed check or a lost connection, until the next
+check succeeds. When none is healthy, reads fall back to the primary.
+
+A request reads from a single replica, chosen on its first read, so its queries see one
+state of the data; the response cache uses it to check how far that replica has caught up.
+
+Read-your-writes: once a request writes, its later reads use the primary, and the
+response sets a cookie that keeps the same client on the primary for
+DB_REPLICA_STICKY_SECONDS, longer than the replicas are expected to lag.
+"""
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+from metrics import Counter
+
+REPLICA_DEFAULTS = {
+    'DB_REPLICAS': [uri for uri in os.getenv('DB_REPLICAS', '').split(',') if uri.strip()],
+    'DB_REPLICA_HEALTH_INTERVAL': int(os.getenv('DB_REPLICA_HEALTH_INTERVAL', 10)),  # seconds between checks
+    'DB_REPLICA_STICKY_SECONDS': int(os.getenv('DB_REPLICA_STICKY_SECONDS', 5)),  # primary reads after a write
+}
+
+READ_METHODS = ("GET", "HEAD")
+STICKY_COOKIE = "db_primary_until"
+
+routed_statements = Counter(
+    "db_routed_statements_total", "Statements sent to the primary or to a read replica", labels=("target",))
+
+def replica_reads(view):
+    """
+    replica_reads(view)
+        marks a non-GET view that only reads, so its SELECTs may be served by a replica
+    """
+    view.replica_reads = True
+    return view
+
+def replica_bind_key(number):
+    return "replica_{}".format(number)
+
+"""
+ReplicaRouter
+    round-robin over the healthy replica engines of one app, kept in
+    app.extensions["db_replicas"]
+"""
+class ReplicaRouter:
+
+    def __init__(self, bind_keys, health_interval, sticky_seconds):
+        self.bind_keys = bind_keys
+        self.health_interval = health_interval
+        self.sticky_seconds = sticky_seconds
+        self._next = 0
+        # bind key -> (healthy, checked at)
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def mark_down(self, bind_key):
+        self._health[bind_key] = (False, time.monotonic())
+
+    def _healthy(self, bind_key, engine):
+        healthy, checked_at = self._health.get(bind_key, (None, 0))
+        if healthy is not None and time.monotonic() - checked_at < self.health_interval:
+            return healthy
+
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            healthy = True
+        except Exception as e:
+            current_app.logger.warning("read replica %s failed its health check: %s", bind_key, e)
+            healthy = False
+        self._health[bind_key] = (healthy, time.monotonic())
+        return healthy
+
+    def choose(self, engines):
+        # the next healthy replica engine, or None to use the primary
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.bind_keys)
+        for offset in range(len(self.bind_keys)):
+            bind_key = self.bind_keys[(start + offset) % len(self.bind_keys)]
+            if self._healthy(bind_key, engines[bind_key]):
+                return engines[bind_key]
+        return None
+
+    def request_replica(self, engines):
+        # the replica engine of this request, chosen on its first read; None for the primary
+        if "db_replica" not in g:
+            g.db_replica = self.choose(engines)
+        return g.db_replica
+
+    def read_only_request(self):
+        if not has_request_context() or g.get("db_wrote", False):
+            return False
+        try:
+            if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+                return False
+        except ValueError:
+            pass
+        if request.method in READ_METHODS:
+            return True
+        view = current_app.view_functions.get(request.endpoint)
+        return getattr(view, "replica_reads", False)
+
+def _is_read(clause):
+    if clause is None:
+        return False
+    if getattr(clause, "is_select", False):
+        return True
+    # raw SQL, like the Postgres full-text search
+    return getattr(clause, "is_text", False) and clause.text.lstrip().upper().startswith(("SELECT", "WITH"))
+
+"""
+RoutingSession
+    db.session class sending the reads of read-only requests to a replica
+"""
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            router = current_app.extensions.get("db_replicas")
+            if router is not None and not self._flushing and _is_read(clause) and router.read_only_request():
+                engine = router.request_replica(self._db.engines)
+                if engine is not None:
+                    routed_statements.inc(target="replica")
+                    return engine
+            if not _is_read(clause) or self._flushing:
+                # anything else from this request reads its own writes
+                g.db_wrote = True
+        routed_statements.inc(target="primary")
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def setup_replicas(app, engine_options):
+    """
+    setup_replicas(app, engine_options)
+        adds one SQLALCHEMY_BINDS entry per DB_REPLICAS URI, with the primary's engine
+        options; call before db.init_app
+    """
+    for key, value in REPLICA_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    replicas = app.config["DB_REPLICAS"]
+    if isinstance(replicas, str):
+        replicas = [uri for uri in replicas.split(",") if uri.strip()]
+    if not replicas:
+        app.extensions.pop("db_replicas", None)
+        return
+
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    bind_keys = []
+    for number, uri in enumerate(replicas):
+        bind_keys.append(replica_bind_key(number))
+        binds[bind_keys[-1]] = dict(engine_options(uri), url=uri.strip())
+    app.config["SQLALCHEMY_BINDS"] = binds
+
+    router = ReplicaRouter(bind_keys, app.config["DB_REPLICA_HEALTH_INTERVAL"], app.config["DB_REPLICA_STICKY_SECONDS"])
+    app.extensions["db_replicas"] = router
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get("db_wrote", False) and request.method not in READ_METHODS:
+            response.set_cookie(STICKY_COOKIE, str(time.time() + router.sticky_seconds),
+                                max_age=router.sticky_seconds, httponly=True, samesite="Lax")
+        return response
+
+def watch_replicas(app, engines):
+    # a lost connection takes the replica out of the rotation until its next health check
+    router = app.extensions.get("db_replicas")
+    if router is None:
+        return
+    for bind_key in router.bind_keys:
+        def handle_error(context, bind_key=bind_key):
+            if context.is_disconnect:
+                router.mark_down(bind_key)
+        event.listen(engines[bind_key], "handle_error", handle_error)
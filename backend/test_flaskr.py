@@ -1,9 +1,26 @@
+import gzip
 import os
+import tempfile
+import threading
+import time
 import unittest
+import uuid
 import json
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, insert, text
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.response_cache import SingleFlight
+from flaskr.warmup import warm_caches
+
+try:
+    from starlette.testclient import TestClient
+    from asgi import create_asgi_app
+except ImportError:
+    # the async entry point is optional, see requirements.txt
+    TestClient = None
+import migrations
+from models import db, setup_db, Question, Category, Score
 
 # Connect to the database
 # declaring environment variables to use on the db URI below
@@ -13,6 +30,10 @@ DB_HOST = os.getenv('DB_HOST', '127.0.0.1:5432')
 DB_NAME = os.getenv('DB_NAME', 'trivia_test')
 DATABASE_PATH = 'postgresql://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
 
+def unique_question():
+    # repeated questions are refused, so every inserted one gets its own text
+    return {"question":"Which year did the USA get its first African American president? {}".format(uuid.uuid4().hex),"answer":"2008","difficulty":1,"category":4}
+
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
@@ -26,7 +47,7 @@ class TriviaTestCase(unittest.TestCase):
         #setup_db(self.app, self.database_path)
 
         #setup a new question json object to use in the testcases
-        self.new_question = {"question":"Which year did the USA get its first African American president?","answer":"2008","difficulty":1,"category":4}
+        self.new_question = unique_question()
 
     
     def tearDown(self):
@@ -39,11 +60,23 @@ class TriviaTestCase(unittest.TestCase):
     """
     # testcase 1: test retrieve_questions() == success
     def test_get_paginated_questions(self):
-        pass
+        response = self.client().get("/questions")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data["questions"]), 10)
+        self.assertTrue(data["total_questions"])
+        self.assertTrue(len(data["categories"]))
+        self.assertNotIn("next_cursor", data)
     
     # testcase 2: test retrieve_questions() == failed
     def test_404_requesting_beyond_valid_page(self):
-        pass
+        response = self.client().get("/questions?page=1000")
+        data = json.loads(response.data)
+
+        self.assertEqual(data["error"], 404)
+        self.assertEqual(data["message"], "resource not found")
+        self.assertEqual(data["success"], False)
 
     # testcase 3: test retrieve_categories() == success
     def test_get_all_categories(self):
@@ -180,6 +213,916 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["error"], 400)
 
 
+    #testcase 16: test retrieve_questions() with keyset pagination == success
+    def test_get_questions_with_cursor(self):
+        response = self.client().get("/questions?cursor=")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data["questions"]), 10)
+        self.assertTrue(data["next_cursor"])
+
+        next_response = self.client().get("/questions?cursor={}".format(data["next_cursor"]))
+        next_data = json.loads(next_response.data)
+        first_page_ids = [question["id"] for question in data["questions"]]
+
+        self.assertEqual(next_response.status_code, 200)
+        self.assertTrue(len(next_data["questions"]))
+        self.assertTrue(next_data["questions"][0]["id"] > max(first_page_ids))
+        self.assertEqual(next_data["total_questions"], data["total_questions"])
+
+    #testcase 17: test get_quiz_questions() never repeats a previous question
+    def test_get_quiz_question_skips_previous_questions(self):
+        response = self.client().post("/quizzes", json={"quiz_category":{"type":"Sports", "id":6}, "previous_questions":[10]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["question"]["id"], 11)
+
+    #testcase 18: test get_quiz_questions() ends the game once every question has been played
+    def test_get_quiz_question_when_category_is_exhausted(self):
+        response = self.client().post("/quizzes", json={"quiz_category":{"type":"Sports", "id":6}, "previous_questions":[10, 11]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertNotIn("question", data)
+
+    #testcase 19: test retrieve_categories() answers a matching If-None-Match with 304
+    def test_get_categories_not_modified(self):
+        response = self.client().get("/categories")
+        etag = response.headers["ETag"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("max-age", response.headers["Cache-Control"])
+
+        cached_response = self.client().get("/categories", headers={"If-None-Match": etag})
+
+        self.assertEqual(cached_response.status_code, 304)
+        self.assertEqual(cached_response.data, b"")
+
+    #testcase 20: test search_questions() ranks whole-word matches in the question text
+    def test_full_text_search_with_results(self):
+        response = self.client().post("/questions/search", json={"searchTerm": "title"})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(len(data["questions"]), 1)
+        self.assertEqual(data["total_questions"], 1)
+        self.assertTrue(data["questions"][0]["rank"] > 0)
+
+    #testcase 21: test search_questions() also searches answers
+    def test_full_text_search_matches_answers(self):
+        response = self.client().get("/questions/search?q=scissorhands")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["total_questions"], 1)
+        self.assertEqual(data["questions"][0]["answer"], "Edward Scissorhands")
+
+    #testcase 22: test search_questions() == failed == no search term
+    def test_400_full_text_search_without_term(self):
+        response = self.client().post("/questions/search", json={})
+        data = json.loads(response.data)
+
+        self.assertEqual(data["error"], 400)
+        self.assertEqual(data["success"], False)
+
+    #testcase 23: test bulk_import_questions() inserts valid rows and reports bad ones
+    def test_bulk_import_questions(self):
+        rows = [
+            json.dumps(self.new_question),
+            json.dumps({"question": "", "answer": "empty", "difficulty": 1, "category": 4}),
+            json.dumps({"question": "Which planet is known as the red planet?", "answer": "Mars", "difficulty": 1, "category": 1})
+        ]
+        response = self.client().post("/questions/bulk", data="\n".join(rows), content_type="application/x-ndjson")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["inserted"], 2)
+        self.assertEqual(data["failed"], 1)
+        self.assertEqual(data["errors"][0]["row"], 2)
+        self.assertIn("rows_per_second", data)
+
+    #testcase 24: test bulk_import_questions() with CSV input and an unknown category
+    def test_bulk_import_questions_from_csv(self):
+        rows = "question,answer,category,difficulty\nWho painted the Mona Lisa?,Leonardo da Vinci,2,2\nNo such category?,none,1000,1\n"
+        response = self.client().post("/questions/bulk?format=csv", data=rows)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["inserted"], 1)
+        self.assertEqual(data["failed"], 1)
+        self.assertEqual(data["errors"][0]["error"], "unknown category 1000")
+
+    #testcase 25: test export_questions() streams JSON Lines filtered by category
+    def test_export_questions_by_category(self):
+        response = self.client().get("/questions/export?category=6")
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertTrue(len(rows))
+        self.assertTrue(all(int(row["category"]) == 6 for row in rows))
+
+    #testcase 26: test export_questions() == failed == unknown format, or a filter that is not an integer
+    def test_400_export_questions_unknown_format(self):
+        response = self.client().get("/questions/export?format=xml")
+        data = json.loads(response.data)
+        bad_category = json.loads(self.client().get("/questions/export?category=abc").data)
+        bad_difficulty = json.loads(self.client().get("/questions/export?difficulty=1.5").data)
+
+        self.assertEqual(data["error"], 400)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(bad_category["error"], 400)
+        self.assertEqual(bad_difficulty["error"], 400)
+
+    #testcase 27: test setup_db() brings the schema up to the latest migration
+    def test_schema_is_migrated(self):
+        with self.app.app_context():
+            self.assertEqual(migrations.current_version(db.engine), migrations.SCHEMA_VERSION)
+            self.assertEqual(migrations.upgrade(db.engine), [])
+
+    #testcase 28: test metrics() exposes the connection pool statistics
+    def test_metrics_include_pool_statistics(self):
+        self.client().get("/questions")
+        response = self.client().get("/metrics")
+        body = response.data.decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("db_pool_checked_out", body)
+        self.assertIn("db_pool_checkout_wait_seconds_count", body)
+
+    #testcase 29: test create_app() applies pool settings from test_config
+    def test_pool_settings_from_test_config(self):
+        app = create_app(self.database_path, test_config={"DB_POOL_SIZE": 2, "DB_MAX_OVERFLOW": 1})
+
+        with app.app_context():
+            self.assertEqual(db.engine.pool.size(), 2)
+            self.assertEqual(app.config["SQLALCHEMY_ENGINE_OPTIONS"]["max_overflow"], 1)
+
+    #testcase 30: test request instrumentation records latency and SQL per endpoint
+    def test_metrics_include_request_instrumentation(self):
+        self.client().get("/categories/6/questions")
+        response = self.client().get("/metrics")
+        body = response.data.decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{endpoint="questions_by_category"}', body)
+        self.assertIn('http_request_sql_queries_count{endpoint="questions_by_category"}', body)
+        self.assertIn('http_response_size_bytes_count{endpoint="questions_by_category"}', body)
+
+    #testcase 31: test ?profile=1 returns a cProfile summary when profiling is enabled
+    def test_profile_request(self):
+        app = create_app(self.database_path, test_config={"PROFILING_ENABLED": True})
+        response = app.test_client().get("/questions?profile=1")
+        body = response.data.decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        self.assertIn("sql queries:", body)
+        self.assertIn("retrieve_questions", body)
+
+    #testcase 32: test ?profile=1 is ignored unless profiling is enabled
+    def test_profile_request_disabled_by_default(self):
+        response = self.client().get("/questions?profile=1")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(len(data["questions"]))
+
+    #testcase 33: test quiz sessions serve every question of the category exactly once
+    def test_quiz_session_plays_whole_category(self):
+        response = self.client().post("/quizzes/sessions", json={"quiz_category":{"type":"Sports", "id":6}})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["total_questions"], 2)
+
+        played = []
+        for remaining in (1, 0):
+            next_data = json.loads(self.client().get("/quizzes/sessions/{}/next".format(data["session_id"])).data)
+            self.assertEqual(next_data["remaining"], remaining)
+            played.append(next_data["question"]["id"])
+
+        last_data = json.loads(self.client().get("/quizzes/sessions/{}/next".format(data["session_id"])).data)
+
+        self.assertEqual(sorted(played), [10, 11])
+        self.assertEqual(last_data["success"], True)
+        self.assertNotIn("question", last_data)
+
+    #testcase 34: test quiz sessions == failed == unknown session and empty category
+    def test_quiz_session_errors(self):
+        unknown = json.loads(self.client().get("/quizzes/sessions/nope/next").data)
+        empty = json.loads(self.client().post("/quizzes/sessions", json={"quiz_category":{"type":"Nothing", "id":10}}).data)
+
+        self.assertEqual(unknown["error"], 404)
+        self.assertEqual(empty["error"], 400)
+
+    #testcase 35: test get_quiz_questions() prefetches a batch of distinct unseen questions
+    def test_get_quiz_questions_batch(self):
+        response = self.client().post("/quizzes", json={"quiz_category":{"type":"Science", "id":1}, "previous_questions":[20], "count":5})
+        data = json.loads(response.data)
+        question_ids = [question["id"] for question in data["questions"]]
+        # other tests add Science questions, so the batch is checked against the category as it is now
+        available = json.loads(self.client().get("/categories/1/questions").data)["total_questions"] - 1
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(len(question_ids), min(5, available))
+        self.assertEqual(len(set(question_ids)), len(question_ids))
+        self.assertNotIn(20, question_ids)
+        self.assertTrue(all(question["category"] == 1 for question in data["questions"]))
+
+    #testcase 36: test get_quiz_questions() == failed == invalid batch size
+    def test_400_quiz_with_invalid_count(self):
+        response = self.client().post("/quizzes", json={"quiz_category":{"type":"Science", "id":1}, "previous_questions":[], "count":0})
+        data = json.loads(response.data)
+
+        self.assertEqual(data["error"], 400)
+        self.assertEqual(data["success"], False)
+
+    #testcase 37: test question pages are cached and revalidated with ETags
+    def test_questions_page_etag(self):
+        response = self.client().get("/questions?page=1")
+        etag = response.headers["ETag"]
+        cached_response = self.client().get("/questions?page=1", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cached_response.status_code, 304)
+        self.assertEqual(cached_response.data, b"")
+
+    #testcase 38: test a new question invalidates the cached category page
+    def test_category_page_cache_invalidated_on_insert(self):
+        response = self.client().get("/categories/4/questions")
+        data = json.loads(response.data)
+
+        self.client().post("/questions", json=self.new_question)
+        fresh_response = self.client().get("/categories/4/questions", headers={"If-None-Match": response.headers["ETag"]})
+        fresh_data = json.loads(fresh_response.data)
+
+        self.assertEqual(fresh_response.status_code, 200)
+        self.assertEqual(fresh_data["total_questions"], data["total_questions"] + 1)
+        self.assertNotEqual(fresh_response.headers["ETag"], response.headers["ETag"])
+
+    #testcase 39: test question pages serialize the same fields as Question.format()
+    def test_questions_page_fields(self):
+        response = self.client().get("/questions?page=1")
+        data = json.loads(response.data)
+
+        with self.app.app_context():
+            question = db.session.get(Question, data["questions"][0]["id"])
+            self.assertEqual(data["questions"][0], question.format())
+        self.assertEqual(response.status_code, 200)
+
+    #testcase 40: test stats add up to the question totals of the list endpoints
+    def test_get_stats(self):
+        response = self.client().get("/stats")
+        data = json.loads(response.data)
+        questions_data = json.loads(self.client().get("/questions").data)
+        category_data = json.loads(self.client().get("/categories/1/questions").data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["total_questions"], questions_data["total_questions"])
+        self.assertEqual(data["categories"]["1"]["total_questions"], category_data["total_questions"])
+        self.assertEqual(sum(data["difficulties"].values()), data["total_questions"])
+
+    #testcase 41: test stats follow inserts and deletes
+    def test_stats_follow_writes(self):
+        data = json.loads(self.client().get("/stats").data)
+        created = json.loads(self.client().post("/questions", json=self.new_question).data)
+        inserted_data = json.loads(self.client().get("/stats").data)
+        self.client().delete("/questions/{}".format(created["created_question_id"]))
+        deleted_data = json.loads(self.client().get("/stats").data)
+
+        self.assertEqual(created["total_questions"], data["total_questions"] + 1)
+        self.assertEqual(inserted_data["categories"]["4"]["total_questions"], data["categories"]["4"]["total_questions"] + 1)
+        self.assertEqual(inserted_data["difficulties"]["1"], data["difficulties"]["1"] + 1)
+        self.assertEqual(deleted_data, data)
+
+    #testcase 42: test bulk delete by ids and category in one request
+    def test_bulk_delete_questions(self):
+        created = [json.loads(self.client().post("/questions", json=unique_question()).data) for _ in range(3)]
+        ids = [question["created_question_id"] for question in created]
+        response = self.client().delete("/questions", json={"ids": ids + [4000], "category": 4})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["deleted"], 3)
+        self.assertEqual(data["total_questions"], created[0]["total_questions"] - 1)
+
+    #testcase 43: test bulk update by category and difficulty
+    def test_bulk_update_questions(self):
+        stats = json.loads(self.client().get("/stats").data)
+        response = self.client().patch("/questions", json={"category": 6, "set": {"difficulty": 5}})
+        data = json.loads(response.data)
+        category_data = json.loads(self.client().get("/categories/6/questions").data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["updated"], stats["categories"]["6"]["total_questions"])
+        self.assertTrue(all(question["difficulty"] == 5 for question in category_data["questions"]))
+
+    #testcase 44: test bulk endpoints refuse a body without criteria or with unknown columns
+    def test_400_bulk_questions_without_criteria(self):
+        delete_data = json.loads(self.client().delete("/questions", json={}).data)
+        patch_data = json.loads(self.client().patch("/questions", json={"ids": [2], "set": {"answer": "x"}}).data)
+
+        self.assertEqual(delete_data["error"], 400)
+        self.assertEqual(patch_data["error"], 400)
+        self.assertEqual(patch_data["success"], False)
+
+    #testcase 45: test GET reads go to the replica and a client reads its own writes from the primary
+    def test_read_replica_routing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            replica_path = "sqlite:///" + os.path.join(directory, "replica.db")
+            # an empty replica: the schema without any questions
+            migrations.upgrade(create_engine(replica_path))
+            app = create_app(self.database_path, {"DB_REPLICAS": [replica_path]})
+            client = app.test_client()
+
+            replica_data = json.loads(client.get("/stats").data)
+            created = json.loads(client.post("/questions", json=self.new_question).data)
+            sticky_data = json.loads(client.get("/stats").data)
+            other_client_data = json.loads(app.test_client().get("/stats").data)
+
+        self.assertEqual(replica_data["total_questions"], 0)
+        self.assertTrue(created["total_questions"])
+        self.assertEqual(sticky_data["total_questions"], created["total_questions"])
+        self.assertEqual(other_client_data["total_questions"], 0)
+
+    #testcase 46: test reads fall back to the primary when no replica is healthy
+    def test_unreachable_replica_falls_back_to_primary(self):
+        app = create_app(self.database_path, {"DB_REPLICAS": ["sqlite:////nonexistent/replica.db"]})
+        response = app.test_client().get("/stats")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertTrue(data["total_questions"])
+
+    #testcase 47: test a client over its route limit gets 429 with Retry-After, and it shows in the metrics
+    def test_rate_limited_client(self):
+        app = create_app(self.database_path, {"RATE_LIMITS": {"retrieve_categories": "1/2"}})
+        client = app.test_client()
+        responses = [client.get("/categories") for _ in range(3)]
+        other_route_response = client.get("/questions")
+        metrics = client.get("/metrics").data.decode()
+
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429])
+        self.assertEqual(json.loads(responses[2].data)["error"], 429)
+        self.assertTrue(int(responses[2].headers["Retry-After"]) >= 1)
+        self.assertEqual(other_route_response.status_code, 200)
+        self.assertIn('http_rate_limited_total{endpoint="retrieve_categories"}', metrics)
+
+    #testcase 48: test concurrent identical calls share one in-flight computation
+    def test_single_flight_coalesces_calls(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def render():
+            calls.append(1)
+            release.wait(5)
+            return ("page",)
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do("key", render))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True])
+        self.assertTrue(all(result == ("page",) for result, _ in results))
+
+    #testcase 49: test columnar pages and field selection carry the same values as the default rows
+    def test_get_questions_columnar_with_fields(self):
+        data = json.loads(self.client().get("/questions?page=1").data)
+        columnar_data = json.loads(self.client().get("/questions?page=1&format=columnar&fields=id,question").data)
+        fields_data = json.loads(self.client().get("/questions?page=1&fields=id,answer").data)
+
+        self.assertEqual(columnar_data["questions"]["id"], [question["id"] for question in data["questions"]])
+        self.assertEqual(columnar_data["questions"]["question"], [question["question"] for question in data["questions"]])
+        self.assertEqual(set(columnar_data["questions"]), {"id", "question"})
+        self.assertEqual(fields_data["questions"][0], {"id": data["questions"][0]["id"], "answer": data["questions"][0]["answer"]})
+        self.assertEqual(columnar_data["total_questions"], data["total_questions"])
+
+    #testcase 50: test unknown fields or formats are rejected
+    def test_400_questions_with_unknown_fields(self):
+        fields_data = json.loads(self.client().get("/questions?fields=id,password").data)
+        format_data = json.loads(self.client().get("/categories/1/questions?format=xml").data)
+
+        self.assertEqual(fields_data["error"], 400)
+        self.assertEqual(format_data["error"], 400)
+
+    #testcase 51: test pages are gzip-compressed on request and still revalidate with their ETag
+    def test_questions_page_gzip(self):
+        plain_response = self.client().get("/questions?page=1")
+        response = self.client().get("/questions?page=1", headers={"Accept-Encoding": "gzip"})
+        cached_response = self.client().get("/questions?page=1", headers={
+            "Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]})
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(gzip.decompress(response.data), plain_response.data)
+        self.assertLess(len(response.data), len(plain_response.data))
+        self.assertEqual(cached_response.status_code, 304)
+
+    #testcase 52: test adaptive quizzes aim at a harder question after correct answers and skip played ones
+    def test_get_adaptive_quiz_question(self):
+        body = {"quiz_category": {"type": "click", "id": 0}, "adaptive": True, "previous_questions": [],
+                "recent_answers": [True, True, True, True, True]}
+        response = self.client().post("/quizzes", json=body)
+        data = json.loads(response.data)
+        easy_data = json.loads(self.client().post("/quizzes", json=dict(body, recent_answers=[False] * 5)).data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["target_difficulty"], 5)
+        self.assertEqual(easy_data["target_difficulty"], 1)
+        self.assertTrue(data["question"]["difficulty"] >= easy_data["question"]["difficulty"])
+
+        played_data = json.loads(self.client().post("/quizzes", json=dict(
+            body, quiz_category={"type": "Sports", "id": 6}, previous_questions=[10, 11])).data)
+        self.assertEqual(played_data["success"], True)
+        self.assertNotIn("question", played_data)
+
+    #testcase 53: test adaptive quizzes reject malformed answers
+    def test_400_adaptive_quiz_with_invalid_answers(self):
+        response = self.client().post("/quizzes", json={
+            "quiz_category": {"type": "Science", "id": 1}, "adaptive": True, "recent_answers": "yes"})
+        data = json.loads(response.data)
+
+        self.assertEqual(data["error"], 400)
+        self.assertEqual(data["success"], False)
+
+    #testcase 54: test warm_caches() loads the caches up front and the worker memory shows in the metrics
+    def test_warm_caches_before_serving(self):
+        timings = warm_caches(self.app)
+        metrics = self.client().get("/metrics").data.decode()
+
+        self.assertIn("categories", timings)
+        self.assertIn("quiz_pools", timings)
+        self.assertIsNotNone(self.app.extensions["quiz_pools"].fresh())
+        self.assertIn("process_resident_memory_bytes", metrics)
+
+    #testcase 55: test add_new_question() refuses mistyped fields, exact and near duplicates, and flags near ones on request
+    def test_add_duplicate_question(self):
+        created = json.loads(self.client().post("/questions", json=self.new_question).data)
+        exact = dict(self.new_question, question="  " + self.new_question["question"].upper() + "?!")
+        near = dict(self.new_question, question=self.new_question["question"].replace("Which year did", "What year did"))
+
+        exact_data = json.loads(self.client().post("/questions?duplicates=flag", json=exact).data)
+        near_data = json.loads(self.client().post("/questions", json=near).data)
+        flagged_data = json.loads(self.client().post("/questions?duplicates=flag", json=near).data)
+        # fields of the wrong type are refused before the duplicate check looks at them
+        not_text = json.loads(self.client().post("/questions", json=dict(self.new_question, question=["Which", "year?"])).data)
+        empty = json.loads(self.client().post("/questions", json=dict(self.new_question, answer=" ")).data)
+        not_integer = json.loads(self.client().post("/questions", json=dict(self.new_question, difficulty=True)).data)
+
+        self.assertEqual(exact_data["error"], 409)
+        self.assertEqual(exact_data["duplicate"], {"question_id": created["created_question_id"], "similarity": 1.0, "exact": True})
+        self.assertEqual(near_data["error"], 409)
+        self.assertEqual(near_data["duplicate"]["question_id"], created["created_question_id"])
+        self.assertFalse(near_data["duplicate"]["exact"])
+        self.assertEqual(flagged_data["success"], True)
+        self.assertEqual(flagged_data["duplicate"]["question_id"], created["created_question_id"])
+        self.assertEqual(flagged_data["total_questions"], created["total_questions"] + 1)
+        self.assertEqual(not_text["error"], 400)
+        self.assertEqual(empty["error"], 400)
+        self.assertEqual(not_integer["error"], 400)
+
+    #testcase 56: test bulk_import_questions() rejects duplicates of existing questions and of earlier rows
+    def test_bulk_import_duplicate_questions(self):
+        rows = [
+            json.dumps({"question": "La Giaconda is better known as what?", "answer": "Mona Lisa", "difficulty": 3, "category": 2}),
+            json.dumps(self.new_question),
+            json.dumps(dict(self.new_question, question=self.new_question["question"].lower())),
+            json.dumps(dict(self.new_question, question=self.new_question["question"].replace("Which year", "In which year"))),
+        ]
+        response = self.client().post("/questions/bulk?duplicates=flag", data="\n".join(rows), content_type="application/x-ndjson")
+        data = json.loads(response.data)
+
+        self.assertEqual(data["inserted"], 2)
+        self.assertEqual(data["errors"], [{"row": 1, "error": "duplicate of question 17"}, {"row": 3, "error": "duplicate of row 2"}])
+        self.assertEqual(data["flagged"], 1)
+        self.assertEqual(data["near_duplicates"][0]["row"], 4)
+        self.assertEqual(data["near_duplicates"][0]["row_of_duplicate"], 2)
+
+    #testcase 57: test flask dedupe-questions keeps the oldest copy and fills in missing hashes
+    def test_dedupe_questions_command(self):
+        question = self.new_question["question"]
+        with self.app.app_context():
+            db.session.execute(Question.__table__.insert(), [
+                dict(self.new_question, question_hash=None),
+                dict(self.new_question, question=question.upper(), question_hash=None),
+                dict(self.new_question, question=question.replace("Which year", "In which year"), question_hash=None),
+            ])
+            db.session.commit()
+            ids = [question_id for (question_id,) in db.session.query(Question.id).filter(
+                Question.question.ilike("%" + question[-32:] + "%")).order_by(Question.id)]
+
+        dry_run = self.app.test_cli_runner().invoke(args=["dedupe-questions", "--dry-run"])
+        result = self.app.test_cli_runner().invoke(args=["dedupe-questions"])
+
+        # other tests leave questions behind, so only the lines about this test's rows are checked
+        exact = "question {}: duplicate of question {} (similarity 1.0)".format(ids[1], ids[0])
+        near = "question {}: duplicate of question {} ".format(ids[2], ids[0])
+        for output in (dry_run.output, result.output):
+            self.assertIn(exact, output)
+            self.assertIn(near, output)
+        with self.app.app_context():
+            remaining = db.session.query(Question.id, Question.question_hash).filter(Question.id.in_(ids)).all()
+            self.assertEqual([question_id for question_id, _ in remaining], ids[:1])
+            self.assertEqual(remaining[0][1], migrations.question_hash(question))
+
+    #testcase 58: test add_score() queues scores and retrieve_leaderboard() ranks them once flushed
+    def test_scores_and_leaderboard(self):
+        with self.app.app_context():
+            db.session.query(Score).delete()
+            db.session.commit()
+        player = uuid.uuid4().hex[:8]
+        for score, category in [(4, 1), (5, 1), (5, 0)]:
+            response = self.client().post("/scores", json={
+                "player": player, "score": score, "total_questions": 5, "quiz_category": {"type": "Science", "id": category}})
+            self.assertEqual(json.loads(response.data)["queued"], True)
+
+        self.app.extensions["score_buffer"].flush()
+        science = json.loads(self.client().get("/leaderboard?category=1").data)
+        overall = json.loads(self.client().get("/leaderboard").data)
+        queued = json.loads(self.client().post("/scores", json={
+            "player": player, "score": 3, "total_questions": 5, "quiz_category": {"type": "Science", "id": "1"}}).data)
+
+        self.assertEqual([(entry["rank"], entry["score"]) for entry in science["leaderboard"]], [(1, 5), (2, 4)])
+        self.assertEqual([(entry["score"], entry["category"]) for entry in overall["leaderboard"]], [(5, 1), (5, 0), (4, 1)])
+        self.assertEqual(overall["leaderboard"][0]["player"], player)
+        self.assertEqual(queued["rank"], 3)
+        self.assertIn("scores_flushed_total", self.client().get("/metrics").data.decode())
+
+    #testcase 59: test add_score() and retrieve_leaderboard() reject invalid scores, categories and limits
+    def test_400_invalid_scores_and_leaderboards(self):
+        too_high = self.client().post("/scores", json={
+            "player": "ana", "score": 6, "total_questions": 5, "quiz_category": {"type": "Science", "id": 1}})
+        unknown_category = self.client().post("/scores", json={
+            "player": "ana", "score": 1, "total_questions": 5, "quiz_category": {"type": "Science", "id": 1000}})
+        bad_limit = self.client().get("/leaderboard?limit=0")
+        missing_category = self.client().get("/leaderboard?category=1000")
+
+        self.assertEqual(json.loads(too_high.data)["error"], 400)
+        self.assertEqual(json.loads(unknown_category.data)["error"], 400)
+        self.assertEqual(json.loads(bad_limit.data)["error"], 400)
+        self.assertEqual(json.loads(missing_category.data)["error"], 404)
+        self.assertEqual(len(self.app.extensions["score_buffer"]), 0)
+
+    #testcase 60: test question_changes() returns the inserts and deletes after a version, in order
+    def test_get_question_changes(self):
+        version = json.loads(self.client().get("/questions/changes").data)["version"]
+        kept = json.loads(self.client().post("/questions", json=self.new_question).data)["created_question_id"]
+        removed = json.loads(self.client().post("/questions", json=unique_question()).data)["created_question_id"]
+        self.client().delete("/questions/{}".format(removed))
+
+        data = json.loads(self.client().get("/questions/changes?since={}".format(version)).data)
+        caught_up = json.loads(self.client().get("/questions/changes?since={}".format(data["version"])).data)
+
+        self.assertEqual([(change["op"], change["id"]) for change in data["changes"]],
+                         [("insert", kept), ("insert", removed), ("delete", removed)])
+        self.assertEqual(data["changes"][0]["question"]["question"], self.new_question["question"])
+        self.assertIsNone(data["changes"][1]["question"])
+        self.assertEqual(data["version"], data["changes"][-1]["version"])
+        self.assertEqual(caught_up["changes"], [])
+        self.assertEqual(caught_up["more"], False)
+
+    #testcase 61: test question_changes() streams the changes as Server-Sent Events
+    def test_stream_question_changes(self):
+        self.app.config["QUESTION_CHANGES_STREAM_SECONDS"] = 0
+        version = json.loads(self.client().get("/questions/changes").data)["version"]
+        created = json.loads(self.client().post("/questions", json=self.new_question).data)["created_question_id"]
+
+        response = self.client().get("/questions/changes", headers={"Accept": "text/event-stream", "Last-Event-ID": str(version)})
+        events = response.data.decode().split("\n\n")
+        response.close()
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(events[0], "retry: 1000\nid: {}".format(version))
+        self.assertEqual(json.loads(events[1].split("data: ", 1)[1])["id"], created)
+        self.assertEqual(self.app.extensions["question_changes"].streams, 0)
+
+    #testcase 62: test question_changes() refuses invalid versions and pruned ones
+    def test_410_question_changes_after_pruning(self):
+        for _ in range(2):
+            self.client().post("/questions", json=unique_question())
+
+        result = self.app.test_cli_runner().invoke(args=["prune-question-changes", "--keep", "1"])
+        pruned = json.loads(self.client().get("/questions/changes?since=0").data)
+        invalid = json.loads(self.client().get("/questions/changes?since=-1").data)
+        latest = json.loads(self.client().get("/questions/changes").data)["version"]
+        current = json.loads(self.client().get("/questions/changes?since={}".format(latest - 1)).data)
+
+        self.assertIn("have to reload", result.output)
+        self.assertEqual(pruned["error"], 410)
+        self.assertEqual(invalid["error"], 400)
+        self.assertEqual(len(current["changes"]), 1)
+
+    #testcase 63: test retrieve_questions() == failed == a cursor it did not hand out
+    def test_400_questions_with_invalid_cursor(self):
+        response = self.client().get("/questions?cursor=not-a-cursor")
+        data = json.loads(response.data)
+
+        self.assertEqual(data["error"], 400)
+        self.assertEqual(data["success"], False)
+
+    #testcase 64: test search_questions() and add_new_question() == failed == a search term that is not text
+    def test_400_search_with_non_string_term(self):
+        ranked = json.loads(self.client().post("/questions/search", json={"searchTerm": 5}).data)
+        substring = json.loads(self.client().post("/questions", json={"searchTerm": ["title"]}).data)
+
+        self.assertEqual(ranked["error"], 400)
+        self.assertEqual(substring["error"], 400)
+
+    #testcase 65: test bulk_import_questions() reports fields of the wrong type and input that is not UTF-8
+    def test_bulk_import_questions_with_invalid_types_and_encoding(self):
+        rows = [
+            json.dumps({"question": 5, "answer": "five", "difficulty": 1, "category": 1}),
+            json.dumps(dict(self.new_question, answer=["2008"])),
+            json.dumps(dict(self.new_question, category=True)),
+        ]
+        typed = json.loads(self.client().post("/questions/bulk", data="\n".join(rows), content_type="application/x-ndjson").data)
+        csv_rows = "question,answer,category,difficulty\n{},2008,4,1\n".format(self.new_question["question"]).encode() + b"caf\xe9?,latin-1,4,1\n"
+        encoded = json.loads(self.client().post("/questions/bulk?format=csv", data=csv_rows).data)
+
+        self.assertEqual(typed["inserted"], 0)
+        self.assertEqual([error["error"] for error in typed["errors"]], [
+            "question and answer must be text", "question and answer must be text", "category and difficulty must be integers"])
+        self.assertEqual(encoded["success"], True)
+        self.assertEqual(encoded["failed"], 1)
+        self.assertIn("not UTF-8", encoded["errors"][0]["error"])
+
+    #testcase 66: test get_quiz_questions() == failed == a malformed body or a category that is not an object
+    def test_400_quiz_with_malformed_body(self):
+        malformed = json.loads(self.client().post("/quizzes", data="{not json", content_type="application/json").data)
+        not_object = json.loads(self.client().post("/quizzes", json={"quiz_category": "Science"}).data)
+        bad_previous = json.loads(self.client().post("/quizzes", json={
+            "quiz_category": {"type": "Science", "id": 1}, "previous_questions": "20,21"}).data)
+
+        self.assertEqual(malformed["error"], 400)
+        self.assertEqual(not_object["error"], 400)
+        self.assertEqual(bad_previous["error"], 400)
+
+    #testcase 67: test quiz sessions hold at most `length` questions, and reject a malformed body
+    def test_quiz_session_length(self):
+        response = self.client().post("/quizzes/sessions", json={"quiz_category":{"type":"Science", "id":1}, "length":1})
+        data = json.loads(response.data)
+        first = json.loads(self.client().get("/quizzes/sessions/{}/next".format(data["session_id"])).data)
+        last = json.loads(self.client().get("/quizzes/sessions/{}/next".format(data["session_id"])).data)
+        not_object = json.loads(self.client().post("/quizzes/sessions", json={"quiz_category": "Science"}).data)
+        bad_length = json.loads(self.client().post("/quizzes/sessions", json={"quiz_category":{"type":"Science", "id":1}, "length":0}).data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["total_questions"], 1)
+        self.assertEqual(first["question"]["category"], 1)
+        self.assertEqual(first["remaining"], 0)
+        self.assertNotIn("question", last)
+        self.assertEqual(not_object["error"], 400)
+        self.assertEqual(bad_length["error"], 400)
+
+    #testcase 68: test pages read from a lagging replica are not cached, and a client on the primary skips the cache
+    def test_response_cache_reads_your_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            replica_path = "sqlite:///" + os.path.join(directory, "replica.db")
+            replica = create_engine(replica_path)
+            migrations.upgrade(replica)
+            with replica.begin() as connection:
+                connection.execute(text("INSERT INTO categories (id, type) VALUES (1, 'Science')"))
+                connection.execute(text("INSERT INTO questions (question, answer, category, difficulty) VALUES ('On the replica?', 'Yes', 1, 1)"))
+                # a replica that has not applied any of the primary's changes yet
+                connection.execute(text("DELETE FROM question_changes"))
+            app = create_app(self.database_path, {"DB_REPLICAS": [replica_path]})
+            writer = app.test_client()
+            cache = app.extensions["response_cache"]
+
+            writer.post("/questions", json=self.new_question)
+            lagging = json.loads(app.test_client().get("/questions").data)
+            size_after_lagging = cache.size
+            sticky = json.loads(writer.get("/questions").data)
+            size_after_sticky = cache.size
+
+            with replica.begin() as connection:
+                connection.execute(text("INSERT INTO question_changes (version, op, question_id) VALUES (1000000000, 'insert', 0)"))
+            app.test_client().get("/questions")
+            size_after_caught_up = cache.size
+            replica.dispose()
+
+        self.assertEqual(lagging["total_questions"], 1)
+        self.assertEqual(size_after_lagging, 0)
+        self.assertGreater(sticky["total_questions"], 1)
+        self.assertEqual(size_after_sticky, 0)
+        self.assertGreater(size_after_caught_up, 0)
+
+    #testcase 69: test a write from another process reaches the memory response cache
+    def test_response_cache_sees_other_processes_writes(self):
+        before = json.loads(self.client().get("/questions").data)
+        # written past this process's questions_version, as another worker would
+        other_process = create_engine(self.database_path)
+        with other_process.begin() as connection:
+            connection.execute(text("INSERT INTO questions (question, answer, category, difficulty) VALUES (:question, '2008', 4, 1)"),
+                               {"question": self.new_question["question"]})
+        other_process.dispose()
+        after = json.loads(self.client().get("/questions").data)
+
+        self.assertEqual(after["total_questions"], before["total_questions"] + 1)
+
+    #testcase 70: test get_quiz_questions() takes the category id as sent by the frontend, and refuses other ids
+    def test_quiz_with_string_category_id(self):
+        string_id = json.loads(self.client().post("/quizzes", json={"quiz_category": {"type": "Science", "id": "1"}, "previous_questions": []}).data)
+        not_integer = json.loads(self.client().post("/quizzes", json={"quiz_category": {"type": "Science", "id": "abc"}, "previous_questions": []}).data)
+        boolean = json.loads(self.client().post("/quizzes", json={"quiz_category": {"type": "Science", "id": True}, "previous_questions": []}).data)
+
+        self.assertEqual(string_id["success"], True)
+        self.assertEqual(string_id["question"]["category"], 1)
+        self.assertEqual(string_id["category"]["id"], 1)
+        self.assertEqual(not_integer["error"], 400)
+        self.assertEqual(boolean["error"], 400)
+
+    #testcase 71: test keyset pagination ends on an exactly full last page instead of handing out a cursor to an empty one
+    def test_cursor_on_exactly_full_last_page(self):
+        marker = uuid.uuid4().hex
+        for number in range(11):
+            question = {"question": "Cursor page {} question {} {}".format(marker, number, uuid.uuid4().hex), "answer": "page", "difficulty": 1, "category": 1}
+            self.assertEqual(json.loads(self.client().post("/questions", json=question).data)["success"], True)
+            if number == 9:
+                full = json.loads(self.client().post("/questions?cursor=", json={"searchTerm": marker}).data)
+
+        first = json.loads(self.client().post("/questions?cursor=", json={"searchTerm": marker}).data)
+        last = json.loads(self.client().post("/questions?cursor={}".format(first["next_cursor"]), json={"searchTerm": marker}).data)
+
+        self.assertEqual(len(full["questions"]), 10)
+        self.assertIsNone(full["next_cursor"])
+        self.assertEqual(len(first["questions"]), 10)
+        self.assertTrue(first["next_cursor"])
+        self.assertEqual(len(last["questions"]), 1)
+        self.assertTrue(last["questions"][0]["id"] > first["questions"][-1]["id"])
+        self.assertIsNone(last["next_cursor"])
+
+    #testcase 72: test adaptive quiz pools load from the primary and catch up on writes without being rebuilt
+    def test_adaptive_quiz_pools_follow_changes(self):
+        body = {"quiz_category": {"type": "click", "id": 0}, "adaptive": True, "previous_questions": [], "recent_answers": []}
+        with tempfile.TemporaryDirectory() as directory:
+            replica_path = "sqlite:///" + os.path.join(directory, "replica.db")
+            replica = create_engine(replica_path)
+            migrations.upgrade(replica)
+            with replica.begin() as connection:
+                connection.execute(text("INSERT INTO questions (question, answer, category, difficulty) VALUES ('On the replica?', 'Yes', 1, 1)"))
+            app = create_app(self.database_path, {"DB_REPLICAS": [replica_path]})
+            pools = app.extensions["quiz_pools"]
+
+            app.test_client().post("/quizzes", json=body)
+            loaded = pools.fresh()
+            created = json.loads(app.test_client().post("/questions", json=self.new_question).data)["created_question_id"]
+            app.test_client().post("/quizzes", json=body)
+            inserted = pools.fresh()
+            app.test_client().delete("/questions/{}".format(created))
+            app.test_client().post("/quizzes", json=body)
+            deleted = pools.fresh()
+            replica.dispose()
+
+        self.assertGreater(sum(len(loaded[(0, difficulty)]) for difficulty in range(1, 6) if (0, difficulty) in loaded), 1)
+        self.assertIn(created, inserted[(4, 1)])
+        self.assertIn(created, inserted[(0, 1)])
+        untouched = [key for key in loaded if key not in ((0, 1), (4, 1))]
+        self.assertTrue(untouched)
+        self.assertTrue(all(inserted[key] is loaded[key] for key in untouched))
+        self.assertNotIn(created, deleted[(4, 1)])
+        self.assertNotIn(created, deleted[(0, 1)])
+
+    #testcase 73: test the leaderboards read no scores when none were written, and pick up a score committed out of order
+    def test_leaderboard_catch_up_reads_only_new_scores(self):
+        leaderboards = self.app.extensions["leaderboards"]
+        player = uuid.uuid4().hex[:8]
+        with self.app.app_context():
+            db.session.query(Score).delete()
+            db.session.commit()
+            leaderboards.top()
+            first_id = leaderboards.last_id + 1
+            scores = [{"id": first_id + offset, "player": player, "category": 1, "score": score, "total_questions": 5,
+                       "created_at": datetime(2024, 1, 1)} for offset, score in ((1, 3), (0, 5))]
+
+            # the higher id commits first, as a concurrent flush would
+            db.session.execute(insert(Score), scores[:1])
+            db.session.commit()
+            leaderboards.invalidate()
+            before_late_commit = [-entry[0] for entry in leaderboards.top(1)]
+            read_from_with_gap = leaderboards.read_from
+            db.session.execute(insert(Score), scores[1:])
+            db.session.commit()
+            leaderboards.invalidate()
+            after_late_commit = [-entry[0] for entry in leaderboards.top(1)]
+            leaderboards.invalidate()
+            leaderboards.top(1)
+            read_from_idle = leaderboards.read_from
+
+            db.session.query(Score).filter(Score.player == player).delete()
+            db.session.commit()
+
+        self.assertEqual(before_late_commit, [3])
+        self.assertEqual(read_from_with_gap, first_id)
+        self.assertEqual(after_late_commit, [5, 3])
+        self.assertEqual(read_from_idle, first_id + 2)
+
+
+class ASGIClient:
+    """Exposes the starlette TestClient through the parts of the Flask test client used above"""
+
+    def __init__(self, app):
+        # entered so that every request runs on one event loop, which the asyncpg pool requires
+        self.client = TestClient(app).__enter__()
+
+    def close(self):
+        self.client.__exit__(None, None, None)
+
+    def _response(self, response):
+        response.data = response.content
+        return response
+
+    def get(self, url, headers=None):
+        return self._response(self.client.get(url, headers=headers))
+
+    def post(self, url, json=None, data=None, content_type=None):
+        headers = {"Content-Type": content_type} if content_type else None
+        return self._response(self.client.post(url, json=json, content=data, headers=headers))
+
+    def delete(self, url):
+        return self._response(self.client.delete(url))
+
+
+@unittest.skipIf(TestClient is None, "starlette is not installed")
+class AsyncTriviaTestCase(unittest.TestCase):
+    """Runs the endpoint tests above against the ASGI app in asgi.py"""
+
+    def setUp(self):
+        self.database_path = DATABASE_PATH
+        self.asgi_client = ASGIClient(create_asgi_app(self.database_path))
+        self.client = lambda: self.asgi_client
+        self.new_question = unique_question()
+
+    def tearDown(self):
+        self.asgi_client.close()
+
+    # testcase 5 deletes a fixed question id, so the async app deletes the question it creates instead
+    def test_delete_created_question(self):
+        created = json.loads(self.client().post("/questions", json=self.new_question).data)
+        response = self.client().delete("/questions/{}".format(created["created_question_id"]))
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["deleted_question"], created["created_question_id"])
+        self.assertTrue(len(data["current_questions"]))
+
+for test_name in [
+    "test_get_paginated_questions",
+    "test_404_requesting_beyond_valid_page",
+    "test_get_all_categories",
+    "test_404_for_bad_url",
+    "test_422_unprocessable_entity_when_deleting_question",
+    "test_add_new_question",
+    "test_400_if_adding_new_question_fails",
+    "test_questions_search_with_results",
+    "test_questions_search_with_no_results",
+    "test_get_questions_by_category",
+    "test_404_wrong_url_get_questions_by_category",
+    "test_get_quiz_questions_by_category_id",
+    "test_400_quiz_without_category_id",
+    "test_get_questions_with_cursor",
+    "test_get_quiz_question_skips_previous_questions",
+    "test_get_quiz_question_when_category_is_exhausted",
+    "test_get_categories_not_modified",
+    "test_full_text_search_with_results",
+    "test_full_text_search_matches_answers",
+    "test_400_full_text_search_without_term",
+    "test_get_quiz_questions_batch",
+    "test_400_quiz_with_invalid_count",
+    "test_get_stats",
+    "test_stats_follow_writes",
+    "test_get_questions_columnar_with_fields",
+    "test_400_questions_with_unknown_fields",
+    "test_get_adaptive_quiz_question",
+    "test_400_adaptive_quiz_with_invalid_answers",
+    "test_add_duplicate_question",
+    "test_400_questions_with_invalid_cursor",
+    "test_400_search_with_non_string_term",
+    "test_400_quiz_with_malformed_body",
+    "test_quiz_with_string_category_id",
+    "test_cursor_on_exactly_full_last_page",
+]:
+    setattr(AsyncTriviaTestCase, test_name, getattr(TriviaTestCase, test_name))
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
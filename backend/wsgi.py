@@ -0,0 +1,27 @@
+"""
+Production WSGI entry point for a preforking server.
+
+Imported once in the master when the server preloads the app (gunicorn.conf.py does):
+create_app applies any pending migrations there, warm_caches loads the in-process caches,
+and gc.freeze() moves everything allocated so far out of the garbage collector's reach,
+so the forked workers keep sharing those pages instead of copying them on the first
+collection.
+
+Serve it from the backend folder:
+    gunicorn -c gunicorn.conf.py wsgi:app
+    DATABASE_URL=sqlite:////tmp/trivia.db gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import gc
+import os
+import time
+
+from flaskr import create_app
+from flaskr.warmup import warm_caches
+
+started = time.perf_counter()
+# a full database URI, instead of the DB_* settings models.py builds one from
+app = create_app(os.getenv("DATABASE_URL", ""))
+cache_seconds = warm_caches(app)
+startup_seconds = time.perf_counter() - started
+
+gc.freeze()
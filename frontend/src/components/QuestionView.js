@@ -4,6 +4,8 @@ import Question from './Question';
 import Search from './Search';
 import $ from 'jquery';
 
+const changesPollInterval = 10000;
+
 class QuestionView extends Component {
   constructor() {
     super();
@@ -13,13 +15,69 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      listing: 'all',
     };
   }
 
   componentDidMount() {
     this.getQuestions();
+    this.watchChanges();
+  }
+
+  componentWillUnmount() {
+    clearTimeout(this.changesTimer);
+    if (this.changesRequest) {
+      this.changesRequest.abort();
+    }
   }
 
+  watchChanges = () => {
+    // asks for the question inserts, updates and deletes since the last poll, so the
+    // list is patched in place instead of refetched; no request is held open in between
+    const since = this.changesVersion === undefined ? '' : `?since=${this.changesVersion}`;
+    this.changesRequest = $.ajax({
+      url: `/questions/changes${since}`,
+      type: 'GET',
+      cache: false,
+      success: (result) => {
+        if (!result.success) {
+          // the changes since our version are gone, reload and start over
+          this.changesVersion = undefined;
+          this.getQuestions();
+        } else {
+          this.applyChanges(result.changes);
+          this.changesVersion = result.version;
+        }
+        this.changesTimer = setTimeout(this.watchChanges, result.more ? 0 : changesPollInterval);
+      },
+      error: (error, status) => {
+        if (status !== 'abort') {
+          this.changesTimer = setTimeout(this.watchChanges, changesPollInterval);
+        }
+      },
+    });
+  };
+
+  applyChanges = (changes) => {
+    let questions = this.state.questions;
+    let totalQuestions = this.state.totalQuestions;
+    changes.forEach((change) => {
+      const index = questions.findIndex((q) => q.id === change.id);
+      if (change.op === 'delete') {
+        if (index !== -1) {
+          questions = questions.filter((q) => q.id !== change.id);
+          totalQuestions -= 1;
+        }
+      } else if (change.question && index !== -1) {
+        questions = [...questions];
+        questions[index] = change.question;
+      } else if (change.op === 'insert' && change.question && this.state.listing === 'all') {
+        totalQuestions += 1;
+      }
+    });
+    this.setState({ questions: questions, totalQuestions: totalQuestions });
+  };
+
   getQuestions = () => {
     $.ajax({
       url: `/questions?page=${this.state.page}`, //TODO: update request URL == DONE
@@ -30,6 +88,7 @@ class QuestionView extends Component {
           totalQuestions: result.total_questions,
           categories: result.categories,
           currentCategory: result.current_category,
+          listing: 'all',
         });
         return;
       },
@@ -72,6 +131,7 @@ class QuestionView extends Component {
           questions: result.questions,
           totalQuestions: result.total_questions,
           currentCategory: result.current_category,
+          listing: 'category',
         });
         return;
       },
@@ -98,6 +158,7 @@ class QuestionView extends Component {
           questions: result.questions,
           totalQuestions: result.total_questions,
           currentCategory: result.current_category,
+          listing: 'search',
         });
         return;
       },
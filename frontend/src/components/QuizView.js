@@ -9,6 +9,7 @@ class QuizView extends Component {
     super();
     this.state = {
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [],
       showAnswer: false,
       categories: {},
@@ -16,6 +17,9 @@ class QuizView extends Component {
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      player: '',
+      scoreSaved: false,
+      scoreRank: null,
     };
   }
 
@@ -34,8 +38,58 @@ class QuizView extends Component {
     });
   }
 
+  componentWillUnmount() {
+    this.endSession();
+  }
+
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    this.setState({ quizCategory: { type, id } }, this.startQuiz);
+  };
+
+  startQuiz = () => {
+    // the server keeps the shuffled questions, each turn only sends the session id
+    $.ajax({
+      url: '/quizzes/sessions',
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        quiz_category: this.state.quizCategory,
+        length: questionsPerPlay,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => {
+        if (!result.session_id) {
+          this.setState({ forceEnd: true });
+          return;
+        }
+        this.setState({ quizSession: result.session_id }, this.getNextQuestion);
+        return;
+      },
+      error: (error) => {
+        alert('Unable to start the quiz. Please try your request again');
+        return;
+      },
+    });
+  };
+
+  endSession = () => {
+    // frees the session on the server instead of leaving it to expire
+    if (!this.state.quizSession) {
+      return;
+    }
+    $.ajax({
+      url: `/quizzes/sessions/${this.state.quizSession}`,
+      type: 'DELETE',
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+    });
+    this.setState({ quizSession: null });
   };
 
   handleChange = (event) => {
@@ -48,20 +102,26 @@ class QuizView extends Component {
       previousQuestions.push(this.state.currentQuestion.id);
     }
 
+    if (previousQuestions.length === questionsPerPlay) {
+      // the quiz is over, no need to ask the session for another question
+      this.setState({ previousQuestions: previousQuestions });
+      this.endSession();
+      return;
+    }
+
     $.ajax({
-      url: '/quizzes', //TODO: update request URL == DONE
-      type: 'POST',
+      url: `/quizzes/sessions/${this.state.quizSession}/next`,
+      type: 'GET',
       dataType: 'json',
-      contentType: 'application/json',
-      data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory,
-      }),
+      cache: false,
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
+        if (!result.question) {
+          this.endSession();
+        }
         this.setState({
           showAnswer: false,
           previousQuestions: previousQuestions,
@@ -87,15 +147,51 @@ class QuizView extends Component {
     });
   };
 
+  saveScore = (event) => {
+    event.preventDefault();
+    $.ajax({
+      url: '/scores',
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        player: this.state.player,
+        score: this.state.numCorrect,
+        total_questions: this.state.previousQuestions.length,
+        quiz_category: this.state.quizCategory,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => {
+        if (!result.success) {
+          alert('Unable to save your score. Please try your request again');
+          return;
+        }
+        this.setState({ scoreSaved: true, scoreRank: result.rank });
+        return;
+      },
+      error: (error) => {
+        alert('Unable to save your score. Please try your request again');
+        return;
+      },
+    });
+  };
+
   restartGame = () => {
+    this.endSession();
     this.setState({
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      scoreSaved: false,
+      scoreRank: null,
     });
   };
 
@@ -132,6 +228,25 @@ class QuizView extends Component {
         <div className='final-header'>
           Your Final Score is {this.state.numCorrect}
         </div>
+        {this.state.scoreSaved ? (
+          <div className='score-saved'>
+            {this.state.scoreRank
+              ? `Saved! You are #${this.state.scoreRank} on the leaderboard`
+              : 'Saved!'}
+          </div>
+        ) : (
+          <form onSubmit={this.saveScore}>
+            <input
+              type='text'
+              name='player'
+              placeholder='Your name'
+              maxLength={64}
+              value={this.state.player}
+              onChange={this.handleChange}
+            />
+            <input className='save-score button' type='submit' value='Save Score' />
+          </form>
+        )}
         <div className='play-again button' onClick={this.restartGame}>
           Play Again?
         </div>